@@ -22,11 +22,38 @@ GPG指纹：A2D0092CEE2E5BA87035600924C3704A8CC26D5F
 ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
 """
 
+import argparse
+import asyncio
+import ctypes
+import ctypes.util
+import filecmp
+import glob
+import hashlib
+import itertools
+import json
+import marshal
+import mmap
+import os
 import re
+import select
+import stat
+import struct
 import sys
-from dataclasses import dataclass
-from typing import List, Optional, Dict, Any
-from enum import Enum, auto
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import asynccontextmanager, contextmanager, suppress
+from array import array
+from bisect import bisect_right
+from collections import deque
+from dataclasses import dataclass, field, fields
+from typing import List, Optional, Dict, Any, Iterable, Iterator, TextIO, Union
+from enum import Enum, IntEnum, auto
+
+try:
+    import re._parser as sre_parse   # Python 3.11+
+except ImportError:
+    import sre_parse
 
 
 # ═══════════════════════════════════════════════════════════════
@@ -40,17 +67,36 @@ class AuditLevel(Enum):
     RED = "🔴 红色"     # 危险，阻断
 
 
+@dataclass
+class AuditFinding:
+    """审计命中"""
+    level: AuditLevel
+    reason: str
+    offset: int     # 字符偏移
+    line: int       # 行号（从1开始）
+    text: str       # 命中的原文
+    rule: int       # 规则序号（越小越优先）
+
+
 @dataclass
 class AuditResult:
     """审计结果"""
     level: AuditLevel
     reason: str
     action: str
+    findings: List[AuditFinding] = field(default_factory=list)
 
 
 class ThreeColorAudit:
     """三色审计系统"""
     
+    # 审计级别对应的处理动作
+    ACTIONS = {
+        AuditLevel.RED: '阻断编译',
+        AuditLevel.YELLOW: '警告但继续',
+        AuditLevel.GREEN: '允许编译',
+    }
+    
     def __init__(self):
         self.rules = {
             AuditLevel.RED: [
@@ -63,41 +109,469 @@ class ThreeColorAudit:
                 (r'\d{15,18}', '可能包含身份证号'),
             ]
         }
+        self.compile_rules()
     
-    def check(self, source_code: str) -> AuditResult:
-        """检查代码内容"""
-        # 红色审计
-        for pattern, reason in self.rules[AuditLevel.RED]:
-            if re.search(pattern, source_code):
-                return AuditResult(
-                    level=AuditLevel.RED,
-                    reason=reason,
-                    action='阻断编译'
-                )
+    def compile_rules(self):
+        """把全部规则编译成一个命名分组正则（修改rules后需重新调用）"""
+        branches = []
+        self.rule_table = []
+        self.rule_patterns = []
+        self.group_rules = {}
         
-        # 黄色审计
-        for pattern, reason in self.rules[AuditLevel.YELLOW]:
-            if re.search(pattern, source_code):
-                return AuditResult(
-                    level=AuditLevel.YELLOW,
-                    reason=reason,
-                    action='警告但继续'
-                )
+        # 红色规则在前，保证同一位置优先命中更严重的规则
+        for level in (AuditLevel.RED, AuditLevel.YELLOW):
+            for pattern, reason in self.rules[level]:
+                name = f'r{len(self.rule_table)}'
+                branches.append(f'(?P<{name}>{pattern})')
+                self.group_rules[name] = len(self.rule_table)
+                self.rule_table.append((level, reason))
+                self.rule_patterns.append(re.compile(pattern))
+        
+        self.pattern = re.compile('|'.join(branches)) if branches else None
+        # 规则表签名：编译缓存键含此签名，规则改变后旧的审计结果不再命中
+        self.signature = repr([
+            (level.name, pattern, reason)
+            for level in (AuditLevel.RED, AuditLevel.YELLOW)
+            for pattern, reason in self.rules[level]
+        ])
+        
+        # 单次命中的最大长度，流式审计据此确定分块重叠量；None表示无上限
+        self.max_width = 0
+        # 各规则的命中都只取决于所在行时，增量审计可以逐行扫描、按行缓存
+        self.line_local = True
+        for pattern, _ in (rule for level in self.rules.values() for rule in level):
+            parsed = sre_parse.parse(pattern)
+            if self.max_width is not None:
+                width = parsed.getwidth()[1]
+                self.max_width = None if width >= sre_parse.MAXREPEAT else max(self.max_width, width)
+            if self.line_local and self.crosses_lines(parsed, parsed.state.flags):
+                self.line_local = False
+    
+    # 含换行符的字符类别
+    NEWLINE_CATEGORIES = frozenset({
+        sre_parse.CATEGORY_SPACE, sre_parse.CATEGORY_NOT_DIGIT, sre_parse.CATEGORY_NOT_WORD,
+    })
+    # 非多行模式的 ^ $ 与 \A \Z：逐行扫描时在每行首尾都成立，与整份扫描不同
+    STRING_ANCHORS = frozenset({sre_parse.AT_BEGINNING_STRING, sre_parse.AT_END_STRING})
+    LINE_ANCHORS = frozenset({sre_parse.AT_BEGINNING, sre_parse.AT_END})
+    REPEATS = frozenset(filter(None, (
+        sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT, getattr(sre_parse, 'POSSESSIVE_REPEAT', None),
+    )))
+    
+    @classmethod
+    def crosses_lines(cls, items, flags: int) -> bool:
+        """解析后的模式能否匹配换行符或依赖行外的内容（含断言中的部分），保守判断"""
+        for op, av in items:
+            if op == sre_parse.LITERAL:
+                found = av == 10
+            elif op == sre_parse.NOT_LITERAL:
+                found = av != 10
+            elif op == sre_parse.ANY:
+                found = bool(flags & sre_parse.SRE_FLAG_DOTALL)
+            elif op == sre_parse.IN:
+                found = cls.class_has_newline(av)
+            elif op == sre_parse.AT:
+                found = av in cls.STRING_ANCHORS or (
+                    av in cls.LINE_ANCHORS and not flags & sre_parse.SRE_FLAG_MULTILINE)
+            elif op == sre_parse.SUBPATTERN:
+                _, add_flags, del_flags, pattern = av
+                found = cls.crosses_lines(pattern, (flags | add_flags) & ~del_flags)
+            elif op == sre_parse.BRANCH:
+                found = any(cls.crosses_lines(branch, flags) for branch in av[1])
+            elif op in cls.REPEATS:
+                found = cls.crosses_lines(av[2], flags)
+            elif op in (sre_parse.ASSERT, sre_parse.ASSERT_NOT):
+                found = cls.crosses_lines(av[1], flags)
+            elif op == sre_parse.GROUPREF_EXISTS:
+                found = any(cls.crosses_lines(branch, flags) for branch in av[1:] if branch is not None)
+            elif op == getattr(sre_parse, 'ATOMIC_GROUP', None):
+                found = cls.crosses_lines(av, flags)
+            else:
+                # 反向引用（所引用的分组已单独判断）、\b 等
+                found = False
+            if found:
+                return True
+        return False
+    
+    @classmethod
+    def class_has_newline(cls, items) -> bool:
+        """字符集 [...] 是否包含换行符"""
+        negate = False
+        found = False
+        for op, av in items:
+            if op == sre_parse.NEGATE:
+                negate = True
+            elif op == sre_parse.LITERAL:
+                found = found or av == 10
+            elif op == sre_parse.RANGE:
+                found = found or av[0] <= 10 <= av[1]
+            elif op == sre_parse.CATEGORY:
+                found = found or av in cls.NEWLINE_CATEGORIES
+        return found != negate
+    
+    def matches(self, text: str, resumes: List[int], limit: Optional[int] = None) -> Iterator[tuple]:
+        """逐个产出命中 (起点, 规则序号, 匹配对象)，按起点、再按规则序号排列
+        
+        结果与每条规则各自 finditer 相同：一条规则的命中不会遮住另一条规则在重叠位置的命中。
+        合并的正则只用来跳到下一个有规则命中的位置；该位置上排在命中分支之后的规则再逐条试配。
+        resumes[规则序号] 为该规则下次命中的最小起点，随命中更新；只报告起点不超过limit的命中。
+        """
+        search = self.pattern.search
+        rule_patterns = self.rule_patterns
+        end = len(text) if limit is None else limit
+        position = min(resumes)
+        while position <= end:
+            match = search(text, position)
+            if match is None or match.start() > end:
+                return
+            start = match.start()
+            first = self.group_rules[match.lastgroup]
+            for rule in range(first, len(rule_patterns)):
+                if resumes[rule] > start:
+                    continue
+                found = match if rule == first else rule_patterns[rule].match(text, start)
+                if found is not None:
+                    resumes[rule] = max(found.end(), start + 1)
+                    yield start, rule, found
+            position = start + 1
+    
+    def scan(self, source_code: str, base_offset: int = 0, base_line: int = 1) -> List[AuditFinding]:
+        """扫描全部命中（含偏移、行号和级别）"""
+        findings = []
+        if self.pattern is None:
+            return findings
+        
+        line = base_line
+        last = 0
+        for start, rule, match in self.matches(source_code, [0] * len(self.rule_table)):
+            line += source_code.count('\n', last, start)
+            last = start
+            level, reason = self.rule_table[rule]
+            findings.append(AuditFinding(level, reason, base_offset + start, line, match.group(), rule))
+        
+        return findings
+    
+    def summarize(self, findings: List[AuditFinding]) -> AuditResult:
+        """按规则优先级汇总命中结果"""
+        if not findings:
+            # 绿色通过
+            return AuditResult(
+                level=AuditLevel.GREEN,
+                reason='内容安全',
+                action=self.ACTIONS[AuditLevel.GREEN]
+            )
         
-        # 绿色通过
+        first = min(findings, key=lambda finding: finding.rule)
         return AuditResult(
-            level=AuditLevel.GREEN,
-            reason='内容安全',
-            action='允许编译'
+            level=first.level,
+            reason=first.reason,
+            action=self.ACTIONS[first.level],
+            findings=findings
         )
+    
+    def check(self, source_code: str) -> AuditResult:
+        """检查代码内容"""
+        return self.summarize(self.scan(source_code))
+    
+    def iter_file(self, path: str, chunk_size: int = 1 << 20,
+                  encoding: str = 'utf-8') -> Iterator[AuditFinding]:
+        """流式审计文件：按固定大小分块解码，内存占用与文件大小无关"""
+        if self.pattern is None:
+            return
+        if self.max_width is None:
+            raise ValueError('审计规则包含无上限长度的模式，无法流式审计')
+        
+        # 多留一个字符给 \b 之类的边界判断
+        overlap = self.max_width + 1
+        buffer = ''
+        base_offset = 0
+        base_line = 1
+        # 各规则下次命中的最小起点（相对缓冲区开头）
+        resumes = [0] * len(self.rule_table)
+        
+        with open(path, 'r', encoding=encoding) as f:
+            while True:
+                chunk = f.read(chunk_size)
+                at_eof = not chunk
+                buffer += chunk
+                
+                # 起点不超过limit的命中不会再受后续数据影响
+                limit = len(buffer) if at_eof else len(buffer) - overlap
+                line = base_line
+                last = 0
+                
+                for start, rule, match in self.matches(buffer, resumes, limit):
+                    line += buffer.count('\n', last, start)
+                    last = start
+                    level, reason = self.rule_table[rule]
+                    yield AuditFinding(level, reason, base_offset + start, line, match.group(), rule)
+                
+                if at_eof:
+                    return
+                
+                # 起点不超过limit的位置都已试过；其后的位置可能只是被块尾截断，与下一块拼接后重试
+                resume = max(0, limit + 1)
+                base_line += buffer.count('\n', 0, resume)
+                base_offset += resume
+                buffer = buffer[resume:]
+                resumes = [max(position - resume, 0) for position in resumes]
+    
+    def check_file(self, path: str, chunk_size: int = 1 << 20,
+                   encoding: str = 'utf-8') -> AuditResult:
+        """流式检查文件内容"""
+        return self.summarize(list(self.iter_file(path, chunk_size, encoding)))
+
+
+class LineTable:
+    """行长度的分块前缀和：按行替换后只更新受影响的块
+    
+    每块记录行数与字符数（每行多计一个换行符）；行首偏移、偏移所在行
+    先在块间二分，再在块内逐行累加，代价与编辑大小和块大小相关，
+    与文件大小基本无关。
+    """
+    
+    # 每块的目标行数；块在 BLOCK/2 到 2*BLOCK 行之间时按键编辑只改计数
+    BLOCK = 256
+    
+    def __init__(self, lines: List[str]):
+        self.lines = lines
+        # 每块的行数、字符数
+        self.counts, self.sizes = self.build(0, len(lines))
+        # 两者的前缀和，按需重算
+        self.line_ends = None
+        self.size_ends = None
+    
+    def build(self, start: int, stop: int) -> tuple:
+        """把行下标 [start, stop) 均分成块（每块不超过 2*BLOCK 行），返回 (行数列表, 字符数列表)"""
+        blocks = max(1, (stop - start) // self.BLOCK)
+        counts, sizes = [], []
+        lines = self.lines
+        begin = start
+        for block in range(1, blocks + 1):
+            end = start + (stop - start) * block // blocks
+            counts.append(end - begin)
+            sizes.append(sum(map(len, lines[begin:end])) + end - begin)
+            begin = end
+        return counts, sizes
+    
+    def line_bounds(self) -> List[int]:
+        """各块末尾的累计行数"""
+        if self.line_ends is None:
+            self.line_ends = list(itertools.accumulate(self.counts))
+        return self.line_ends
+    
+    def size_bounds(self) -> List[int]:
+        """各块末尾的累计字符数"""
+        if self.size_ends is None:
+            self.size_ends = list(itertools.accumulate(self.sizes))
+        return self.size_ends
+    
+    def replace(self, first: int, stop: int, new_lines: List[str]):
+        """把行下标 [first, stop) 替换为 new_lines（原地修改 self.lines）"""
+        lines = self.lines
+        old_size = sum(map(len, lines[first:stop])) + stop - first
+        lines[first:stop] = new_lines
+        new_count = len(new_lines)
+        line_ends = self.line_bounds()
+        low = bisect_right(line_ends, first)
+        high = bisect_right(line_ends, stop - 1)
+        self.size_ends = None
+        
+        if low == high:
+            count = self.counts[low] + new_count - (stop - first)
+            # 编辑落在一块之内且块大小仍合适（最常见的按键编辑）：只调整这一块的计数
+            if 0 < count < 2 * self.BLOCK and (count >= self.BLOCK // 2 or low == len(line_ends) - 1):
+                if count != self.counts[low]:
+                    self.counts[low] = count
+                    self.line_ends = None
+                self.sizes[low] += sum(map(len, new_lines)) + new_count - old_size
+                return
+        
+        # 跨块的编辑，或块过大、过小：重切受影响的块；太小时并入后一块，免得碎块越积越多
+        base = line_ends[low] - self.counts[low]
+        count = line_ends[high] - base - (stop - first) + new_count
+        while count < self.BLOCK // 2 and high + 1 < len(line_ends):
+            high += 1
+            count += self.counts[high]
+        self.counts[low:high + 1], self.sizes[low:high + 1] = self.build(base, base + count)
+        self.line_ends = None
+    
+    def line_start(self, index: int) -> int:
+        """第index行（从0开始）行首的字符偏移"""
+        line_ends, size_ends = self.line_bounds(), self.size_bounds()
+        block = min(bisect_right(line_ends, index), len(line_ends) - 1)
+        base = line_ends[block] - self.counts[block]
+        offset = size_ends[block] - self.sizes[block]
+        return offset + sum(map(len, self.lines[base:index])) + index - base
+    
+    def locate(self, offset: int) -> tuple:
+        """字符偏移 -> (行下标, 列偏移)，均从0开始"""
+        line_ends, size_ends = self.line_bounds(), self.size_bounds()
+        block = min(bisect_right(size_ends, offset), len(size_ends) - 1)
+        column = offset - (size_ends[block] - self.sizes[block])
+        index = line_ends[block] - self.counts[block]
+        stop = index + self.counts[block] - 1
+        lines = self.lines
+        # 列偏移等于行长时落在该行的换行符上
+        while index < stop and column > len(lines[index]):
+            column -= len(lines[index]) + 1
+            index += 1
+        return index, column
+
+
+class IncrementalAudit:
+    """增量审计：按行缓存命中结果，编辑时只重扫受影响的行
+    
+    规则都不跨行时（ThreeColorAudit.line_local，内置规则即是如此），每行的命中
+    只取决于该行内容，以行文本为键缓存即可复用未改动行（以及重复行）的结果；
+    有规则可能跨行匹配时，每次编辑都整份重扫，结果仍与 scan() 相同。
+    审计规则重新编译后，下次编辑或查询时丢弃缓存并整份重扫。
+    """
+    
+    def __init__(self, source: str = '', audit: Optional[ThreeColorAudit] = None,
+                 cache_size: int = 65536):
+        self.audit = audit or ThreeColorAudit()
+        self.cache_size = cache_size
+        self.cache: Dict[str, tuple] = {}
+        # 缓存所对应的审计规则签名
+        self.signature = None
+        self.set_source(source)
+    
+    def set_source(self, source: str):
+        """整体替换文档内容"""
+        self.lines = source.split('\n')
+        self.table = LineTable(self.lines)
+        self.rescan()
+    
+    def rescan(self):
+        """按当前规则重扫整个文档"""
+        if self.audit.signature != self.signature:
+            # 规则变了：按行缓存的结果作废
+            self.cache.clear()
+            self.signature = self.audit.signature
+        if self.audit.line_local:
+            self.line_findings = [self.scan_line(line) for line in self.lines]
+        else:
+            self.line_findings = self.scan_document()
+        self.rule_counts = [0] * len(self.audit.rule_table)
+        for hits in self.line_findings:
+            for _, rule, _ in hits:
+                self.rule_counts[rule] += 1
+    
+    def check_rules(self):
+        """审计规则重新编译过时整份重扫"""
+        if self.audit.signature != self.signature:
+            self.rescan()
+    
+    def scan_document(self) -> List[tuple]:
+        """整份扫描（规则可能跨行时），命中按起始行分组"""
+        line_findings = [[] for _ in self.lines]
+        line_starts = [0, *itertools.accumulate(len(line) + 1 for line in self.lines)]
+        for finding in self.audit.scan('\n'.join(self.lines)):
+            index = finding.line - 1
+            line_findings[index].append((finding.offset - line_starts[index], finding.rule, finding.text))
+        return [tuple(hits) for hits in line_findings]
+    
+    @property
+    def source(self) -> str:
+        """当前文档内容"""
+        return '\n'.join(self.lines)
+    
+    def scan_line(self, line: str) -> tuple:
+        """扫描单行，返回 (列偏移, 规则序号, 原文) 元组，结果按内容缓存"""
+        hits = self.cache.get(line)
+        if hits is None:
+            hits = tuple(
+                (finding.offset, finding.rule, finding.text)
+                for finding in self.audit.scan(line)
+            )
+            if len(self.cache) >= self.cache_size:
+                self.cache.clear()
+            self.cache[line] = hits
+        return hits
+    
+    def edit(self, start_line: int, start_column: int,
+             end_line: int, end_column: int, text: str) -> List[AuditFinding]:
+        """应用一次编辑并返回重扫行上的命中
+        
+        行列号从1开始，与Token一致；结束位置不包含在替换范围内。
+        """
+        self.check_rules()
+        first = start_line - 1
+        last = end_line - 1
+        if not (0 <= first <= last < len(self.lines)):
+            raise ValueError(f'编辑范围越界：行{start_line}-行{end_line}')
+        
+        prefix = self.lines[first][:start_column - 1]
+        suffix = self.lines[last][end_column - 1:]
+        new_lines = (prefix + text + suffix).split('\n')
+        if not self.audit.line_local:
+            self.table.replace(first, last + 1, new_lines)
+            self.rescan()
+            return self.findings_in(first, first + len(new_lines))
+        new_findings = [self.scan_line(line) for line in new_lines]
+        
+        for hits in self.line_findings[first:last + 1]:
+            for _, rule, _ in hits:
+                self.rule_counts[rule] -= 1
+        for hits in new_findings:
+            for _, rule, _ in hits:
+                self.rule_counts[rule] += 1
+        
+        self.table.replace(first, last + 1, new_lines)
+        self.line_findings[first:last + 1] = new_findings
+        
+        return self.findings_in(first, first + len(new_lines))
+    
+    def position(self, offset: int) -> tuple:
+        """字符偏移 -> (行号, 列号)，均从1开始，与 edit() 的参数一致"""
+        index, column = self.table.locate(offset)
+        return index + 1, column + 1
+    
+    def findings_in(self, first: int, stop: int) -> List[AuditFinding]:
+        """行下标 [first, stop) 内的命中"""
+        findings = []
+        offset = None
+        for index in range(first, stop):
+            hits = self.line_findings[index]
+            if not hits:
+                continue
+            if offset is None:
+                # 只有真的有命中时才计算行首偏移
+                offset = self.table.line_start(index)
+                offset_line = index
+            while offset_line < index:
+                offset += len(self.lines[offset_line]) + 1
+                offset_line += 1
+            for column, rule, text in hits:
+                level, reason = self.audit.rule_table[rule]
+                findings.append(AuditFinding(level, reason, offset + column, index + 1, text, rule))
+        return findings
+    
+    def findings(self) -> List[AuditFinding]:
+        """整个文档的全部命中"""
+        self.check_rules()
+        return self.findings_in(0, len(self.lines))
+    
+    def level(self) -> AuditLevel:
+        """当前文档的审计级别（只看各规则计数，不重扫）"""
+        self.check_rules()
+        for rule, count in enumerate(self.rule_counts):
+            if count:
+                return self.audit.rule_table[rule][0]
+        return AuditLevel.GREEN
+    
+    def result(self) -> AuditResult:
+        """汇总当前文档的审计结果"""
+        return self.audit.summarize(self.findings())
 
 
 # ═══════════════════════════════════════════════════════════════
 # 📝 词法分析器（Lexer）
 # ═══════════════════════════════════════════════════════════════
 
-class TokenType(Enum):
-    """Token类型"""
+class TokenType(IntEnum):
+    """Token类型（IntEnum：按整数哈希，解析器的运算符表以它为键查得快）"""
     # 关键字
     KEYWORD = auto()
     IDENTIFIER = auto()
@@ -147,14 +621,164 @@ class TokenType(Enum):
 
 @dataclass
 class Token:
-    """Token"""
+    """Token（只记录起始偏移，行列号经词法分析器共享的LineIndex按需换算）"""
     type: TokenType
     value: Any
-    line: int
-    column: int
+    offset: int
+    lines: Optional['LineIndex'] = field(default=None, repr=False, compare=False)
+    
+    @property
+    def line(self) -> Optional[int]:
+        """行号（从1开始）；不带行索引的token为None"""
+        if self.lines is None:
+            return None
+        return self.lines.line(self.offset)
+    
+    @property
+    def column(self) -> Optional[int]:
+        """列号（从1开始，按字符计）；不带行索引的token为None"""
+        if self.lines is None:
+            return None
+        return self.lines.position(self.offset)[1]
     
     def __repr__(self):
-        return f"Token({self.type.name}, {repr(self.value)}, L{self.line}:C{self.column})"
+        return f"Token({self.type.name}, {repr(self.value)}, @{self.offset})"
+
+
+@dataclass
+class TextEdit:
+    """一次文本编辑：把源码 [start, end) 替换为 text（字符偏移）"""
+    start: int
+    end: int
+    text: str
+    
+    def apply(self, source: str) -> str:
+        """返回编辑后的源码"""
+        return source[:self.start] + self.text + source[self.end:]
+    
+    @property
+    def delta(self) -> int:
+        """编辑后其后内容的偏移变化量"""
+        return len(self.text) - (self.end - self.start)
+
+
+class LineIndex:
+    """行首偏移索引：第一次查询行列号时才构建，用二分查找把偏移换算成行列号"""
+    
+    def __init__(self, source: Union[str, bytes, memoryview, 'mmap.mmap']):
+        self.reset(source)
+    
+    def reset(self, source: Union[str, bytes, memoryview, 'mmap.mmap']):
+        """源码改变后调用（共享此索引的token随之按新源码换算）"""
+        self.source = source
+        self.line_starts = None
+    
+    def starts(self) -> List[int]:
+        """各行行首偏移"""
+        if self.line_starts is None:
+            newline = '\n' if isinstance(self.source, str) else b'\n'
+            self.line_starts = [0]
+            self.line_starts.extend(match.end() for match in re.finditer(newline, self.source))
+        return self.line_starts
+    
+    def line(self, offset: int) -> int:
+        """偏移所在行号（从1开始）"""
+        return bisect_right(self.starts(), offset)
+    
+    def position(self, offset: int) -> tuple:
+        """偏移对应的 (行号, 列号)，均从1开始"""
+        line_starts = self.starts()
+        line = bisect_right(line_starts, offset)
+        start = line_starts[line - 1]
+        if isinstance(self.source, str):
+            return line, offset - start + 1
+        # UTF-8字节偏移：列号按字符计
+        return line, len(bytes(self.source[start:offset]).decode('utf-8', 'replace')) + 1
+
+
+def _string_body(close: str) -> str:
+    """字符串内容的正则：普通段与成对的转义序列交替（展开写法，转义多时更快）"""
+    close = re.escape(close)
+    return rf'[^{close}\\]*(?:\\[\s\S]?[^{close}\\]*)*'
+
+
+def _string_pattern(quote: str, close: str, index: int) -> str:
+    """某种引号的字符串正则：内容单独成组，未闭合时一直读到文件末尾"""
+    return rf'(?P<S{index}>{re.escape(quote)}(?P<B{index}>{_string_body(close)}){re.escape(close)}?)'
+
+
+# 主正则：先跳过空白和注释，再匹配一个完整token，分组名即token种类
+TOKEN_PATTERN = re.compile(r'(?:[ \t\r\n]+|#[^\n]*)*(?:' + '|'.join([
+    _string_pattern('"', '"', 0),
+    _string_pattern("'", "'", 1),
+    _string_pattern('「', '」', 2),
+    _string_pattern('『', '』', 3),
+    r'(?P<NUMBER>\d+(?:\.\d*)?)',
+    r'(?P<IDENT>[^\W\d]\w*)',
+    r'(?P<OP>==|!=|>=|<=|&&|\|\||[=+\-*/%><!(){}\[\]【】;,.])',
+    r'(?P<END>\Z)',
+    r'(?P<OTHER>[\s\S])',
+]) + ')')
+
+# 字符串分组 -> 内容分组
+STRING_BODIES = {f'S{index}': f'B{index}' for index in range(4)}
+
+ESCAPE_PATTERN = re.compile(r'\\([\s\S]?)')
+
+# 结束引号 -> 字符串内容正则（内容里的转义成对出现）
+STRING_BODY_PATTERNS = {
+    close: re.compile(_string_body(close))
+    for close in ('"', "'", '」', '』')
+}
+
+IDENT_TAIL_PATTERN = re.compile(r'\w*')
+
+# 十进制数字段（\d 的字符 isdigit() 都为真，其余数字类字符逐个判断）
+DIGITS_PATTERN = re.compile(r'\d*')
+
+
+# ── UTF-8字节层面的主正则（ByteLexer用） ──
+
+# 「」『』【】的UTF-8编码都以 E3 80 开头
+UTF8_SPECIALS = {
+    '「'.encode(): '」'.encode(),
+    '『'.encode(): '』'.encode(),
+    '【'.encode(): None,
+    '】'.encode(): None,
+}
+
+# 一-龥（U+4E00–U+9FA5）的UTF-8编码
+UTF8_CJK = (rb'\xe4[\xb8-\xbf][\x80-\xbf]|[\xe5-\xe8][\x80-\xbf]{2}'
+            rb'|\xe9[\x80-\xbd][\x80-\xbf]|\xe9\xbe[\x80-\xa5]')
+
+
+def _byte_string_pattern(quote: bytes, close: bytes, index: int) -> bytes:
+    """UTF-8字节串中某种引号的字符串正则"""
+    if len(close) == 1:
+        body = rb'(?:[^' + re.escape(close) + rb'\\]+|\\[\s\S]?)*'
+    else:
+        lead, rest = re.escape(close[:1]), re.escape(close[1:])
+        body = rb'(?:[^' + lead + rb'\\]+|' + lead + rb'(?!' + rest + rb')|\\[\s\S]?)*'
+    name = str(index).encode()
+    return (rb'(?P<S' + name + rb'>' + re.escape(quote) + rb'(?P<B' + name + rb'>' + body + rb')'
+            + rb'(?:' + re.escape(close) + rb')?)')
+
+
+BYTE_TOKEN_PATTERN = re.compile(rb'(?:[ \t\r\n]+|#[^\n]*)*(?:' + rb'|'.join([
+    _byte_string_pattern(b'"', b'"', 0),
+    _byte_string_pattern(b"'", b"'", 1),
+    _byte_string_pattern('「'.encode(), '」'.encode(), 2),
+    _byte_string_pattern('『'.encode(), '』'.encode(), 3),
+    rb'(?P<NUMBER>[0-9]+(?:\.[0-9]*)?)',
+    rb'(?P<IDENT>(?:[A-Za-z_]|' + UTF8_CJK + rb')(?:[A-Za-z0-9_]|' + UTF8_CJK + rb')*)',
+    rb'(?P<OP>==|!=|>=|<=|&&|\|\||[=+\-*/%><!(){}\[\];,.]|\xe3\x80[\x90\x91])',
+    rb'(?P<END>\Z)',
+    rb'(?P<SLOW>[\x80-\xff])',
+    rb'(?P<OTHER>[\s\S])',
+]) + rb')')
+
+# 需要解码后交给str词法分析的一段：单词字符、'.'和除引号/方括号外的非ASCII字符
+BYTE_SLOW_RUN_PATTERN = re.compile(rb'(?:[0-9A-Za-z_.]|(?!\xe3\x80[\x8c\x8e\x90\x91])[\x80-\xff])*')
 
 
 class Lexer:
@@ -176,12 +800,64 @@ class Lexer:
         '分配', '释放', '安全检查'
     }
     
+    # 双字符运算符
+    DOUBLE_CHARS = {
+        '==': TokenType.EQ,
+        '!=': TokenType.NEQ,
+        '>=': TokenType.GTE,
+        '<=': TokenType.LTE,
+        '&&': TokenType.LOGICAL_AND,
+        '||': TokenType.LOGICAL_OR,
+    }
+    
+    # 单字符符号
+    SINGLE_CHARS = {
+        '=': TokenType.ASSIGN,
+        '+': TokenType.PLUS,
+        '-': TokenType.MINUS,
+        '*': TokenType.MULTIPLY,
+        '/': TokenType.DIVIDE,
+        '%': TokenType.MODULO,
+        '>': TokenType.GT,
+        '<': TokenType.LT,
+        '!': TokenType.NOT,
+        '(': TokenType.LPAREN,
+        ')': TokenType.RPAREN,
+        '{': TokenType.LBRACE,
+        '}': TokenType.RBRACE,
+        '[': TokenType.LBRACKET,
+        ']': TokenType.RBRACKET,
+        '【': TokenType.LBRACKET,
+        '】': TokenType.RBRACKET,
+        ';': TokenType.SEMICOLON,
+        ',': TokenType.COMMA,
+        '.': TokenType.DOT,
+    }
+    
+    # 开始引号 -> 结束引号
+    CLOSE_QUOTES = {
+        '"': '"',
+        "'": "'",
+        '「': '」',
+        '『': '』'
+    }
+    
+    # 转义字符
+    ESCAPE_CHARS = {
+        'n': '\n',
+        't': '\t',
+        'r': '\r',
+        '\\': '\\',
+        '"': '"',
+        "'": "'"
+    }
+    
     def __init__(self, source: str):
         self.source = source
         self.pos = 0
-        self.line = 1
-        self.column = 1
         self.tokens = []
+        # 本词法分析器产出的token共享的行索引（报错或查询行列号时才构建）
+        self.lines = LineIndex(source)
     
     def current_char(self) -> Optional[str]:
         """当前字符"""
@@ -199,11 +875,6 @@ class Lexer:
     def advance(self):
         """前进一个字符"""
         if self.pos < len(self.source):
-            if self.source[self.pos] == '\n':
-                self.line += 1
-                self.column = 1
-            else:
-                self.column += 1
             self.pos += 1
     
     def skip_whitespace(self):
@@ -219,75 +890,254 @@ class Lexer:
             return True
         return False
     
+    def advance_to(self, end: int):
+        """一次前进到end"""
+        self.pos = end
+    
     def read_number(self) -> str:
         """读取数字"""
-        num_str = ''
+        source = self.source
+        length = len(source)
+        end = self.pos
         has_decimal = False
         
-        while self.current_char() and (self.current_char().isdigit() or self.current_char() == '.'):
-            if self.current_char() == '.':
+        while True:
+            end = DIGITS_PATTERN.match(source, end).end()
+            if end >= length:
+                break
+            ch = source[end]
+            if ch == '.':
                 if has_decimal:
                     break
                 has_decimal = True
-            num_str += self.current_char()
-            self.advance()
+            elif not ch.isdigit():
+                break
+            end += 1
         
+        num_str = source[self.pos:end]
+        self.advance_to(end)
         return num_str
     
     def read_string(self, quote: str) -> str:
         """读取字符串"""
         # 确定结束引号
-        close_quote = {
-            '"': '"',
-            "'": "'",
-            '「': '」',
-            '『': '』'
-        }.get(quote, quote)
+        close_quote = self.CLOSE_QUOTES.get(quote, quote)
         
         self.advance()  # 跳过开始引号
-        string = ''
+        source = self.source
+        start = self.pos
+        close = source.find(close_quote, start)
+        if close == -1:
+            close = len(source)
         
-        while self.current_char() and self.current_char() != close_quote:
-            if self.current_char() == '\\':
-                self.advance()
-                if self.current_char():
-                    # 转义字符
-                    escape_chars = {
-                        'n': '\n',
-                        't': '\t',
-                        'r': '\r',
-                        '\\': '\\',
-                        '"': '"',
-                        "'": "'"
-                    }
-                    string += escape_chars.get(self.current_char(), self.current_char())
-                    self.advance()
-            else:
-                string += self.current_char()
-                self.advance()
+        # 快速路径：没有转义时直接切片
+        if source.find('\\', start, close) == -1:
+            string = source[start:close]
+            end = close
+        else:
+            body = STRING_BODY_PATTERNS.get(close_quote)
+            if body is None:
+                body = re.compile(_string_body(close_quote))
+            end = body.match(source, start).end()
+            string = self.unescape(source[start:end])
         
-        if self.current_char() == close_quote:
-            self.advance()  # 跳过结束引号
+        if end < len(source):
+            end += 1  # 跳过结束引号
+        self.advance_to(end)
         
         return string
     
     def read_identifier(self) -> str:
         """读取标识符或关键字"""
-        ident = ''
-        
-        # 支持中文、英文、数字、下划线
-        while self.current_char() and (
-            '\u4e00' <= self.current_char() <= '\u9fa5' or  # 中文
-            self.current_char().isalnum() or
-            self.current_char() == '_'
-        ):
-            ident += self.current_char()
-            self.advance()
-        
+        # 支持中文、英文、数字、下划线（\w 与 isalnum() 或 '_' 等价）
+        end = IDENT_TAIL_PATTERN.match(self.source, self.pos).end()
+        ident = self.source[self.pos:end]
+        self.advance_to(end)
         return ident
     
+    def scan(self, pos: int = 0) -> Iterator[tuple]:
+        """从pos开始扫描，逐个产出 (类型, 起始偏移, 结束偏移)
+        
+        字符串的结束偏移指向内容末尾（不含结束引号），最后产出EOF。
+        """
+        source = self.source
+        length = len(source)
+        keywords = self.KEYWORDS
+        single_chars = self.SINGLE_CHARS
+        double_chars = self.DOUBLE_CHARS
+        KEYWORD, IDENTIFIER = TokenType.KEYWORD, TokenType.IDENTIFIER
+        NUMBER, STRING, UNKNOWN = TokenType.NUMBER, TokenType.STRING, TokenType.UNKNOWN
+        
+        while True:
+            resume = None
+            
+            for match in TOKEN_PATTERN.finditer(source, pos):
+                kind = match.lastgroup
+                start, end = match.span(kind)
+                
+                if kind == 'IDENT':
+                    ch = source[start]
+                    if ch.isalpha() or ch == '_':
+                        yield (KEYWORD if source[start:end] in keywords else IDENTIFIER), start, end
+                        continue
+                    # 非十进制数字（如²）或数字类符号，交给逐字符扫描
+                    token_type, _, resume = self.read_fallback(start)
+                    yield token_type, start, resume
+                    break
+                
+                elif kind == 'OP':
+                    value = source[start:end]
+                    yield (single_chars.get(value) or double_chars[value]), start, end
+                
+                elif kind == 'NUMBER':
+                    if end < length and source[end].isdigit():
+                        token_type, _, resume = self.read_fallback(start)
+                        yield token_type, start, resume
+                        break
+                    yield NUMBER, start, end
+                
+                elif kind == 'OTHER':
+                    yield UNKNOWN, start, end
+                
+                elif kind == 'END':
+                    break
+                
+                else:
+                    # 字符串（四种引号各占一个分组）
+                    yield STRING, start, match.end(STRING_BODIES[kind])
+            
+            if resume is None:
+                break
+            # 逐字符扫描后从新位置继续匹配
+            pos = resume
+        
+        yield TokenType.EOF, length, length
+    
+    def token_value(self, token_type: TokenType, start: int, end: int) -> Any:
+        """按scan()给出的范围取token的值"""
+        if token_type == TokenType.STRING:
+            body = self.source[start + 1:end]
+            return self.unescape(body) if '\\' in body else body
+        if token_type == TokenType.EOF:
+            return None
+        return self.source[start:end]
+    
+    def iter_tokens(self) -> Iterator[Token]:
+        """逐个产出Token（惰性分词，不保存整个列表）"""
+        source = self.source
+        lines = self.lines
+        STRING, EOF = TokenType.STRING, TokenType.EOF
+        
+        for token_type, start, end in self.scan():
+            if token_type == STRING or token_type == EOF:
+                value = self.token_value(token_type, start, end)
+            else:
+                value = source[start:end]
+            yield Token(token_type, value, start, lines)
+        
+        self.pos = len(source)
+    
     def tokenize(self) -> List[Token]:
-        """分词"""
+        """分词（主正则一次匹配整个token）"""
+        self.tokens.extend(self.iter_tokens())
+        return self.tokens
+    
+    def relex(self, old_tokens: List[Token], edit: TextEdit) -> List[Token]:
+        """增量重新分词：self.source 是 old_tokens 对应的旧源码
+        
+        从编辑点之前最后一个token开始重新扫描，一旦新token的起点与
+        编辑区之后某个旧token的起点（平移后）重合，后面的token就必然相同，
+        直接平移复用。old_tokens 会被原地修改并作为结果返回，
+        self.source 和 self.tokens 同时更新为编辑后的状态；
+        self.relexed 记录被替换的范围 (起点, 旧终点, 新终点)，均为token下标。
+        """
+        if not isinstance(self.source, str):
+            # TextEdit 按字符计偏移，不能用于 ByteLexer 的字节源码
+            raise TypeError('增量重新分词只支持str源码，ByteLexer 请整体重新分词')
+        if not (0 <= edit.start <= edit.end <= len(self.source)):
+            raise ValueError(f'编辑范围越界：{edit.start}-{edit.end}')
+        
+        self.source = edit.apply(self.source)
+        self.lines.reset(self.source)
+        delta = edit.delta
+        edit_end = edit.start + len(edit.text)   # 编辑区在新源码中的结束位置
+        
+        # 二分查找起点在编辑点之前的最后一个token
+        low, high = 0, len(old_tokens)
+        while low < high:
+            middle = (low + high) // 2
+            if old_tokens[middle].offset < edit.start:
+                low = middle + 1
+            else:
+                high = middle
+        first = max(low - 1, 0)
+        restart = old_tokens[first].offset if low else 0
+        
+        new_tokens = []
+        resync = len(old_tokens)
+        index = first
+        for token_type, start, end in self.scan(restart):
+            if start >= edit_end:
+                # 在旧token中找同一位置（平移前）的token
+                old_offset = start - delta
+                while index < len(old_tokens) and old_tokens[index].offset < old_offset:
+                    index += 1
+                if index < len(old_tokens) and old_tokens[index].offset == old_offset:
+                    resync = index
+                    break
+            new_tokens.append(Token(token_type, self.token_value(token_type, start, end), start, self.lines))
+        
+        # 原地替换受影响的token，并平移其后的token
+        old_tokens[first:resync] = new_tokens
+        if delta:
+            for token in itertools.islice(old_tokens, first + len(new_tokens), None):
+                token.offset += delta
+        
+        self.tokens = old_tokens
+        self.pos = len(self.source)
+        self.relexed = (first, resync, first + len(new_tokens))
+        return old_tokens
+    
+    def tokenize_stream(self) -> 'TokenStream':
+        """分词为紧凑的TokenStream（不创建Token对象）"""
+        stream = TokenStream(self.source, self)
+        add_type = stream.types.append
+        add_start = stream.starts.append
+        add_end = stream.ends.append
+        
+        for token_type, start, end in self.scan():
+            add_type(token_type.value)
+            add_start(start)
+            add_end(end)
+        
+        return stream
+    
+    def unescape(self, body: str) -> str:
+        """处理字符串内容里的转义序列"""
+        parts = ESCAPE_PATTERN.split(body)
+        # 奇数位是被转义的字符
+        escape_chars = self.ESCAPE_CHARS
+        parts[1::2] = [escape_chars.get(ch, ch) for ch in parts[1::2]]
+        return ''.join(parts)
+    
+    def read_fallback(self, pos: int):
+        """从pos开始逐字符读取一个数字或标识符，返回 (类型, 值, 结束位置)"""
+        self.pos = pos
+        ch = self.source[pos]
+        
+        if ch.isdigit():
+            value = self.read_number()
+            return TokenType.NUMBER, value, self.pos
+        
+        if '\u4e00' <= ch <= '\u9fa5' or ch.isalpha() or ch == '_':
+            value = self.read_identifier()
+            token_type = TokenType.KEYWORD if value in self.KEYWORDS else TokenType.IDENTIFIER
+            return token_type, value, self.pos
+        
+        return TokenType.UNKNOWN, ch, pos + 1
+    
+    def tokenize_legacy(self) -> List[Token]:
+        """逐字符分词（旧实现，保留用于差分测试）"""
         while self.current_char():
             # 跳过空白
             if self.current_char() in ' \t\r\n':
@@ -298,120 +1148,345 @@ class Lexer:
             if self.skip_comment():
                 continue
             
-            line, column = self.line, self.column
+            offset = self.pos
             ch = self.current_char()
             
             # 字符串
             if ch in '"\'「『':
                 value = self.read_string(ch)
-                self.tokens.append(Token(TokenType.STRING, value, line, column))
+                self.tokens.append(Token(TokenType.STRING, value, offset, self.lines))
                 continue
             
             # 数字
             if ch.isdigit():
                 value = self.read_number()
-                self.tokens.append(Token(TokenType.NUMBER, value, line, column))
+                self.tokens.append(Token(TokenType.NUMBER, value, offset, self.lines))
                 continue
             
             # 标识符或关键字
             if '\u4e00' <= ch <= '\u9fa5' or ch.isalpha() or ch == '_':
                 value = self.read_identifier()
                 token_type = TokenType.KEYWORD if value in self.KEYWORDS else TokenType.IDENTIFIER
-                self.tokens.append(Token(token_type, value, line, column))
+                self.tokens.append(Token(token_type, value, offset, self.lines))
                 continue
             
             # 双字符运算符
             if ch == '=' and self.peek_char() == '=':
                 self.advance()
                 self.advance()
-                self.tokens.append(Token(TokenType.EQ, '==', line, column))
+                self.tokens.append(Token(TokenType.EQ, '==', offset, self.lines))
                 continue
             
             if ch == '!' and self.peek_char() == '=':
                 self.advance()
                 self.advance()
-                self.tokens.append(Token(TokenType.NEQ, '!=', line, column))
+                self.tokens.append(Token(TokenType.NEQ, '!=', offset, self.lines))
                 continue
             
             if ch == '>' and self.peek_char() == '=':
                 self.advance()
                 self.advance()
-                self.tokens.append(Token(TokenType.GTE, '>=', line, column))
+                self.tokens.append(Token(TokenType.GTE, '>=', offset, self.lines))
                 continue
             
             if ch == '<' and self.peek_char() == '=':
                 self.advance()
                 self.advance()
-                self.tokens.append(Token(TokenType.LTE, '<=', line, column))
+                self.tokens.append(Token(TokenType.LTE, '<=', offset, self.lines))
                 continue
             
             if ch == '&' and self.peek_char() == '&':
                 self.advance()
                 self.advance()
-                self.tokens.append(Token(TokenType.LOGICAL_AND, '&&', line, column))
+                self.tokens.append(Token(TokenType.LOGICAL_AND, '&&', offset, self.lines))
                 continue
             
             if ch == '|' and self.peek_char() == '|':
                 self.advance()
                 self.advance()
-                self.tokens.append(Token(TokenType.LOGICAL_OR, '||', line, column))
+                self.tokens.append(Token(TokenType.LOGICAL_OR, '||', offset, self.lines))
                 continue
             
             # 单字符符号
-            single_chars = {
-                '=': TokenType.ASSIGN,
-                '+': TokenType.PLUS,
-                '-': TokenType.MINUS,
-                '*': TokenType.MULTIPLY,
-                '/': TokenType.DIVIDE,
-                '%': TokenType.MODULO,
-                '>': TokenType.GT,
-                '<': TokenType.LT,
-                '!': TokenType.NOT,
-                '(': TokenType.LPAREN,
-                ')': TokenType.RPAREN,
-                '{': TokenType.LBRACE,
-                '}': TokenType.RBRACE,
-                '[': TokenType.LBRACKET,
-                ']': TokenType.RBRACKET,
-                '【': TokenType.LBRACKET,
-                '】': TokenType.RBRACKET,
-                ';': TokenType.SEMICOLON,
-                ',': TokenType.COMMA,
-                '.': TokenType.DOT,
-            }
+            single_chars = self.SINGLE_CHARS
             
             if ch in single_chars:
                 self.advance()
-                self.tokens.append(Token(single_chars[ch], ch, line, column))
+                self.tokens.append(Token(single_chars[ch], ch, offset, self.lines))
                 continue
             
             # 未知字符
             self.advance()
-            self.tokens.append(Token(TokenType.UNKNOWN, ch, line, column))
+            self.tokens.append(Token(TokenType.UNKNOWN, ch, offset, self.lines))
         
         # EOF
-        self.tokens.append(Token(TokenType.EOF, None, self.line, self.column))
+        self.tokens.append(Token(TokenType.EOF, None, self.pos, self.lines))
+        return self.tokens
+
+
+class ByteLexer(Lexer):
+    """UTF-8字节词法分析器：直接扫描 bytes / memoryview / mmap
+    
+    ASCII和一-龥标识符在字节层面识别，只解码实际产出的标识符和字符串；
+    其他非ASCII字符（如全角标点、非十进制数字）所在的一小段才解码后
+    交给str版扫描。token偏移是字节偏移，产出的token与
+    Lexer(data.decode('utf-8')) 的类型和值完全一致。
+    """
+    
+    # 关键字和运算符的UTF-8编码，免得为了查表去解码
+    KEYWORD_BYTES = {keyword.encode('utf-8') for keyword in Lexer.KEYWORDS}
+    OPERATOR_BYTES = {
+        op.encode('utf-8'): token_type
+        for table in (Lexer.SINGLE_CHARS, Lexer.DOUBLE_CHARS)
+        for op, token_type in table.items()
+    }
+    
+    def __init__(self, source: Union[bytes, memoryview, 'mmap.mmap']):
+        super().__init__(source)
+        self.mapped = None
+    
+    @classmethod
+    def from_file(cls, path: str) -> 'ByteLexer':
+        """用mmap只读映射文件，不整体读入也不整体解码"""
+        with open(path, 'rb') as f:
+            try:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # 空文件无法映射
+                return cls(b'')
+        lexer = cls(mapped)
+        lexer.mapped = mapped
+        return lexer
+    
+    def close(self):
+        """释放mmap"""
+        if self.mapped is not None:
+            self.mapped.close()
+            self.mapped = None
+    
+    def decode(self, start: int, end: int) -> str:
+        """解码 [start, end) 字节"""
+        return bytes(self.source[start:end]).decode('utf-8')
+    
+    def scan(self, pos: int = 0) -> Iterator[tuple]:
+        """从字节偏移pos开始扫描，逐个产出 (类型, 起始偏移, 结束偏移)"""
+        source = self.source
+        length = len(source)
+        keywords = self.KEYWORD_BYTES
+        operators = self.OPERATOR_BYTES
+        KEYWORD, IDENTIFIER = TokenType.KEYWORD, TokenType.IDENTIFIER
+        NUMBER, STRING, UNKNOWN = TokenType.NUMBER, TokenType.STRING, TokenType.UNKNOWN
+        
+        while True:
+            resume = None
+            
+            for match in BYTE_TOKEN_PATTERN.finditer(source, pos):
+                kind = match.lastgroup
+                start, end = match.span(kind)
+                
+                # 标识符和数字后面紧跟其他非ASCII字符时，可能还要继续，交给慢路径
+                if (kind == 'IDENT' or kind == 'NUMBER') and end < length and source[end] >= 0x80 \
+                        and bytes(source[end:end + 3]) not in UTF8_SPECIALS:
+                    kind = 'SLOW'
+                
+                if kind == 'IDENT':
+                    yield (KEYWORD if bytes(source[start:end]) in keywords else IDENTIFIER), start, end
+                
+                elif kind == 'OP':
+                    yield operators[bytes(source[start:end])], start, end
+                
+                elif kind == 'NUMBER':
+                    yield NUMBER, start, end
+                
+                elif kind == 'OTHER':
+                    yield UNKNOWN, start, end
+                
+                elif kind == 'SLOW':
+                    resume = yield from self.scan_decoded(start)
+                    break
+                
+                elif kind == 'END':
+                    break
+                
+                else:
+                    yield STRING, start, match.end(STRING_BODIES[kind])
+            
+            if resume is None:
+                break
+            pos = resume
+        
+        yield TokenType.EOF, length, length
+    
+    def scan_decoded(self, start: int):
+        """解码从start开始的一段并用str版扫描，返回该段结束的字节偏移"""
+        end = BYTE_SLOW_RUN_PATTERN.match(self.source, start).end()
+        text = self.decode(start, end)
+        
+        # 字符偏移 -> 字节偏移
+        offset = start
+        counted = 0
+        for token_type, char_start, char_end in Lexer(text).scan():
+            if token_type == TokenType.EOF:
+                break
+            offset += len(text[counted:char_start].encode('utf-8'))
+            token_end = offset + len(text[char_start:char_end].encode('utf-8'))
+            yield token_type, offset, token_end
+            offset, counted = token_end, char_end
+        
+        return end
+    
+    def token_value(self, token_type: TokenType, start: int, end: int) -> Any:
+        """按scan()给出的字节范围取token的值"""
+        if token_type == TokenType.STRING:
+            # 跳过开始引号（1或3个字节）
+            lead = self.source[start]
+            body = self.decode(start + (1 if lead < 0x80 else 3), end)
+            return self.unescape(body) if '\\' in body else body
+        if token_type == TokenType.EOF:
+            return None
+        return self.decode(start, end)
+    
+    def iter_tokens(self) -> Iterator[Token]:
+        """逐个产出Token（偏移为字节偏移）"""
+        token_value = self.token_value
+        lines = self.lines
+        for token_type, start, end in self.scan():
+            yield Token(token_type, token_value(token_type, start, end), start, lines)
+        self.pos = len(self.source)
+    
+    def tokenize_legacy(self) -> List[Token]:
+        """逐字符分词（整体解码后交给str版旧实现，偏移换算回字节偏移；供差分测试）"""
+        text = self.decode(0, len(self.source))
+        tokens = Lexer(text).tokenize_legacy()
+        
+        # 字符偏移 -> 字节偏移（token按偏移递增）
+        offset = counted = 0
+        for token in tokens:
+            offset += len(text[counted:token.offset].encode('utf-8'))
+            counted = token.offset
+            token.offset = offset
+            token.lines = self.lines
+        
+        self.tokens.extend(tokens)
+        self.pos = len(self.source)
         return self.tokens
 
 
+class TokenStream:
+    """紧凑token流：类型、起止偏移分列存放在array中，值按需从源码切片
+    
+    一百万个token只占十几MB，不产生一百万个Token对象；
+    下标访问时才临时构造Token，Parser可以直接消费。
+    """
+    
+    def __init__(self, source: str, lexer: Optional['Lexer'] = None):
+        self.source = source
+        self.types = array('i')    # TokenType.value
+        self.starts = array('i')   # 起始偏移
+        self.ends = array('i')     # 结束偏移（字符串为内容末尾）
+        self.lexer = lexer or Lexer(source)
+        self.line_index = self.lexer.lines
+    
+    def __len__(self) -> int:
+        return len(self.types)
+    
+    def type(self, index: int) -> TokenType:
+        """第index个token的类型"""
+        return TOKEN_TYPES[self.types[index]]
+    
+    def value(self, index: int) -> Any:
+        """第index个token的值"""
+        return self.lexer.token_value(TOKEN_TYPES[self.types[index]], self.starts[index], self.ends[index])
+    
+    def position(self, index: int) -> tuple:
+        """第index个token的 (行号, 列号)"""
+        return self.line_index.position(self.starts[index])
+    
+    def __getitem__(self, index: int) -> Token:
+        if index < 0:
+            index += len(self.types)
+        return Token(self.type(index), self.value(index), self.starts[index], self.line_index)
+    
+    def __iter__(self) -> Iterator[Token]:
+        for index in range(len(self.types)):
+            yield self[index]
+    
+    def to_tokens(self) -> List[Token]:
+        """展开为 List[Token]"""
+        return list(self)
+
+
+class TokenBuffer:
+    """环形缓冲：从token迭代器按需拉取，只保留最近的少量token
+    
+    配合 Lexer.iter_tokens() 使用时，词法和语法分析交替进行，
+    前端内存占用与源码规模无关。
+    """
+    
+    def __init__(self, tokens: Iterable[Token], size: int = 16):
+        self.iterator = iter(tokens)
+        self.window = deque(maxlen=size)
+        self.base = 0        # window[0] 的下标
+        self.eof = None
+    
+    @property
+    def count(self) -> int:
+        """已拉取的token数"""
+        return self.base + len(self.window)
+    
+    def __getitem__(self, index: int) -> Token:
+        window = self.window
+        while index >= self.base + len(window):
+            if self.eof is not None:
+                return self.eof
+            token = next(self.iterator)
+            if len(window) == window.maxlen:
+                self.base += 1
+            window.append(token)
+            if token.type == TokenType.EOF:
+                self.eof = token
+        
+        if index < self.base:
+            raise IndexError(f'token {index} 已移出缓冲区')
+        return window[index - self.base]
+
+
+# TokenType.value -> TokenType
+TOKEN_TYPES = {token_type.value: token_type for token_type in TokenType}
+
+
 # ═══════════════════════════════════════════════════════════════
 # 🌳 抽象语法树（AST）节点
 # ═══════════════════════════════════════════════════════════════
 
-@dataclass
+def _slots_dataclass(cls):
+    """带__slots__的dataclass：节点不再各带一个__dict__（兼容Python 3.7）"""
+    cls = dataclass(cls)
+    annotations = cls.__dict__.get('__annotations__', {})
+    names = tuple(f.name for f in fields(cls) if f.name in annotations)
+    namespace = dict(cls.__dict__)
+    # 默认值已记入生成的__init__，类属性须让位给同名slot
+    for name in names:
+        namespace.pop(name, None)
+    namespace.pop('__dict__', None)
+    namespace.pop('__weakref__', None)
+    namespace['__slots__'] = names
+    return type(cls)(cls.__name__, cls.__bases__, namespace)
+
+
+@_slots_dataclass
 class ASTNode:
     """AST节点基类"""
-    pass
+    __slots__ = ()
 
 
-@dataclass
+@_slots_dataclass
 class Program(ASTNode):
     """程序"""
     statements: List[ASTNode]
 
 
-@dataclass
+@_slots_dataclass
 class VariableDeclaration(ASTNode):
     """变量声明"""
     var_type: str
@@ -419,16 +1494,23 @@ class VariableDeclaration(ASTNode):
     value: Optional[ASTNode] = None
 
 
-@dataclass
+@_slots_dataclass
+class Parameter:
+    """函数参数"""
+    param_type: str
+    name: str
+
+
+@_slots_dataclass
 class FunctionDeclaration(ASTNode):
     """函数声明"""
     name: str
-    params: List[Dict[str, str]]
+    params: List['Parameter']
     return_type: str
     body: List[ASTNode]
 
 
-@dataclass
+@_slots_dataclass
 class IfStatement(ASTNode):
     """if语句"""
     condition: ASTNode
@@ -436,62 +1518,62 @@ class IfStatement(ASTNode):
     else_body: Optional[List[ASTNode]] = None
 
 
-@dataclass
+@_slots_dataclass
 class LoopStatement(ASTNode):
     """循环语句"""
     times: ASTNode
     body: List[ASTNode]
 
 
-@dataclass
+@_slots_dataclass
 class ReturnStatement(ASTNode):
     """return语句"""
     value: Optional[ASTNode] = None
 
 
-@dataclass
+@_slots_dataclass
 class PrintStatement(ASTNode):
     """打印语句"""
     value: ASTNode
 
 
-@dataclass
+@_slots_dataclass
 class ExpressionStatement(ASTNode):
     """表达式语句"""
     expression: ASTNode
 
 
-@dataclass
+@_slots_dataclass
 class Number(ASTNode):
     """数字"""
     value: str
 
 
-@dataclass
+@_slots_dataclass
 class String(ASTNode):
     """字符串"""
     value: str
 
 
-@dataclass
+@_slots_dataclass
 class Boolean(ASTNode):
     """布尔值"""
     value: bool
 
 
-@dataclass
+@_slots_dataclass
 class Null(ASTNode):
     """空值"""
     pass
 
 
-@dataclass
+@_slots_dataclass
 class Identifier(ASTNode):
     """标识符"""
     name: str
 
 
-@dataclass
+@_slots_dataclass
 class BinaryOp(ASTNode):
     """二元运算"""
     op: str
@@ -499,54 +1581,401 @@ class BinaryOp(ASTNode):
     right: ASTNode
 
 
-@dataclass
+@_slots_dataclass
 class UnaryOp(ASTNode):
     """一元运算"""
     op: str
     operand: ASTNode
 
 
-@dataclass
+@_slots_dataclass
 class Assignment(ASTNode):
     """赋值"""
     left: ASTNode
     right: ASTNode
 
 
-@dataclass
+@_slots_dataclass
 class FunctionCall(ASTNode):
     """函数调用"""
     name: str
     args: List[ASTNode]
 
 
-# ═══════════════════════════════════════════════════════════════
-# 🔍 语法分析器（Parser）
-# ═══════════════════════════════════════════════════════════════
+class NodeKind:
+    """紧凑AST的节点种类（数组中直接存放的整数）"""
+    VARIABLE = 0
+    FUNCTION = 1
+    IF = 2
+    LOOP = 3
+    RETURN = 4
+    PRINT = 5
+    EXPRESSION = 6
+    NUMBER = 7
+    STRING = 8
+    BOOLEAN = 9
+    NULL = 10
+    IDENTIFIER = 11
+    BINARY = 12
+    UNARY = 13
+    ASSIGNMENT = 14
+    CALL = 15
 
-class Parser:
-    """语法分析器"""
+
+class ASTArena:
+    """紧凑AST：节点种类、子节点下标与载荷分列存于数组，不为每个节点保留Python对象"""
     
-    def __init__(self, tokens: List[Token]):
-        self.tokens = tokens
+    # 每个节点占用的整数字段数
+    WIDTH = 4
+    
+    # 字段编码：子节点下标（无则-1）、子节点列表偏移（无则-1）、字符串编号、真假、参数列表偏移
+    NODE, LIST, TEXT, FLAG, PARAMS = range(5)
+    
+    # 节点类 -> (种类, 依次存放的字段)
+    LAYOUT = {
+        VariableDeclaration: (NodeKind.VARIABLE, (('var_type', TEXT), ('name', TEXT), ('value', NODE))),
+        FunctionDeclaration: (NodeKind.FUNCTION, (('name', TEXT), ('params', PARAMS),
+                                                  ('return_type', TEXT), ('body', LIST))),
+        IfStatement: (NodeKind.IF, (('condition', NODE), ('then_body', LIST), ('else_body', LIST))),
+        LoopStatement: (NodeKind.LOOP, (('times', NODE), ('body', LIST))),
+        ReturnStatement: (NodeKind.RETURN, (('value', NODE),)),
+        PrintStatement: (NodeKind.PRINT, (('value', NODE),)),
+        ExpressionStatement: (NodeKind.EXPRESSION, (('expression', NODE),)),
+        Number: (NodeKind.NUMBER, (('value', TEXT),)),
+        String: (NodeKind.STRING, (('value', TEXT),)),
+        Boolean: (NodeKind.BOOLEAN, (('value', FLAG),)),
+        Null: (NodeKind.NULL, ()),
+        Identifier: (NodeKind.IDENTIFIER, (('name', TEXT),)),
+        BinaryOp: (NodeKind.BINARY, (('op', TEXT), ('left', NODE), ('right', NODE))),
+        UnaryOp: (NodeKind.UNARY, (('op', TEXT), ('operand', NODE))),
+        Assignment: (NodeKind.ASSIGNMENT, (('left', NODE), ('right', NODE))),
+        FunctionCall: (NodeKind.CALL, (('name', TEXT), ('args', LIST))),
+    }
+    
+    # 种类 -> 节点类（还原对象时用）
+    CLASSES = {kind: node_class for node_class, (kind, _) in LAYOUT.items()}
+    
+    def __init__(self):
+        self.kinds = array('B')
+        # 第i个节点的字段位于 data[i*WIDTH : (i+1)*WIDTH]
+        self.data = array('i')
+        # 子节点列表：长度后接各项；参数列表同样存放，各项为 (类型, 名称) 字符串编号对
+        self.lists = array('i')
+        self.strings = []
+        self.string_ids = {}
+        # 顶层语句的节点下标
+        self.statements = array('i')
+    
+    @classmethod
+    def from_statements(cls, statements: Iterable[ASTNode]) -> 'ASTArena':
+        """逐条写入顶层语句（配合 Parser.iter_statements，整棵对象树不必同时存在）"""
+        arena = cls()
+        for stmt in statements:
+            arena.add_statement(stmt)
+        return arena
+    
+    def __len__(self) -> int:
+        return len(self.kinds)
+    
+    def pack(self) -> tuple:
+        """转为可marshal的元组（数组存为原始字节）"""
+        return (
+            self.kinds.tobytes(),
+            self.data.tobytes(),
+            self.lists.tobytes(),
+            self.strings,
+            self.statements.tobytes(),
+        )
+    
+    @classmethod
+    def unpack(cls, packed: tuple) -> 'ASTArena':
+        """由 pack() 的结果还原"""
+        arena = cls()
+        kinds, data, lists, strings, statements = packed
+        arena.kinds.frombytes(kinds)
+        arena.data.frombytes(data)
+        arena.lists.frombytes(lists)
+        arena.statements.frombytes(statements)
+        arena.strings = list(strings)
+        arena.string_ids = {text: string_id for string_id, text in enumerate(arena.strings)}
+        return arena
+    
+    def intern(self, text: str) -> int:
+        """字符串驻留，返回编号"""
+        string_id = self.string_ids.get(text)
+        if string_id is None:
+            string_id = self.string_ids[text] = len(self.strings)
+            self.strings.append(text)
+        return string_id
+    
+    def add_list(self, items: List[int]) -> int:
+        """写入子节点列表，返回偏移"""
+        offset = len(self.lists)
+        self.lists.append(len(items))
+        self.lists.extend(items)
+        return offset
+    
+    def children(self, offset: int) -> array:
+        """子节点列表"""
+        count = self.lists[offset]
+        return self.lists[offset + 1:offset + 1 + count]
+    
+    def params(self, offset: int) -> List[tuple]:
+        """参数列表：[(类型, 名称), ...]"""
+        strings = self.strings
+        pairs = self.children(offset)
+        return [(strings[pairs[i]], strings[pairs[i + 1]]) for i in range(0, len(pairs), 2)]
+    
+    def add_statement(self, node: ASTNode) -> int:
+        """写入一条顶层语句及其子树（后序、显式栈），返回节点下标"""
+        index = self.add_node(node)
+        self.statements.append(index)
+        return index
+    
+    def add_node(self, node: ASTNode) -> int:
+        """写入一棵子树（后序、显式栈），返回根节点下标"""
+        NODE, LIST, TEXT, FLAG = self.NODE, self.LIST, self.TEXT, self.FLAG
+        layout = self.LAYOUT
+        # 已写入子树的下标，按字段顺序排列
+        values = []
+        stack = [(node, False)]
+        
+        while stack:
+            item, ready = stack.pop()
+            if item is None:
+                values.append(-1)
+                continue
+            
+            kind, spec = layout[type(item)]
+            if not ready:
+                # 先写子节点：逆序入栈，出栈即为字段顺序
+                stack.append((item, True))
+                for name, code in reversed(spec):
+                    if code == NODE:
+                        stack.append((getattr(item, name), False))
+                    elif code == LIST:
+                        children = getattr(item, name)
+                        if children:
+                            stack.extend((child, False) for child in reversed(children))
+                continue
+            
+            # 子树下标在values栈顶，逆序取回
+            row = []
+            for name, code in reversed(spec):
+                value = getattr(item, name)
+                if code == NODE:
+                    row.append(values.pop())
+                elif code == LIST:
+                    if value is None:
+                        row.append(-1)
+                    elif value:
+                        count = len(value)
+                        row.append(self.add_list(values[-count:]))
+                        del values[-count:]
+                    else:
+                        row.append(self.add_list([]))
+                elif code == TEXT:
+                    row.append(self.intern(value))
+                elif code == FLAG:
+                    row.append(1 if value else 0)
+                else:
+                    row.append(self.add_list([
+                        self.intern(text)
+                        for param in value
+                        for text in (param.param_type, param.name)
+                    ]))
+            row.reverse()
+            row.extend([-1] * (self.WIDTH - len(row)))
+            
+            values.append(len(self.kinds))
+            self.kinds.append(kind)
+            self.data.extend(row)
+        
+        return values[0]
+    
+    def node(self, index: int) -> ASTNode:
+        """还原一棵子树为节点对象（显式栈）"""
+        NODE, LIST, TEXT, FLAG = self.NODE, self.LIST, self.TEXT, self.FLAG
+        width = self.WIDTH
+        values = []
+        stack = [(index, False)]
+        
+        while stack:
+            item, ready = stack.pop()
+            if item < 0:
+                values.append(None)
+                continue
+            
+            kind = self.kinds[item]
+            node_class = self.CLASSES[kind]
+            spec = self.LAYOUT[node_class][1]
+            row = self.data[item * width:item * width + len(spec)]
+            if not ready:
+                stack.append((item, True))
+                for (name, code), value in zip(reversed(spec), reversed(row)):
+                    if code == NODE:
+                        stack.append((value, False))
+                    elif code == LIST and value >= 0:
+                        stack.extend((child, False) for child in reversed(self.children(value)))
+                continue
+            
+            count = 0
+            for (name, code), value in zip(spec, row):
+                if code == NODE:
+                    count += 1
+                elif code == LIST and value >= 0:
+                    count += self.lists[value]
+            children = values[len(values) - count:]
+            del values[len(values) - count:]
+            
+            args = []
+            position = 0
+            for (name, code), value in zip(spec, row):
+                if code == NODE:
+                    args.append(children[position])
+                    position += 1
+                elif code == LIST:
+                    if value < 0:
+                        args.append(None)
+                    else:
+                        count = self.lists[value]
+                        args.append(children[position:position + count])
+                        position += count
+                elif code == TEXT:
+                    args.append(self.strings[value])
+                elif code == FLAG:
+                    args.append(bool(value))
+                else:
+                    args.append([Parameter(*pair) for pair in self.params(value)])
+            values.append(node_class(*args))
+        
+        return values[0]
+    
+    def to_program(self) -> Program:
+        """还原为节点对象树"""
+        return Program([self.node(index) for index in self.statements])
+
+
+# ═══════════════════════════════════════════════════════════════
+# 🔍 语法分析器（Parser）
+# ═══════════════════════════════════════════════════════════════
+
+class Parser:
+    """语法分析器"""
+    
+    # 二元运算符优先级（越大结合越紧）；赋值最低、右结合，只出现在表达式最外层
+    BINARY_PRECEDENCE = {
+        TokenType.ASSIGN: 0,
+        TokenType.LOGICAL_OR: 1,
+        TokenType.LOGICAL_AND: 2,
+        TokenType.EQ: 3,
+        TokenType.NEQ: 3,
+        TokenType.GT: 4,
+        TokenType.LT: 4,
+        TokenType.GTE: 4,
+        TokenType.LTE: 4,
+        TokenType.PLUS: 5,
+        TokenType.MINUS: 5,
+        TokenType.MULTIPLY: 6,
+        TokenType.DIVIDE: 6,
+        TokenType.MODULO: 6,
+    }
+    
+    # 前缀一元运算符
+    PREFIX_OPERATORS = frozenset({TokenType.MINUS, TokenType.NOT})
+    
+    # 类型关键字
+    TYPE_KEYWORDS = frozenset({'整数', '小数', '文本', '真假'})
+    
+    # 语句关键字 -> 解析方法名（新增语句只需加一项并实现对应方法）
+    STATEMENT_PARSERS = {
+        # 变量声明
+        '整数': 'parse_variable_declaration',
+        '小数': 'parse_variable_declaration',
+        '文本': 'parse_variable_declaration',
+        '真假': 'parse_variable_declaration',
+        # 函数定义
+        '函数': 'parse_function_declaration',
+        # if语句
+        '如果': 'parse_if_statement',
+        # 循环语句
+        '循环': 'parse_loop_statement',
+        # return语句
+        '返回': 'parse_return_statement',
+        # 打印语句
+        '打印': 'parse_print_statement',
+    }
+    
+    # 带语句块的语句关键字 -> 语句头解析方法名（迭代模式用）
+    BLOCK_PARSERS = {
+        '函数': 'parse_function_header',
+        '如果': 'parse_if_header',
+        '循环': 'parse_loop_header',
+    }
+    
+    def __init__(self, tokens: Union[List[Token], TokenStream, TokenBuffer, Iterable[Token]],
+                 source: Optional[str] = None, iterative: bool = False):
+        # 其他可迭代对象（如 Lexer.iter_tokens()）经环形缓冲按需拉取
+        if not isinstance(tokens, (list, TokenStream, TokenBuffer)):
+            tokens = TokenBuffer(tokens)
+        self.tokens = tokens
         self.pos = 0
+        # 报错时才用源码建立行索引
+        if source is None and isinstance(tokens, TokenStream):
+            source = tokens.source
+        self.source = source
+        self.line_index = None
+        # 分派表绑定到本实例，子类覆盖的方法同样生效
+        self.statement_parsers = {
+            keyword: getattr(self, name)
+            for keyword, name in self.STATEMENT_PARSERS.items()
+        }
+        self.block_parsers = {
+            keyword: getattr(self, name)
+            for keyword, name in self.BLOCK_PARSERS.items()
+        }
+        # 迭代模式：语句块与表达式都用显式栈解析，嵌套深度不受递归上限限制
+        self.iterative = iterative
+        if iterative:
+            self.parse_expression = self.parse_expression_iterative
+        # 缓存当前token；TokenStream按下标临时构造Token
+        self.token = tokens[0]
     
     def current(self) -> Token:
         """当前token"""
-        return self.tokens[self.pos]
+        return self.token
+    
+    def seek(self, pos: int):
+        """跳到第pos个token（增量解析从语句边界重新开始）"""
+        self.pos = pos
+        self.token = self.tokens[pos]
     
     def peek(self, offset: int = 1) -> Token:
         """向前看token"""
-        pos = self.pos + offset
-        if pos < len(self.tokens):
-            return self.tokens[pos]
-        return self.tokens[-1]  # EOF
+        if self.token.type == TokenType.EOF:
+            return self.token
+        try:
+            return self.tokens[self.pos + offset]
+        except IndexError:
+            return self.tokens[-1]  # EOF
+    
+    def location(self, token: Token) -> str:
+        """token位置描述（用于错误信息）"""
+        if token.lines is not None:
+            return f'行{token.line}'
+        if self.source is not None:
+            if self.line_index is None:
+                self.line_index = LineIndex(self.source)
+            return f'行{self.line_index.line(token.offset)}'
+        # 手工构造、不带行索引的token
+        return f'偏移{token.offset}'
     
     def advance(self) -> Token:
         """前进"""
-        token = self.current()
-        if self.pos < len(self.tokens) - 1:
+        token = self.token
+        if token.type != TokenType.EOF:
             self.pos += 1
+            self.token = self.tokens[self.pos]
         return token
     
     def expect(self, token_type: TokenType, value: Optional[str] = None) -> Token:
@@ -557,51 +1986,76 @@ class Parser:
             if value:
                 expected += f" '{value}'"
             raise SyntaxError(
-                f"语法错误 (行{token.line}): 期望 {expected}, "
+                f"语法错误 ({self.location(token)}): 期望 {expected}, "
                 f"但得到 {token.type.name} '{token.value}'"
             )
         return self.advance()
     
     def parse(self) -> Program:
         """解析程序"""
-        statements = []
+        return Program(list(self.iter_statements()))
+    
+    def iter_statements(self) -> Iterator[ASTNode]:
+        """逐条解析顶层语句（调用方可边解析边处理，不必留住整棵树）"""
+        if self.iterative:
+            yield from self.iter_statements_iterative()
+            return
         
         while self.current().type != TokenType.EOF:
             stmt = self.parse_statement()
             if stmt:
-                statements.append(stmt)
+                yield stmt
+    
+    def iter_statements_iterative(self) -> Iterator[ASTNode]:
+        """逐条解析顶层语句（显式栈，不递归）"""
+        statements = []
+        body = statements
+        # 未闭合的语句块：(所属语句, 外层语句块)
+        blocks = []
+        block_parsers = self.block_parsers
         
-        return Program(statements)
+        while True:
+            # 语句块全部闭合时，顶层语句即已完整
+            if statements and not blocks:
+                yield statements.pop()
+            
+            token = self.token
+            
+            if token.type == TokenType.RBRACE and blocks:
+                self.advance()
+                node, outer = blocks[-1]
+                # then块结束后可能紧跟else块
+                if isinstance(node, IfStatement) and body is node.then_body \
+                        and self.parse_else_header(node) is not None:
+                    body = node.else_body
+                    continue
+                blocks.pop()
+                body = outer
+                continue
+            
+            if token.type == TokenType.EOF and not blocks:
+                return
+            
+            # 带语句块的语句只解析语句头，语句块入栈后继续读其中的语句
+            parse_header = block_parsers.get(token.value)
+            if parse_header is not None and token.type == TokenType.KEYWORD:
+                node = parse_header()
+                body.append(node)
+                blocks.append((node, body))
+                body = node.then_body if isinstance(node, IfStatement) else node.body
+                continue
+            
+            body.append(self.parse_statement())
     
     def parse_statement(self) -> Optional[ASTNode]:
         """解析语句"""
-        token = self.current()
-        
-        # 变量声明
-        if token.type == TokenType.KEYWORD and token.value in ['整数', '小数', '文本', '真假']:
-            return self.parse_variable_declaration()
+        token = self.token
         
-        # 函数定义
-        if token.type == TokenType.KEYWORD and token.value == '函数':
-            return self.parse_function_declaration()
-        
-        # if语句
-        if token.type == TokenType.KEYWORD and token.value == '如果':
-            return self.parse_if_statement()
-        
-        # 循环语句
-        if token.type == TokenType.KEYWORD and token.value == '循环':
-            return self.parse_loop_statement()
-        
-        # return语句
-        if token.type == TokenType.KEYWORD and token.value == '返回':
-            return self.parse_return_statement()
-        
-        # 打印语句
-        if token.type == TokenType.KEYWORD and token.value == '打印':
-            return self.parse_print_statement()
+        # 关键字开头的语句查表分派，其余都是表达式语句
+        parse = self.statement_parsers.get(token.value)
+        if parse is not None and token.type == TokenType.KEYWORD:
+            return parse()
         
-        # 表达式语句
         return self.parse_expression_statement()
     
     def parse_variable_declaration(self) -> VariableDeclaration:
@@ -620,8 +2074,18 @@ class Parser:
         
         return VariableDeclaration(type_token.value, name_token.value, value)
     
-    def parse_function_declaration(self) -> FunctionDeclaration:
-        """解析函数声明"""
+    def parse_block(self, body: List[ASTNode]) -> List[ASTNode]:
+        """解析语句块剩余部分（左花括号已消费），直到右花括号"""
+        while self.current().type != TokenType.RBRACE:
+            stmt = self.parse_statement()
+            if stmt:
+                body.append(stmt)
+        
+        self.expect(TokenType.RBRACE)
+        return body
+    
+    def parse_function_header(self) -> FunctionDeclaration:
+        """解析函数头（到左花括号为止），函数体留空"""
         self.advance()  # 跳过 '函数'
         name_token = self.expect(TokenType.IDENTIFIER)
         
@@ -630,10 +2094,10 @@ class Parser:
         
         # 参数列表
         while self.current().type != TokenType.RPAREN:
-            if self.current().type == TokenType.KEYWORD and self.current().value in ['整数', '小数', '文本', '真假']:
+            if self.current().type == TokenType.KEYWORD and self.current().value in self.TYPE_KEYWORDS:
                 param_type = self.advance().value
                 param_name = self.expect(TokenType.IDENTIFIER).value
-                params.append({'type': param_type, 'name': param_name})
+                params.append(Parameter(param_type, param_name))
                 
                 if self.current().type == TokenType.COMMA:
                     self.advance()
@@ -650,68 +2114,58 @@ class Parser:
         
         # 函数体
         self.expect(TokenType.LBRACE)
-        body = []
-        
-        while self.current().type != TokenType.RBRACE:
-            stmt = self.parse_statement()
-            if stmt:
-                body.append(stmt)
-        
-        self.expect(TokenType.RBRACE)
-        
-        return FunctionDeclaration(name_token.value, params, return_type, body)
+        return FunctionDeclaration(name_token.value, params, return_type, [])
     
-    def parse_if_statement(self) -> IfStatement:
-        """解析if语句"""
+    def parse_function_declaration(self) -> FunctionDeclaration:
+        """解析函数声明"""
+        node = self.parse_function_header()
+        self.parse_block(node.body)
+        return node
+    
+    def parse_if_header(self) -> IfStatement:
+        """解析if语句头（到左花括号为止）"""
         self.advance()  # 跳过 '如果'
         self.expect(TokenType.LBRACKET)
         condition = self.parse_expression()
         self.expect(TokenType.RBRACKET)
         
         self.expect(TokenType.LBRACE)
-        then_body = []
-        
-        while self.current().type != TokenType.RBRACE:
-            stmt = self.parse_statement()
-            if stmt:
-                then_body.append(stmt)
-        
-        self.expect(TokenType.RBRACE)
-        
-        # else子句
-        else_body = None
+        return IfStatement(condition, [])
+    
+    def parse_else_header(self, node: IfStatement) -> Optional[List[ASTNode]]:
+        """解析else子句头；有else时返回待填充的else语句块"""
         if self.current().type == TokenType.KEYWORD and self.current().value == '否则':
             self.advance()
             self.expect(TokenType.LBRACE)
-            else_body = []
-            
-            while self.current().type != TokenType.RBRACE:
-                stmt = self.parse_statement()
-                if stmt:
-                    else_body.append(stmt)
-            
-            self.expect(TokenType.RBRACE)
+            node.else_body = []
+        return node.else_body
+    
+    def parse_if_statement(self) -> IfStatement:
+        """解析if语句"""
+        node = self.parse_if_header()
+        self.parse_block(node.then_body)
+        
+        # else子句
+        if self.parse_else_header(node) is not None:
+            self.parse_block(node.else_body)
         
-        return IfStatement(condition, then_body, else_body)
+        return node
     
-    def parse_loop_statement(self) -> LoopStatement:
-        """解析循环语句"""
+    def parse_loop_header(self) -> LoopStatement:
+        """解析循环语句头（到左花括号为止）"""
         self.advance()  # 跳过 '循环'
         self.expect(TokenType.LBRACKET)
         times = self.parse_expression()
         self.expect(TokenType.RBRACKET)
         
         self.expect(TokenType.LBRACE)
-        body = []
-        
-        while self.current().type != TokenType.RBRACE:
-            stmt = self.parse_statement()
-            if stmt:
-                body.append(stmt)
-        
-        self.expect(TokenType.RBRACE)
-        
-        return LoopStatement(times, body)
+        return LoopStatement(times, [])
+    
+    def parse_loop_statement(self) -> LoopStatement:
+        """解析循环语句"""
+        node = self.parse_loop_header()
+        self.parse_block(node.body)
+        return node
     
     def parse_return_statement(self) -> ReturnStatement:
         """解析return语句"""
@@ -745,90 +2199,120 @@ class Parser:
         
         return ExpressionStatement(expr)
     
-    def parse_expression(self) -> ASTNode:
-        """解析表达式"""
-        return self.parse_assignment()
-    
-    def parse_assignment(self) -> ASTNode:
-        """解析赋值"""
-        left = self.parse_logical_or()
+    def parse_expression(self, min_precedence: int = 0) -> ASTNode:
+        """解析表达式（按优先级表爬升）"""
+        left = self.parse_primary()
+        precedence_of = self.BINARY_PRECEDENCE.get
         
-        if self.current().type == TokenType.ASSIGN:
+        while True:
+            token = self.token
+            precedence = precedence_of(token.type)
+            if precedence is None or precedence < min_precedence:
+                return left
             self.advance()
-            right = self.parse_assignment()
-            return Assignment(left, right)
-        
-        return left
-    
-    def parse_logical_or(self) -> ASTNode:
-        """解析逻辑或"""
-        left = self.parse_logical_and()
-        
-        while self.current().type == TokenType.LOGICAL_OR:
-            op = self.advance().value
-            right = self.parse_logical_and()
-            left = BinaryOp(op, left, right)
-        
-        return left
-    
-    def parse_logical_and(self) -> ASTNode:
-        """解析逻辑与"""
-        left = self.parse_equality()
-        
-        while self.current().type == TokenType.LOGICAL_AND:
-            op = self.advance().value
-            right = self.parse_equality()
-            left = BinaryOp(op, left, right)
-        
-        return left
-    
-    def parse_equality(self) -> ASTNode:
-        """解析相等性"""
-        left = self.parse_comparison()
-        
-        while self.current().type in [TokenType.EQ, TokenType.NEQ]:
-            op = self.advance().value
-            right = self.parse_comparison()
-            left = BinaryOp(op, left, right)
-        
-        return left
-    
-    def parse_comparison(self) -> ASTNode:
-        """解析比较"""
-        left = self.parse_term()
-        
-        while self.current().type in [TokenType.GT, TokenType.LT, TokenType.GTE, TokenType.LTE]:
-            op = self.advance().value
-            right = self.parse_term()
-            left = BinaryOp(op, left, right)
-        
-        return left
+            
+            if precedence == 0:
+                # 赋值右结合
+                return Assignment(left, self.parse_expression())
+            
+            # 左结合：右操作数只吸收更高优先级的运算符
+            left = BinaryOp(token.value, left, self.parse_expression(precedence + 1))
     
-    def parse_term(self) -> ASTNode:
-        """解析项"""
-        left = self.parse_factor()
-        
-        while self.current().type in [TokenType.PLUS, TokenType.MINUS]:
-            op = self.advance().value
-            right = self.parse_factor()
-            left = BinaryOp(op, left, right)
+    def parse_expression_iterative(self) -> ASTNode:
+        """解析表达式（显式栈，不递归）"""
+        precedence_of = self.BINARY_PRECEDENCE.get
+        prefix_operators = self.PREFIX_OPERATORS
+        # 外层上下文：(左括号或函数名token, 实参列表, 操作数栈, 运算符栈)
+        frames = []
+        opener = None
+        args = None
+        operands = []
+        # (优先级, 运算符)；前缀运算符优先级记为None
+        operators = []
         
-        return left
+        while True:
+            # 读一个操作数
+            token = self.token
+            if token.type in prefix_operators:
+                self.advance()
+                operators.append((None, token.value))
+                continue
+            
+            if token.type == TokenType.IDENTIFIER:
+                self.advance()
+                opens = self.token.type == TokenType.LPAREN
+                if not opens:
+                    node = Identifier(token.value)
+            elif token.type == TokenType.LPAREN:
+                opens = True
+            else:
+                opens = False
+                node = self.parse_primary()
+            
+            if opens:
+                # 括号或函数调用：保存当前上下文，里面是一个新表达式
+                self.advance()  # 跳过 (
+                frames.append((opener, args, operands, operators))
+                opener = token
+                args = [] if token.type == TokenType.IDENTIFIER else None
+                operands = []
+                operators = []
+                if args is None or self.token.type != TokenType.RPAREN:
+                    continue
+                # 无参调用
+                self.advance()
+                node = FunctionCall(opener.value, args)
+                opener, args, operands, operators = frames.pop()
+            
+            while True:
+                # 得到操作数：先结合等待中的前缀运算符
+                while operators and operators[-1][0] is None:
+                    node = UnaryOp(operators.pop()[1], node)
+                operands.append(node)
+                
+                token = self.token
+                precedence = precedence_of(token.type)
+                if precedence is not None:
+                    self.advance()
+                    # 左结合弹出同级及更高级；赋值右结合只弹出更高级
+                    while operators and (operators[-1][0] > precedence
+                                         or operators[-1][0] == precedence and precedence):
+                        self.reduce_operator(operands, operators)
+                    operators.append((precedence, token.value))
+                    break
+                
+                # 当前层表达式结束
+                while operators:
+                    self.reduce_operator(operands, operators)
+                node = operands.pop()
+                
+                if opener is None:
+                    return node
+                if args is None:
+                    self.expect(TokenType.RPAREN)
+                else:
+                    args.append(node)
+                    if self.token.type == TokenType.COMMA:
+                        self.advance()
+                    if self.token.type != TokenType.RPAREN:
+                        # 下一个实参
+                        break
+                    self.advance()
+                    node = FunctionCall(opener.value, args)
+                opener, args, operands, operators = frames.pop()
     
-    def parse_factor(self) -> ASTNode:
-        """解析因子"""
-        left = self.parse_unary()
-        
-        while self.current().type in [TokenType.MULTIPLY, TokenType.DIVIDE, TokenType.MODULO]:
-            op = self.advance().value
-            right = self.parse_unary()
-            left = BinaryOp(op, left, right)
-        
-        return left
+    def reduce_operator(self, operands: List[ASTNode], operators: List[tuple]):
+        """弹出一个二元运算符，与栈顶两个操作数结合"""
+        precedence, op = operators.pop()
+        right = operands.pop()
+        if precedence == 0:
+            operands[-1] = Assignment(operands[-1], right)
+        else:
+            operands[-1] = BinaryOp(op, operands[-1], right)
     
     def parse_unary(self) -> ASTNode:
         """解析一元运算"""
-        if self.current().type in [TokenType.MINUS, TokenType.NOT]:
+        if self.current().type in self.PREFIX_OPERATORS:
             op = self.advance().value
             operand = self.parse_unary()
             return UnaryOp(op, operand)
@@ -839,6 +2323,10 @@ class Parser:
         """解析基本表达式"""
         token = self.current()
         
+        # 一元运算
+        if token.type in self.PREFIX_OPERATORS:
+            return self.parse_unary()
+        
         # 数字
         if token.type == TokenType.NUMBER:
             self.advance()
@@ -887,7 +2375,303 @@ class Parser:
             self.expect(TokenType.RPAREN)
             return expr
         
-        raise SyntaxError(f"语法错误 (行{token.line}): 意外的token {token.type.name} '{token.value}'")
+        raise SyntaxError(f"语法错误 ({self.location(token)}): 意外的token {token.type.name} '{token.value}'")
+
+
+# ═══════════════════════════════════════════════════════════════
+# 🧹 AST优化（-O1）
+# ═══════════════════════════════════════════════════════════════
+
+# 可折叠的数字字面量（只认ASCII数字，\d 还会匹配全角等数字）
+NUMBER_LITERAL_PATTERN = re.compile(r'[0-9]+(?:\.[0-9]*)?|[0-9]+(?:\.[0-9]*)?e[+-][0-9]+')
+
+
+class Optimizer:
+    """AST优化：常量折叠、删除死分支、零次循环与return之后的语句
+    
+    折叠按C语义计算：整数运算结果须在int范围内，除法与取余向零截断，
+    除数为0、小数取余、结果不是有限值等情况原样保留。
+    """
+    
+    INT_MIN = -2 ** 31
+    INT_MAX = 2 ** 31 - 1
+    
+    COMPARISONS = {
+        '==': lambda a, b: a == b,
+        '!=': lambda a, b: a != b,
+        '<': lambda a, b: a < b,
+        '>': lambda a, b: a > b,
+        '<=': lambda a, b: a <= b,
+        '>=': lambda a, b: a >= b,
+    }
+    
+    ARITHMETIC = {
+        '+': lambda a, b: a + b,
+        '-': lambda a, b: a - b,
+        '*': lambda a, b: a * b,
+    }
+    
+    # 语句节点类 -> 优化方法名；方法返回替换该语句的语句列表
+    STATEMENT_OPTIMIZERS = {
+        VariableDeclaration: 'optimize_variable_declaration',
+        IfStatement: 'optimize_if_statement',
+        LoopStatement: 'optimize_loop_statement',
+        ReturnStatement: 'optimize_return_statement',
+        PrintStatement: 'optimize_print_statement',
+        ExpressionStatement: 'optimize_expression_statement',
+    }
+    
+    def __init__(self):
+        self.statement_optimizers = {
+            node_class: getattr(self, name)
+            for node_class, name in self.STATEMENT_OPTIMIZERS.items()
+        }
+        # 统计：折叠掉的表达式节点数、删除的语句数
+        self.folded = 0
+        self.removed = 0
+    
+    def optimize(self, program: Program) -> Program:
+        """优化整个程序（原地修改并返回）"""
+        program.statements = list(self.optimize_statements(program.statements))
+        return program
+    
+    def optimize_statements(self, statements: Iterable[ASTNode]) -> Iterator[ASTNode]:
+        """逐条优化顶层语句，可直接接在 Parser.iter_statements() 之后"""
+        for statement in statements:
+            yield from self.optimize_block([statement], nested=False)
+    
+    def optimize_block(self, statements: List[ASTNode], nested: bool = True) -> List[ASTNode]:
+        """优化一个语句块及其内部的所有嵌套块（显式栈，不递归）"""
+        # 先序收集嵌套块，逆序处理即保证内层块先于外层
+        blocks = []
+        stack = list(statements)
+        while stack:
+            statement = stack.pop()
+            for body in self.bodies(statement):
+                blocks.append(body)
+                stack.extend(body)
+        for body in reversed(blocks):
+            body[:] = self.simplify(body, nested=True)
+        return self.simplify(statements, nested)
+    
+    @staticmethod
+    def bodies(statement: ASTNode) -> List[List[ASTNode]]:
+        """语句直接包含的语句块"""
+        if isinstance(statement, IfStatement):
+            if statement.else_body is not None:
+                return [statement.then_body, statement.else_body]
+            return [statement.then_body]
+        if isinstance(statement, (FunctionDeclaration, LoopStatement)):
+            return [statement.body]
+        return []
+    
+    def simplify(self, statements: List[ASTNode], nested: bool) -> List[ASTNode]:
+        """优化块内各语句；块内return之后的语句不可达，一并删除"""
+        result = []
+        for index, statement in enumerate(statements):
+            optimize = self.statement_optimizers.get(type(statement))
+            replacement = optimize(statement) if optimize is not None else [statement]
+            for position, item in enumerate(replacement):
+                result.append(item)
+                # 顶层的“返回”不在函数体内，不据此删除后面的函数定义
+                if nested and isinstance(item, ReturnStatement):
+                    self.removed += len(replacement) - position - 1 + len(statements) - index - 1
+                    return result
+        return result
+    
+    # ── 语句 ──
+    
+    def optimize_variable_declaration(self, node: VariableDeclaration) -> List[ASTNode]:
+        if node.value is not None:
+            node.value = self.fold(node.value)
+        return [node]
+    
+    def optimize_if_statement(self, node: IfStatement) -> List[ASTNode]:
+        node.condition = self.fold(node.condition)
+        truth = self.truth(node.condition)
+        if truth is None:
+            return [node]
+        
+        self.removed += 1
+        body = node.then_body if truth else node.else_body
+        if not body:
+            return []
+        # 分支里有声明时保留块作用域，免得与外层同名变量冲突
+        if any(isinstance(item, (VariableDeclaration, FunctionDeclaration)) for item in body):
+            return [IfStatement(Boolean(True), body)]
+        return body
+    
+    def optimize_loop_statement(self, node: LoopStatement) -> List[ASTNode]:
+        node.times = self.fold(node.times)
+        constant = self.constant(node.times)
+        # 循环变量从0开始，次数不大于0时一次也不执行
+        if constant is not None and constant[0] <= 0:
+            self.removed += 1
+            return []
+        return [node]
+    
+    def optimize_return_statement(self, node: ReturnStatement) -> List[ASTNode]:
+        if node.value is not None:
+            node.value = self.fold(node.value)
+        return [node]
+    
+    def optimize_print_statement(self, node: PrintStatement) -> List[ASTNode]:
+        value = self.fold(node.value)
+        # 打印按节点类型选择格式（数字用%g），折成数字会改变输出，此时只保留子表达式的折叠
+        if not isinstance(value, Number) or isinstance(node.value, Number):
+            node.value = value
+        else:
+            self.folded -= 1
+        return [node]
+    
+    def optimize_expression_statement(self, node: ExpressionStatement) -> List[ASTNode]:
+        node.expression = self.fold(node.expression)
+        return [node]
+    
+    # ── 表达式 ──
+    
+    def fold(self, node: ASTNode) -> ASTNode:
+        """折叠表达式中的常量子树（后序、显式栈），返回折叠后的根节点"""
+        # 先序收集内部节点，逆序处理即保证子节点先于父节点
+        order = []
+        stack = [node]
+        while stack:
+            item = stack.pop()
+            if isinstance(item, BinaryOp):
+                order.append(item)
+                stack.append(item.left)
+                stack.append(item.right)
+            elif isinstance(item, UnaryOp):
+                order.append(item)
+                stack.append(item.operand)
+            elif isinstance(item, Assignment):
+                order.append(item)
+                stack.append(item.right)
+            elif isinstance(item, FunctionCall):
+                order.append(item)
+                stack.extend(item.args)
+        
+        # id(原节点) -> 折叠结果
+        replaced = {}
+        for item in reversed(order):
+            if isinstance(item, BinaryOp):
+                item.left = replaced.pop(id(item.left), item.left)
+                item.right = replaced.pop(id(item.right), item.right)
+                result = self.fold_binary(item)
+            elif isinstance(item, UnaryOp):
+                item.operand = replaced.pop(id(item.operand), item.operand)
+                result = self.fold_unary(item)
+            elif isinstance(item, Assignment):
+                item.right = replaced.pop(id(item.right), item.right)
+                continue
+            else:
+                item.args = [replaced.pop(id(arg), arg) for arg in item.args]
+                continue
+            if result is not item:
+                self.folded += 1
+                replaced[id(item)] = result
+        return replaced.get(id(node), node)
+    
+    def fold_binary(self, node: BinaryOp) -> ASTNode:
+        """折叠二元运算，不能折叠时返回原节点"""
+        op = node.op
+        left = self.constant(node.left)
+        
+        # 短路：左侧已能决定结果时右侧在C里根本不求值
+        if left is not None and op in ('&&', '||'):
+            if op == '&&' and not left[0]:
+                return Boolean(False)
+            if op == '||' and left[0]:
+                return Boolean(True)
+        
+        right = self.constant(node.right)
+        if left is None or right is None:
+            return node
+        (a, left_double), (b, right_double) = left, right
+        is_double = left_double or right_double
+        
+        if op == '&&' or op == '||':
+            return Boolean(bool(b))
+        if op in self.COMPARISONS:
+            return Boolean(self.COMPARISONS[op](a, b))
+        if op in self.ARITHMETIC:
+            return self.make_constant(self.ARITHMETIC[op](a, b), is_double) or node
+        if op == '/' and b:
+            if is_double:
+                return self.make_constant(a / b, True) or node
+            return self.make_constant(self.truncate_divide(a, b), False) or node
+        if op == '%' and b and not is_double:
+            return self.make_constant(a - b * self.truncate_divide(a, b), False) or node
+        return node
+    
+    def fold_unary(self, node: UnaryOp) -> ASTNode:
+        """折叠一元运算，不能折叠时返回原节点"""
+        # 负号加数字本身就是负常量的写法
+        if node.op == '-' and isinstance(node.operand, Number):
+            return node
+        constant = self.constant(node.operand)
+        if constant is None:
+            return node
+        value, is_double = constant
+        if node.op == '!':
+            return Boolean(not value)
+        if node.op == '-':
+            return self.make_constant(-value, is_double) or node
+        return node
+    
+    @staticmethod
+    def truncate_divide(a: int, b: int) -> int:
+        """C的整数除法：向零截断"""
+        quotient = abs(a) // abs(b)
+        return quotient if (a < 0) == (b < 0) else -quotient
+    
+    @classmethod
+    def constant(cls, node: ASTNode) -> Optional[tuple]:
+        """常量节点的 (值, 是否小数)；不是可折叠的常量时返回None"""
+        if isinstance(node, Boolean):
+            return (1 if node.value else 0), False
+        if isinstance(node, UnaryOp) and node.op == '-' and isinstance(node.operand, Number):
+            constant = cls.constant(node.operand)
+            if constant is None:
+                return None
+            return -constant[0], constant[1]
+        if not isinstance(node, Number) or not NUMBER_LITERAL_PATTERN.fullmatch(node.value):
+            return None
+        
+        text = node.value
+        if '.' in text or 'e' in text:
+            return float(text), True
+        if len(text) > 1 and text[0] == '0':
+            # C里前导0是八进制
+            if '8' in text or '9' in text:
+                return None
+            value = int(text, 8)
+        else:
+            value = int(text)
+        # 超出int的字面量在C里是long，不参与折叠
+        if value > cls.INT_MAX:
+            return None
+        return value, False
+    
+    def make_constant(self, value: Any, is_double: bool) -> Optional[ASTNode]:
+        """由折叠结果构造常量节点；C里没有对应字面量或会溢出时返回None"""
+        if is_double:
+            if value != value or value in (float('inf'), float('-inf')):
+                return None
+            text = repr(abs(value))
+            negative = value < 0 or (value == 0 and str(value)[0] == '-')
+        else:
+            if not self.INT_MIN < value <= self.INT_MAX:
+                return None
+            text = str(abs(value))
+            negative = value < 0
+        # 负数写成取负，避免生成“--3”这样的记号
+        return UnaryOp('-', Number(text)) if negative else Number(text)
+    
+    def truth(self, node: ASTNode) -> Optional[bool]:
+        """条件的常量真值；不是常量时返回None"""
+        constant = self.constant(node)
+        return None if constant is None else bool(constant[0])
 
 
 # ═══════════════════════════════════════════════════════════════
@@ -913,77 +2697,303 @@ class CCodeGenerator:
         'void': ''
     }
     
-    def __init__(self, ast: Program):
+    # 语句节点类 -> 生成方法名（新增节点类型只需在子类表中加一项并实现对应方法）
+    STATEMENT_GENERATORS = {
+        VariableDeclaration: 'generate_variable_declaration',
+        FunctionDeclaration: 'generate_function_declaration',
+        IfStatement: 'generate_if_statement',
+        LoopStatement: 'generate_loop_statement',
+        ReturnStatement: 'generate_return_statement',
+        PrintStatement: 'generate_print_statement',
+        ExpressionStatement: 'generate_expression_statement',
+    }
+    
+    # 表达式节点类 -> 生成方法名
+    EXPRESSION_GENERATORS = {
+        Identifier: 'generate_identifier',
+        Number: 'generate_number',
+        BinaryOp: 'generate_binary_op',
+        FunctionCall: 'generate_function_call',
+        String: 'generate_string',
+        UnaryOp: 'generate_unary_op',
+        Assignment: 'generate_assignment',
+        Boolean: 'generate_boolean',
+        Null: 'generate_null',
+    }
+    
+    # 常见深度的缩进字符串（只读，多线程生成时所有实例共用）
+    INDENTS = tuple('    ' * depth for depth in range(64))
+    
+    # 流式输出时缓冲的行数达到此值即写出
+    FLUSH_LINES = 1024
+    
+    # 结果必为整数的运算符（比较、逻辑、取余），不论操作数类型
+    INTEGER_OPERATORS = frozenset({'==', '!=', '<', '>', '<=', '>=', '&&', '||', '%'})
+    INTEGER_TYPES = frozenset({'int', 'bool'})
+    
+    # 展开循环的次数上限
+    UNROLL_LIMIT = 8
+    
+    def __init__(self, ast: Program, iterative: bool = False, sink: Optional[TextIO] = None,
+                 unroll: bool = False, jobs: int = 1):
         self.ast = ast
         self.indent = 0
         self.output = []
+        # 循环展开：次数为不超过 UNROLL_LIMIT 的常量时，循环体按次数重复输出
+        self.unroll = unroll
+        # 并行生成的进程数；大于1时各顶层语句分到多个进程生成，输出与串行逐字节相同
+        self.jobs = jobs
+        # 当前打开的各层循环各自占用的缩进层数；层数即嵌套深度，决定循环变量名
+        self.loops = []
+        # 变量名 -> C类型（None表示类型不确定），用于推断循环次数的类型
+        self.variable_types = {}
+        # 流式输出：每条顶层语句生成后把缓冲的行写入sink，不在内存中拼出整份C代码
+        self.sink = sink
+        self.separator = ''
+        # 分派表绑定到本实例，子类覆盖的方法同样生效
+        self.statement_generators = {
+            node_class: getattr(self, name)
+            for node_class, name in self.STATEMENT_GENERATORS.items()
+        }
+        self.expression_generators = {
+            node_class: getattr(self, name)
+            for node_class, name in self.EXPRESSION_GENERATORS.items()
+        }
+        # 迭代模式下用显式栈展开的节点类：只限分派表里仍是内建生成方法的内建节点类，
+        # 子类覆盖的方法与新增的节点类（含内建节点类的子类）照常按分派表调用
+        self.stack_statements = self.builtin_types(
+            self.statement_generators, CCodeGenerator.STATEMENT_GENERATORS,
+            (IfStatement, LoopStatement, FunctionDeclaration))
+        self.stack_expressions = self.builtin_types(
+            self.expression_generators, CCodeGenerator.EXPRESSION_GENERATORS,
+            CCodeGenerator.EXPRESSION_GENERATORS)
+        # 迭代模式：语句与表达式都用显式栈生成，嵌套深度不受递归上限限制
+        self.iterative = iterative
+        if iterative:
+            self.generate_statement = self.generate_statement_iterative
+            self.generate_expression = self.generate_expression_iterative
+    
+    @staticmethod
+    def builtin_types(table: Dict[type, Any], names: Dict[type, str], node_classes) -> frozenset:
+        """node_classes 中分派表仍指向 CCodeGenerator 自身生成方法的节点类"""
+        return frozenset(
+            node_class for node_class in node_classes
+            if getattr(table.get(node_class), '__func__', None) is getattr(CCodeGenerator, names[node_class])
+        )
     
     def emit(self, code: str):
         """输出代码"""
-        indent_str = '    ' * self.indent
+        try:
+            indent_str = self.INDENTS[self.indent]
+        except IndexError:
+            indent_str = self.indentation(self.indent)
         self.output.append(indent_str + code)
     
-    def generate(self) -> str:
-        """生成C代码"""
-        # 头文件
-        self.output.append('// Generated by CNSH Compiler v1.0 (Python)')
-        self.output.append('// DNA追溯码：#龙芯⚡️2026-02-02-CNSH编译输出')
-        self.output.append('// GPG指纹：A2D0092CEE2E5BA87035600924C3704A8CC26D5F')
-        self.output.append('')
-        self.output.append('#include <stdio.h>')
-        self.output.append('#include <stdlib.h>')
-        self.output.append('#include <string.h>')
-        self.output.append('#include <stdbool.h>')
-        self.output.append('')
+    def indentation(self, depth: int) -> str:
+        """第depth层的缩进字符串；超出 INDENTS 的深层缩进现算，不改共用的表"""
+        if depth < len(self.INDENTS):
+            return self.INDENTS[depth]
+        return '    ' * depth
+    
+    def flush(self):
+        """把缓冲的行写入sink（行间以换行分隔，末尾不加换行，与 generate() 的返回值一致）"""
+        if self.output:
+            self.sink.write(self.separator + '\n'.join(self.output))
+            self.separator = '\n'
+            self.output.clear()
+    
+    # 头文件
+    PROLOGUE = [
+        '// Generated by CNSH Compiler v1.0 (Python)',
+        '// DNA追溯码：#龙芯⚡️2026-02-02-CNSH编译输出',
+        '// GPG指纹：A2D0092CEE2E5BA87035600924C3704A8CC26D5F',
+        '',
+        '#include <stdio.h>',
+        '#include <stdlib.h>',
+        '#include <string.h>',
+        '#include <stdbool.h>',
+        '',
+    ]
+    
+    # main函数
+    EPILOGUE = [
+        '',
+        'int main() {',
+        '    主函数();',
+        '    return 0;',
+        '}',
+    ]
+    
+    def generate(self) -> Optional[str]:
+        """生成C代码；流式输出时写入sink并返回None"""
+        self.output.extend(self.PROLOGUE)
         
         # 生成程序体
         self.generate_program(self.ast)
         
-        # main函数
-        self.output.append('')
-        self.output.append('int main() {')
-        self.output.append('    主函数();')
-        self.output.append('    return 0;')
-        self.output.append('}')
+        self.output.extend(self.EPILOGUE)
         
+        if self.sink is not None:
+            self.flush()
+            return None
         return '\n'.join(self.output)
     
+    def generate_fragment(self, node: ASTNode) -> str:
+        """生成单条顶层语句的C代码（增量编译按语句缓存）；出错时恢复输出与缩进，不影响之后的语句"""
+        start, indent, depth = len(self.output), self.indent, len(self.loops)
+        try:
+            self.generate_top_level(node)
+            return '\n'.join(self.output[start:])
+        finally:
+            del self.output[start:]
+            del self.loops[depth:]
+            self.indent = indent
+    
     def generate_program(self, node: Program):
         """生成程序"""
+        if self.jobs > 1 and len(node.statements) > 1:
+            self.generate_parallel(node)
+            return
         for stmt in node.statements:
-            self.generate_statement(stmt)
+            self.generate_top_level(stmt)
+            if self.sink is not None and len(self.output) >= self.FLUSH_LINES:
+                self.flush()
     
-    def generate_statement(self, node: ASTNode):
-        """生成语句"""
-        if isinstance(node, VariableDeclaration):
-            self.generate_variable_declaration(node)
-        elif isinstance(node, FunctionDeclaration):
-            self.generate_function_declaration(node)
-        elif isinstance(node, IfStatement):
-            self.generate_if_statement(node)
-        elif isinstance(node, LoopStatement):
-            self.generate_loop_statement(node)
-        elif isinstance(node, ReturnStatement):
-            self.generate_return_statement(node)
-        elif isinstance(node, PrintStatement):
-            self.generate_print_statement(node)
-        elif isinstance(node, ExpressionStatement):
-            expr_code = self.generate_expression(node.expression)
-            self.emit(f'{expr_code};')
+    def generate_top_level(self, node: ASTNode):
+        """生成一条顶层语句
+        
+        其代码只取决于它自身，不依赖前面的语句：增量编译按语句缓存片段、
+        并行生成按语句分段，都靠这一点保证与整体生成的结果一致。
+        """
+        self.variable_types = {}
+        if self.iterative:
+            self.generate_statement_iterative(node)
+        else:
+            self.generate_statement(node)
+    
+    def generate_range(self, start: int, stop: int) -> tuple:
+        """生成第 [start, stop) 条顶层语句，返回 (行数, 代码)"""
+        statements = self.ast.statements
+        self.output = []
+        for index in range(start, stop):
+            self.generate_top_level(statements[index])
+        lines, self.output = self.output, []
+        return len(lines), '\n'.join(lines)
+    
+    def generate_parallel(self, node: Program):
+        """多进程生成：顶层语句按原顺序切成若干段分给工作进程，再按顺序拼接"""
+        count = len(node.statements)
+        # 每个进程分到多段，各段耗时不均时也能互相补位
+        size = max(1, -(-count // (self.jobs * 8)))
+        bounds = [(start, min(start + size, count)) for start in range(0, count, size)]
+        
+        with ProcessPoolExecutor(
+            max_workers=self.jobs,
+            initializer=_init_codegen_worker,
+            initargs=(type(self), self.ast, self.iterative, self.unroll),
+        ) as executor:
+            for lines, code in executor.map(_generate_range, bounds):
+                # 整段代码作为一项放入输出，'\n'.join 的结果与逐行生成相同
+                if lines:
+                    self.output.append(code)
+                if self.sink is not None:
+                    self.flush()
+    
+    def lookup_generator(self, table: Dict[type, Any], node_class: type) -> Optional[Any]:
+        """沿继承链查找生成方法（节点子类沿用父类的方法），结果记入表中"""
+        generate = None
+        for base in node_class.__mro__:
+            generate = table.get(base)
+            if generate is not None:
+                break
+        table[node_class] = generate
+        return generate
+    
+    def generate_statement(self, node: ASTNode):
+        """生成语句（按节点类型查表分派）"""
+        generate = self.statement_generators.get(type(node))
+        if generate is None:
+            generate = self.lookup_generator(self.statement_generators, type(node))
+            if generate is None:
+                return
+        generate(node)
+    
+    def generate_statement_iterative(self, node: ASTNode):
+        """生成语句（显式栈，不递归）"""
+        # 栈中：语句节点、待输出的行（str）、缩进增量（int）
+        stack = [node]
+        stack_statements = self.stack_statements
+        while stack:
+            item = stack.pop()
+            kind = type(item)
+            if kind is str:
+                self.emit(item)
+            elif kind is int:
+                self.indent += item
+            elif item is None:
+                # 循环结束
+                self.close_loop()
+            elif kind not in stack_statements:
+                # 不含语句块的语句、子类扩展或覆盖的生成方法：按分派表生成
+                generate = self.statement_generators.get(kind)
+                if generate is None:
+                    generate = self.lookup_generator(self.statement_generators, kind)
+                if generate is not None:
+                    generate(item)
+            elif kind is IfStatement:
+                condition = self.generate_expression(item.condition)
+                self.emit(f'if ({condition}) {{')
+                self.indent += 1
+                # 逆序入栈
+                stack.append('}')
+                if item.else_body:
+                    stack.append(-1)
+                    stack.extend(reversed(item.else_body))
+                    stack.append(1)
+                    stack.append('} else {')
+                stack.append(-1)
+                stack.extend(reversed(item.then_body))
+            elif kind is LoopStatement:
+                count = self.unroll_count(item.times) if self.unroll else None
+                if count is not None:
+                    for _ in range(count):
+                        stack += ('}', -1, *reversed(item.body), 1, '{')
+                else:
+                    times = self.generate_expression(item.times)
+                    literal = isinstance(item.times, (Number, Boolean))
+                    self.open_loop(times, None if literal else self.trip_count_type(item.times, times))
+                    stack.append(None)
+                    stack.extend(reversed(item.body))
+            else:
+                # 函数声明
+                return_type = self.TYPE_MAP[item.return_type]
+                params = ', '.join(
+                    f"{self.TYPE_MAP[p.param_type]} {p.name}"
+                    for p in item.params
+                )
+                self.declare_params((p.param_type, p.name) for p in item.params)
+                self.emit(f'{return_type} {item.name}({params}) {{')
+                self.indent += 1
+                stack.append('')
+                stack.append('}')
+                stack.append(-1)
+                stack.extend(reversed(item.body))
     
     def generate_variable_declaration(self, node: VariableDeclaration):
         """生成变量声明"""
         c_type = self.TYPE_MAP[node.var_type]
         value = self.generate_expression(node.value) if node.value else self.DEFAULT_VALUES[c_type]
         self.emit(f'{c_type} {node.name} = {value};')
+        self.declare(node.name, c_type)
     
     def generate_function_declaration(self, node: FunctionDeclaration):
         """生成函数声明"""
         return_type = self.TYPE_MAP[node.return_type]
         params = ', '.join(
-            f"{self.TYPE_MAP[p['type']]} {p['name']}"
+            f"{self.TYPE_MAP[p.param_type]} {p.name}"
             for p in node.params
         )
+        self.declare_params((p.param_type, p.name) for p in node.params)
         
         self.emit(f'{return_type} {node.name}({params}) {{')
         self.indent += 1
@@ -1019,15 +3029,113 @@ class CCodeGenerator:
     
     def generate_loop_statement(self, node: LoopStatement):
         """生成循环语句"""
+        count = self.unroll_count(node.times) if self.unroll else None
+        if count is not None:
+            # 展开：每份循环体各占一个块，块内声明互不冲突
+            for _ in range(count):
+                self.emit('{')
+                self.indent += 1
+                for stmt in node.body:
+                    self.generate_statement(stmt)
+                self.indent -= 1
+                self.emit('}')
+            return
+        
         times = self.generate_expression(node.times)
-        self.emit(f'for (int __i = 0; __i < {times}; __i++) {{')
-        self.indent += 1
+        literal = isinstance(node.times, (Number, Boolean))
+        self.open_loop(times, None if literal else self.trip_count_type(node.times, times))
         
         for stmt in node.body:
             self.generate_statement(stmt)
         
-        self.indent -= 1
-        self.emit('}')
+        self.close_loop()
+    
+    def open_loop(self, times: str, count_type: Optional[str]):
+        """输出循环头
+        
+        次数不是字面量时先算进const局部变量（count_type为其类型），
+        不在每轮迭代重新求值；循环变量按嵌套深度命名，内外层互不遮蔽。
+        """
+        depth = len(self.loops)
+        counter = f'__i{depth}'
+        if count_type is None:
+            self.loops.append(1)
+        else:
+            self.emit('{')
+            self.indent += 1
+            self.emit(f'const {count_type} __n{depth} = {times};')
+            times = f'__n{depth}'
+            self.loops.append(2)
+        self.emit(f'for (int {counter} = 0; {counter} < {times}; {counter}++) {{')
+        self.indent += 1
+    
+    def close_loop(self):
+        """关闭最内层循环"""
+        for _ in range(self.loops.pop()):
+            self.indent -= 1
+            self.emit('}')
+    
+    def unroll_count(self, node: ASTNode) -> Optional[int]:
+        """可展开的循环次数；次数不是不超过 UNROLL_LIMIT 的整数常量时返回None"""
+        constant = Optimizer.constant(node)
+        if constant is None or constant[1] or constant[0] > self.UNROLL_LIMIT:
+            return None
+        return max(constant[0], 0)
+    
+    def trip_count_type(self, node: ASTNode, times: str) -> str:
+        """循环次数（生成的C代码为times）的C类型
+        
+        确定是数值时为int或double，与原比较的结果相同；含文本、空值、函数调用
+        或类型不确定的变量时取表达式自身的类型（__typeof__，不会多求值一次）。
+        """
+        count_type = 'int'
+        stack = [node]
+        while stack:
+            item = stack.pop()
+            if isinstance(item, BinaryOp):
+                if item.op not in self.INTEGER_OPERATORS:
+                    stack.append(item.left)
+                    stack.append(item.right)
+            elif isinstance(item, UnaryOp):
+                if item.op != '!':
+                    stack.append(item.operand)
+            elif isinstance(item, Number):
+                if not self.is_int_literal(item.value):
+                    count_type = 'double'
+            elif isinstance(item, Identifier):
+                variable_type = self.variable_types.get(item.name)
+                if variable_type == 'double':
+                    count_type = 'double'
+                elif variable_type not in self.INTEGER_TYPES:
+                    return f'__typeof__({times})'
+            elif not isinstance(item, Boolean):
+                return f'__typeof__({times})'
+        return count_type
+    
+    @staticmethod
+    def is_int_literal(text: str) -> bool:
+        """是否int范围内的整数字面量（超出范围的在C里是long）"""
+        return text.isdigit() and (len(text) < 10 or int(text) <= Optimizer.INT_MAX)
+    
+    def declare(self, name: str, c_type: str, trusted: Optional[bool] = None):
+        """记录变量的C类型
+        
+        只采信顶层函数的参数与函数体最外层的声明（作用域到函数结束为止）；
+        别处出现同名但类型不同的声明时，该名字不再推断类型。
+        """
+        if trusted is None:
+            trusted = self.indent == 1
+        if name in self.variable_types:
+            if self.variable_types[name] != c_type:
+                self.variable_types[name] = None
+        elif trusted:
+            self.variable_types[name] = c_type
+    
+    def declare_params(self, params: Iterable[tuple]):
+        """记录函数参数 [(类型, 名称), ...] 的类型"""
+        top_level = self.indent == 0
+        for param_type, name in params:
+            self.declare(name, self.TYPE_MAP[param_type], top_level)
     
     def generate_return_statement(self, node: ReturnStatement):
         """生成return语句"""
@@ -1049,130 +3157,1615 @@ class CCodeGenerator:
         else:
             self.emit(f'printf("%d\\n", {value});')
     
+    def generate_expression_statement(self, node: ExpressionStatement):
+        """生成表达式语句"""
+        expr_code = self.generate_expression(node.expression)
+        self.emit(f'{expr_code};')
+    
     def generate_expression(self, node: ASTNode) -> str:
-        """生成表达式"""
-        if isinstance(node, Number):
-            return node.value
-        elif isinstance(node, String):
-            return f'"{node.value}"'
-        elif isinstance(node, Boolean):
-            return 'true' if node.value else 'false'
-        elif isinstance(node, Null):
-            return 'NULL'
-        elif isinstance(node, Identifier):
-            return node.name
-        elif isinstance(node, BinaryOp):
-            left = self.generate_expression(node.left)
-            right = self.generate_expression(node.right)
-            return f'({left} {node.op} {right})'
-        elif isinstance(node, UnaryOp):
-            operand = self.generate_expression(node.operand)
-            return f'({node.op}{operand})'
-        elif isinstance(node, Assignment):
-            left = self.generate_expression(node.left)
-            right = self.generate_expression(node.right)
-            return f'{left} = {right}'
-        elif isinstance(node, FunctionCall):
-            args = ', '.join(self.generate_expression(arg) for arg in node.args)
-            return f'{node.name}({args})'
-        else:
-            return ''
+        """生成表达式（按节点类型查表分派）"""
+        generate = self.expression_generators.get(type(node))
+        if generate is None:
+            generate = self.lookup_generator(self.expression_generators, type(node))
+            if generate is None:
+                return ''
+        return generate(node)
+    
+    def generate_number(self, node: Number) -> str:
+        """生成数字"""
+        return node.value
+    
+    def generate_string(self, node: String) -> str:
+        """生成字符串"""
+        return f'"{node.value}"'
+    
+    def generate_boolean(self, node: Boolean) -> str:
+        """生成布尔值"""
+        return 'true' if node.value else 'false'
+    
+    def generate_null(self, node: Null) -> str:
+        """生成空值"""
+        return 'NULL'
+    
+    def generate_identifier(self, node: Identifier) -> str:
+        """生成标识符"""
+        return node.name
+    
+    def generate_binary_op(self, node: BinaryOp) -> str:
+        """生成二元运算"""
+        left = self.generate_expression(node.left)
+        right = self.generate_expression(node.right)
+        return f'({left} {node.op} {right})'
+    
+    def generate_unary_op(self, node: UnaryOp) -> str:
+        """生成一元运算"""
+        operand = self.generate_expression(node.operand)
+        return f'({node.op}{operand})'
+    
+    def generate_assignment(self, node: Assignment) -> str:
+        """生成赋值"""
+        left = self.generate_expression(node.left)
+        right = self.generate_expression(node.right)
+        return f'{left} = {right}'
+    
+    def generate_function_call(self, node: FunctionCall) -> str:
+        """生成函数调用"""
+        args = ', '.join(self.generate_expression(arg) for arg in node.args)
+        return f'{node.name}({args})'
+    
+    def generate_expression_iterative(self, node: ASTNode) -> str:
+        """生成表达式（显式栈，不递归）"""
+        parts = []
+        # 栈中：表达式节点或已生成的片段（str），逆序入栈
+        stack = [node]
+        stack_expressions = self.stack_expressions
+        while stack:
+            item = stack.pop()
+            kind = type(item)
+            if kind is str:
+                parts.append(item)
+            elif kind not in stack_expressions:
+                # 子类扩展的节点类型、被覆盖的生成方法按分派表生成
+                generate = self.expression_generators.get(kind)
+                if generate is None:
+                    generate = self.lookup_generator(self.expression_generators, kind)
+                if generate is not None:
+                    parts.append(generate(item))
+            elif kind is BinaryOp:
+                stack += (')', item.right, f' {item.op} ', item.left, '(')
+            elif kind is UnaryOp:
+                stack += (')', item.operand, f'({item.op}')
+            elif kind is Assignment:
+                stack += (item.right, ' = ', item.left)
+            elif kind is FunctionCall:
+                stack.append(')')
+                for index in range(len(item.args) - 1, -1, -1):
+                    stack.append(item.args[index])
+                    if index:
+                        stack.append(', ')
+                stack.append(f'{item.name}(')
+            elif kind is Number:
+                parts.append(item.value)
+            elif kind is String:
+                parts.append(f'"{item.value}"')
+            elif kind is Boolean:
+                parts.append('true' if item.value else 'false')
+            elif kind is Null:
+                parts.append('NULL')
+            else:
+                parts.append(item.name)
+        return ''.join(parts)
+
+
+class ArenaCodeGenerator(CCodeGenerator):
+    """C代码生成器（直接遍历紧凑AST，不还原节点对象）"""
+    
+    def __init__(self, arena: ASTArena, iterative: bool = False, sink: Optional[TextIO] = None,
+                 unroll: bool = False, jobs: int = 1):
+        # 数组版本本身就不递归，iterative 仅为与父类的构造参数保持一致
+        super().__init__(arena, sink=sink, unroll=unroll, jobs=jobs)
+        self.arena = arena
+    
+    def generate_top_level(self, index: int):
+        """生成一条顶层语句"""
+        self.variable_types = {}
+        self.generate_statement(index)
+    
+    def generate_statement(self, index: int):
+        """生成语句（显式栈）"""
+        arena = self.arena
+        kinds, data, strings = arena.kinds, arena.data, arena.strings
+        width = arena.WIDTH
+        # 栈中：节点下标、(输出前缩进增量, 行, 输出后缩进增量)，或表示循环结束的None
+        stack = [index]
+        
+        while stack:
+            item = stack.pop()
+            if item is None:
+                self.close_loop()
+                continue
+            if type(item) is tuple:
+                before, line, after = item
+                self.indent += before
+                self.emit(line)
+                self.indent += after
+                continue
+            
+            kind = kinds[item]
+            base = item * width
+            
+            if kind == NodeKind.VARIABLE:
+                c_type = self.TYPE_MAP[strings[data[base]]]
+                value = data[base + 2]
+                value = self.generate_expression(value) if value >= 0 else self.DEFAULT_VALUES[c_type]
+                self.emit(f'{c_type} {strings[data[base + 1]]} = {value};')
+                self.declare(strings[data[base + 1]], c_type)
+            elif kind == NodeKind.FUNCTION:
+                return_type = self.TYPE_MAP[strings[data[base + 2]]]
+                param_list = arena.params(data[base + 1])
+                params = ', '.join(
+                    f'{self.TYPE_MAP[param_type]} {name}'
+                    for param_type, name in param_list
+                )
+                self.declare_params(param_list)
+                self.emit(f'{return_type} {strings[data[base]]}({params}) {{')
+                self.indent += 1
+                stack.append((0, '', 0))
+                stack.append((-1, '}', 0))
+                stack.extend(reversed(arena.children(data[base + 3])))
+            elif kind == NodeKind.IF:
+                condition = self.generate_expression(data[base])
+                self.emit(f'if ({condition}) {{')
+                self.indent += 1
+                stack.append((-1, '}', 0))
+                else_body = data[base + 2]
+                if else_body >= 0 and arena.lists[else_body]:
+                    stack.extend(reversed(arena.children(else_body)))
+                    stack.append((-1, '} else {', 1))
+                stack.extend(reversed(arena.children(data[base + 1])))
+            elif kind == NodeKind.LOOP:
+                body = arena.children(data[base + 1])
+                count = self.unroll_count(data[base]) if self.unroll else None
+                if count is not None:
+                    for _ in range(count):
+                        stack.append((-1, '}', 0))
+                        stack.extend(reversed(body))
+                        stack.append((0, '{', 1))
+                else:
+                    times = self.generate_expression(data[base])
+                    literal = kinds[data[base]] in (NodeKind.NUMBER, NodeKind.BOOLEAN)
+                    self.open_loop(times, None if literal else self.trip_count_type(data[base], times))
+                    stack.append(None)
+                    stack.extend(reversed(body))
+            elif kind == NodeKind.RETURN:
+                if data[base] >= 0:
+                    self.emit(f'return {self.generate_expression(data[base])};')
+                else:
+                    self.emit('return;')
+            elif kind == NodeKind.PRINT:
+                value = self.generate_expression(data[base])
+                
+                # 根据类型选择printf格式
+                value_kind = kinds[data[base]]
+                if value_kind == NodeKind.STRING:
+                    self.emit(f'printf("%s\\n", {value});')
+                elif value_kind == NodeKind.NUMBER:
+                    self.emit(f'printf("%g\\n", (double){value});')
+                else:
+                    self.emit(f'printf("%d\\n", {value});')
+            elif kind == NodeKind.EXPRESSION:
+                self.emit(f'{self.generate_expression(data[base])};')
+    
+    def generate_expression(self, index: int) -> str:
+        """生成表达式（显式栈）"""
+        arena = self.arena
+        kinds, data, strings = arena.kinds, arena.data, arena.strings
+        width = arena.WIDTH
+        parts = []
+        # 栈中：节点下标或已生成的片段（str），逆序入栈
+        stack = [index]
+        
+        while stack:
+            item = stack.pop()
+            if type(item) is str:
+                parts.append(item)
+                continue
+            
+            kind = kinds[item]
+            base = item * width
+            
+            if kind == NodeKind.IDENTIFIER or kind == NodeKind.NUMBER:
+                parts.append(strings[data[base]])
+            elif kind == NodeKind.BINARY:
+                stack += (')', data[base + 2], f' {strings[data[base]]} ', data[base + 1], '(')
+            elif kind == NodeKind.STRING:
+                parts.append(f'"{strings[data[base]]}"')
+            elif kind == NodeKind.CALL:
+                args = arena.children(data[base + 1])
+                stack.append(')')
+                for position in range(len(args) - 1, -1, -1):
+                    stack.append(args[position])
+                    if position:
+                        stack.append(', ')
+                stack.append(f'{strings[data[base]]}(')
+            elif kind == NodeKind.UNARY:
+                stack += (')', data[base + 1], f'({strings[data[base]]}')
+            elif kind == NodeKind.ASSIGNMENT:
+                stack += (data[base + 1], ' = ', data[base])
+            elif kind == NodeKind.BOOLEAN:
+                parts.append('true' if data[base] else 'false')
+            elif kind == NodeKind.NULL:
+                parts.append('NULL')
+        
+        return ''.join(parts)
+    
+    def unroll_count(self, index: int) -> Optional[int]:
+        """可展开的循环次数（常量子树还原成节点后判断）"""
+        if self.arena.kinds[index] not in (NodeKind.NUMBER, NodeKind.BOOLEAN, NodeKind.UNARY):
+            return None
+        return super().unroll_count(self.arena.node(index))
+    
+    def trip_count_type(self, index: int, times: str) -> str:
+        """循环次数（生成的C代码为times）的C类型，与父类相同"""
+        count_type = 'int'
+        arena = self.arena
+        kinds, data, strings = arena.kinds, arena.data, arena.strings
+        width = arena.WIDTH
+        stack = [index]
+        while stack:
+            item = stack.pop()
+            kind = kinds[item]
+            base = item * width
+            if kind == NodeKind.BINARY:
+                if strings[data[base]] not in self.INTEGER_OPERATORS:
+                    stack.append(data[base + 1])
+                    stack.append(data[base + 2])
+            elif kind == NodeKind.UNARY:
+                if strings[data[base]] != '!':
+                    stack.append(data[base + 1])
+            elif kind == NodeKind.NUMBER:
+                if not self.is_int_literal(strings[data[base]]):
+                    count_type = 'double'
+            elif kind == NodeKind.IDENTIFIER:
+                variable_type = self.variable_types.get(strings[data[base]])
+                if variable_type == 'double':
+                    count_type = 'double'
+                elif variable_type not in self.INTEGER_TYPES:
+                    return f'__typeof__({times})'
+            elif kind != NodeKind.BOOLEAN:
+                return f'__typeof__({times})'
+        return count_type
+
+
+# 工作进程里的代码生成器（并行生成时由进程池的 initializer 创建）
+_codegen_worker = None
+
+
+def _init_codegen_worker(generator_class: type, ast: Union[Program, ASTArena],
+                         iterative: bool, unroll: bool):
+    """工作进程初始化：fork 启动时AST随进程继承，不必逐段传送"""
+    global _codegen_worker
+    _codegen_worker = generator_class(ast, iterative=iterative, unroll=unroll)
+
+
+def _generate_range(bounds: tuple) -> tuple:
+    """工作进程任务：生成一段顶层语句"""
+    return _codegen_worker.generate_range(*bounds)
+
+
+# ═══════════════════════════════════════════════════════════════
+# 💾 编译缓存
+# ═══════════════════════════════════════════════════════════════
+
+class CompileCache:
+    """编译缓存：以源码哈希为键，存放审计结果、紧凑AST与C代码"""
+    
+    # 缓存条目格式版本（布局变化时递增）
+    FORMAT = 1
+    
+    def __init__(self, directory: str = '.cnsh_cache'):
+        self.directory = directory
+        # 编译器文件被修改后旧条目作废（与 .pyc 按修改时间失效同理）
+        stat = os.stat(__file__)
+        self.signature = f'{stat.st_mtime_ns}:{stat.st_size}'
+    
+    def key(self, source_code: str, version: str, rules: str = '') -> str:
+        """缓存键：编译器版本与文件签名 + 条目格式 + 字节序 + 审计规则表签名 + 源码内容"""
+        header = f'{version}\0{self.signature}\0{self.FORMAT}\0{sys.byteorder}\0{rules}\0'
+        digest = hashlib.sha256(header.encode())
+        digest.update(source_code.encode('utf-8', 'surrogatepass'))
+        return digest.hexdigest()
+    
+    def path(self, key: str) -> str:
+        """条目路径（按键前两位分目录）"""
+        return os.path.join(self.directory, key[:2], key[2:] + '.cnshc')
+    
+    def load(self, key: str) -> Optional[Dict[str, Any]]:
+        """读取条目；不存在或已损坏时返回None"""
+        try:
+            with open(self.path(key), 'rb') as f:
+                entry = marshal.load(f)
+        except (OSError, EOFError, ValueError, TypeError):
+            return None
+        if not isinstance(entry, dict) or entry.get('key') != key:
+            return None
+        return entry
+    
+    def store(self, key: str, entry: Dict[str, Any]):
+        """写入条目（先写临时文件再改名，并发构建不会读到半截文件）"""
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f'{path}.{os.getpid()}.tmp'
+        with open(temp_path, 'wb') as f:
+            marshal.dump(dict(entry, key=key), f)
+        os.replace(temp_path, path)
+    
+    @staticmethod
+    def pack_findings(findings: List[AuditFinding]) -> List[tuple]:
+        """审计命中转为可marshal的元组"""
+        return [
+            (finding.level.name, finding.reason, finding.offset,
+             finding.line, finding.text, finding.rule)
+            for finding in findings
+        ]
+    
+    @staticmethod
+    def unpack_findings(packed: List[tuple]) -> List[AuditFinding]:
+        """由 pack_findings() 的结果还原审计命中"""
+        return [
+            AuditFinding(AuditLevel[level], reason, offset, line, text, rule)
+            for level, reason, offset, line, text, rule in packed
+        ]
 
 
 # ═══════════════════════════════════════════════════════════════
 # 🚀 CNSH编译器
 # ═══════════════════════════════════════════════════════════════
 
+@dataclass
+class PhaseTiming:
+    """一个阶段的耗时（秒）；CPU时间只计本进程，不含并行代码生成的工作进程"""
+    wall: float = 0.0
+    cpu: float = 0.0
+
+
+@dataclass
+class CompileResult:
+    """编译结果（库接口）：不做任何控制台输出，附带各阶段耗时与规模统计"""
+    success: bool = False
+    error: Optional[str] = None
+    output_path: Optional[str] = None   # 目标输出文件（只在内存中生成时为None）
+    c_code: Optional[str] = None        # 流式输出时为None
+    audit: Optional[str] = None         # 审计级别名：GREEN / YELLOW / RED
+    findings: List[AuditFinding] = field(default_factory=list)
+    written: bool = False               # 是否写了输出文件（内容未变时不重写）
+    cached: bool = False                # 是否命中编译缓存
+    tokens: Optional[int] = None        # token数（命中缓存跳过分词时为None）
+    nodes: Optional[int] = None         # AST节点数（未统计时为None）
+    bytes_emitted: int = 0              # 生成的C代码字节数（UTF-8）
+    # 阶段名 -> 耗时：cache、audit、lex、parse（含-O1优化；流式前端时分词也计入此项）、
+    # codegen（流式输出时含写文件）、write；跳过的阶段不出现
+    phases: Dict[str, PhaseTiming] = field(default_factory=dict)
+    total: PhaseTiming = field(default_factory=PhaseTiming)
+    
+    @contextmanager
+    def phase(self, name: str):
+        """计时一个阶段，同名阶段累加"""
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            timing = self.phases.setdefault(name, PhaseTiming())
+            timing.wall += time.perf_counter() - wall
+            timing.cpu += time.process_time() - cpu
+    
+    def to_dict(self, include_code: bool = False) -> Dict[str, Any]:
+        """转为可JSON序列化的字典"""
+        result = {
+            'success': self.success,
+            'error': self.error,
+            'output_path': self.output_path,
+            'written': self.written,
+            'cached': self.cached,
+            'audit': self.audit,
+            'findings': [
+                {'line': f.line, 'level': f.level.name, 'reason': f.reason, 'text': f.text}
+                for f in self.findings
+            ],
+            'tokens': self.tokens,
+            'nodes': self.nodes,
+            'bytes_emitted': self.bytes_emitted,
+            'phases': {name: {'wall': t.wall, 'cpu': t.cpu} for name, t in self.phases.items()},
+            'total': {'wall': self.total.wall, 'cpu': self.total.cpu},
+        }
+        if include_code:
+            result['c_code'] = self.c_code
+        return result
+
+
+def count_nodes(ast: Union[Program, ASTArena]) -> int:
+    """AST节点数（不含Program本身与函数参数，与紧凑AST的计数一致）"""
+    if isinstance(ast, ASTArena):
+        return len(ast)
+    # 节点类 -> (子节点字段, 子节点列表字段)，取自紧凑AST的布局
+    children = {
+        node_class: (tuple(name for name, code in layout if code == ASTArena.NODE),
+                     tuple(name for name, code in layout if code == ASTArena.LIST))
+        for node_class, (_, layout) in ASTArena.LAYOUT.items()
+    }
+    count = 0
+    stack = list(ast.statements)
+    pop, push, extend = stack.pop, stack.append, stack.extend
+    while stack:
+        node = pop()
+        count += 1
+        nodes, lists = children[type(node)]
+        for name in nodes:
+            child = getattr(node, name)
+            if child is not None:
+                push(child)
+        for name in lists:
+            extend(getattr(node, name) or ())
+    return count
+
+
 class CNSHCompiler:
     """CNSH编译器"""
     
     VERSION = '1.0'
     DNA_CODE = '#龙芯⚡️2026-02-02-CNSH-Python编译器-v1.0'
     
-    def __init__(self):
+    def __init__(self, streaming: bool = False, iterative: bool = False, compact: bool = False,
+                 cache: Optional[CompileCache] = None, stream_output: bool = False,
+                 opt_level: int = 0, unroll: bool = False, verbose: bool = True,
+                 jobs: int = 1):
         self.audit_system = ThreeColorAudit()
+        # 流式模式：词法分析边产出token，语法分析边经环形缓冲消费
+        self.streaming = streaming
+        # 迭代模式：语法分析与代码生成不递归，支持任意深的嵌套
+        self.iterative = iterative
+        # 紧凑模式：AST存为扁平数组，代码生成直接遍历数组
+        self.compact = compact
+        # 编译缓存：命中时跳过审计、词法、语法分析与代码生成；缓存的AST总是紧凑格式
+        self.cache = cache
+        # 流式输出：C代码边生成边写入文件，返回结果中不含 c_code
+        self.stream_output = stream_output
+        # 优化级别：0 不优化；1 常量折叠并删除死代码（解析时逐条语句进行）
+        self.opt_level = opt_level
+        self.optimizer = None
+        # 循环展开：常数次的小循环直接重复输出循环体
+        self.unroll = unroll
+        # 是否输出各阶段的进度信息（批量构建时关闭，只看返回的结果）
+        self.verbose = verbose
+        # 代码生成的并行进程数
+        self.jobs = jobs
+        # 上次编译是否写了输出文件（C代码与原文件相同时不重写）
+        self.written = False
     
-    def compile(self, source_code: str, source_path: str) -> Dict[str, Any]:
-        """编译CNSH代码"""
-        print('🇨🇳 CNSH编译器 v' + self.VERSION + ' (Python版)')
-        print('DNA追溯码：' + self.DNA_CODE)
-        print('━━━━━━━━━━━━━━━━━━\n')
+    def log(self, *args):
+        """输出进度信息"""
+        if self.verbose:
+            print(*args)
+    
+    def print_findings(self, findings: List[AuditFinding], limit: int = 10):
+        """打印审计命中明细"""
+        for finding in findings[:limit]:
+            self.log(f'   行{finding.line}：{finding.level.value} {finding.reason}「{finding.text}」')
+        if len(findings) > limit:
+            self.log(f'   ……共 {len(findings)} 处命中')
+    
+    def parse(self, parser: Parser) -> Union[Program, ASTArena]:
+        """语法分析；紧凑模式（或启用缓存）时逐条语句写入数组，-O1 时逐条优化"""
+        statements = parser.iter_statements()
+        if self.opt_level >= 1:
+            self.optimizer = Optimizer()
+            statements = self.optimizer.optimize_statements(statements)
+        if self.compact or self.cache is not None:
+            return ASTArena.from_statements(statements)
+        return Program(list(statements))
+    
+    def print_optimizer(self):
+        """打印优化统计"""
+        if self.optimizer is not None:
+            self.log(f'🧹 优化（-O{self.opt_level}）...')
+            self.log(f'   折叠 {self.optimizer.folded} 处常量表达式，删除 {self.optimizer.removed} 条语句\n')
+    
+    def code_generator(self, ast: Union[Program, ASTArena],
+                       sink: Optional[TextIO] = None) -> CCodeGenerator:
+        """按AST形式选择代码生成器"""
+        generator_class = ArenaCodeGenerator if isinstance(ast, ASTArena) else CCodeGenerator
+        return generator_class(ast, iterative=self.iterative, sink=sink,
+                               unroll=self.unroll, jobs=self.jobs)
+    
+    def generate(self, ast: Union[Program, ASTArena], output_path: Optional[str]) -> Optional[str]:
+        """代码生成；流式输出时边生成边写文件并返回None（不写文件时照常在内存中生成）"""
+        if not self.stream_output or output_path is None:
+            return self.code_generator(ast).generate()
         
+        # 先写临时文件，生成失败时不留下半截的输出；文件名带进程与线程号，同时构建同一输出互不干扰
+        temp_path = f'{output_path}.{os.getpid()}.{threading.get_ident()}.tmp'
         try:
-            # 三色审计
-            print('🛡️  阶段0：三色审计...')
-            audit_result = self.audit_system.check(source_code)
-            
-            if audit_result.level == AuditLevel.RED:
-                print(f'{audit_result.level.value} 审计阻断：{audit_result.reason}')
-                print('   编译终止')
-                return {
-                    'success': False,
-                    'error': f'三色审计阻断：{audit_result.reason}'
-                }
-            elif audit_result.level == AuditLevel.YELLOW:
-                print(f'{audit_result.level.value} 审计警告：{audit_result.reason}')
-                print('   继续编译，但请注意内容')
+            with open(temp_path, 'w', encoding='utf-8', buffering=1 << 16) as f:
+                self.code_generator(ast, f).generate()
+        except BaseException:
+            # 临时文件可能根本没建成（如目录不存在），删除失败不能掩盖原异常
+            with suppress(OSError):
+                os.remove(temp_path)
+            raise
+        if os.path.isfile(output_path) and filecmp.cmp(temp_path, output_path, shallow=False):
+            os.remove(temp_path)
+            self.written = False
+        else:
+            os.replace(temp_path, output_path)
+            self.written = True
+        return None
+    
+    def write_output(self, output_path: str, c_code: str):
+        """写出C代码；与现有文件内容相同时不重写，保留其修改时间，不触发下游的make"""
+        try:
+            with open(output_path, 'r', encoding='utf-8') as f:
+                if f.read() == c_code:
+                    self.written = False
+                    return
+        except (OSError, UnicodeDecodeError):
+            pass
+        with open(output_path, 'w', encoding='utf-8') as f:
+            f.write(c_code)
+        self.written = True
+    
+    def store_cache(self, key: str, findings: List[AuditFinding],
+                    ast: Optional[ASTArena] = None, c_code: Optional[str] = None):
+        """写入编译缓存；写入失败不影响编译结果"""
+        try:
+            self.cache.store(key, {
+                'findings': self.cache.pack_findings(findings),
+                'ast': ast.pack() if ast is not None else None,
+                'c_code': c_code,
+            })
+        except OSError as e:
+            self.log(f'⚠️  缓存写入失败：{e}')
+    
+    def run(self, source_code: str, output_path: Optional[str] = None,
+            with_nodes: bool = True) -> CompileResult:
+        """编译CNSH代码，返回结构化结果；output_path 为None时只在内存中生成，不写文件
+        
+        verbose=False 时全程不做控制台输出，适合嵌入其他程序。
+        统计AST节点数要多遍历一次语法树，with_nodes=False 时跳过。
+        """
+        result = CompileResult(output_path=output_path)
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            self.compile_into(result, source_code, output_path, with_nodes)
+        except Exception as e:
+            self.log(f'❌ 编译失败：{e}')
+            result.success = False
+            result.error = str(e)
+        result.total = PhaseTiming(time.perf_counter() - wall, time.process_time() - cpu)
+        return result
+    
+    def compile_into(self, result: CompileResult, source_code: str, output_path: Optional[str],
+                     with_nodes: bool = True):
+        """各阶段依次执行，结果与计时记入 result"""
+        self.written = False
+        cache_key = entry = None
+        if self.cache is not None:
+            with result.phase('cache'):
+                # 不同优化选项的产物不同，分开缓存
+                options = f'-O{self.opt_level}' + ('-unroll' if self.unroll else '')
+                cache_key = self.cache.key(source_code, self.VERSION + options,
+                                           self.audit_system.signature)
+                entry = self.cache.load(cache_key)
+            result.cached = entry is not None
+        
+        # 三色审计
+        if entry is not None:
+            self.log('⚡ 缓存命中：沿用缓存的审计结果')
+            findings = self.cache.unpack_findings(entry['findings'])
+        else:
+            self.log('🛡️  阶段0：三色审计...')
+            with result.phase('audit'):
+                findings = self.audit_system.scan(source_code)
+        audit_result = self.audit_system.summarize(findings)
+        result.audit = audit_result.level.name
+        result.findings = audit_result.findings
+        
+        if audit_result.level == AuditLevel.RED:
+            self.log(f'{audit_result.level.value} 审计阻断：{audit_result.reason}')
+            self.print_findings(audit_result.findings)
+            self.log('   编译终止')
+            if entry is None and self.cache is not None:
+                self.store_cache(cache_key, findings)
+            result.error = f'三色审计阻断：{audit_result.reason}'
+            return
+        elif audit_result.level == AuditLevel.YELLOW:
+            self.log(f'{audit_result.level.value} 审计警告：{audit_result.reason}')
+            self.print_findings(audit_result.findings)
+            self.log('   继续编译，但请注意内容')
+        else:
+            self.log(f'{audit_result.level.value} 审计通过：{audit_result.reason}')
+        self.log()
+        
+        ast = c_code = None
+        
+        if entry is not None:
+            c_code = entry['c_code']
+            if c_code is None:
+                # 流式输出时缓存中没有C代码，由缓存的AST重新生成
+                ast = ASTArena.unpack(entry['ast'])
+                self.log('⚡ 缓存命中：跳过词法分析与语法分析\n')
             else:
-                print(f'{audit_result.level.value} 审计通过：{audit_result.reason}')
-            print()
-            
-            # 词法分析
-            print('📝 阶段1：词法分析...')
+                self.log('⚡ 缓存命中：跳过词法分析、语法分析与代码生成\n')
+        else:
             lexer = Lexer(source_code)
-            tokens = lexer.tokenize()
-            print(f'   找到 {len(tokens)} 个token\n')
-            
-            # 语法分析
-            print('🌳 阶段2：语法分析...')
-            parser = Parser(tokens)
-            ast = parser.parse()
-            print('   生成抽象语法树\n')
+            if self.streaming:
+                # 词法+语法分析（流式）：两者交替进行，合计入parse阶段
+                self.log('📝 阶段1+2：词法与语法分析（流式）...')
+                with result.phase('parse'):
+                    tokens = TokenBuffer(lexer.iter_tokens())
+                    parser = Parser(tokens, source_code, iterative=self.iterative)
+                    ast = self.parse(parser)
+                result.tokens = tokens.count
+                self.log(f'   处理 {tokens.count} 个token，生成抽象语法树\n')
+                self.print_optimizer()
+            else:
+                # 词法分析
+                self.log('📝 阶段1：词法分析...')
+                with result.phase('lex'):
+                    tokens = lexer.tokenize_stream()
+                result.tokens = len(tokens)
+                self.log(f'   找到 {len(tokens)} 个token\n')
+                
+                # 语法分析
+                self.log('🌳 阶段2：语法分析...')
+                with result.phase('parse'):
+                    parser = Parser(tokens, iterative=self.iterative)
+                    ast = self.parse(parser)
+                self.log('   生成抽象语法树\n')
+                self.print_optimizer()
+        
+        if ast is not None:
+            if with_nodes:
+                result.nodes = count_nodes(ast)
             
             # 代码生成
-            print('⚙️  阶段3：代码生成...')
-            generator = CCodeGenerator(ast)
-            c_code = generator.generate()
-            print('   生成C代码\n')
-            
-            # 保存输出
-            output_path = source_path.replace('.cnsh', '.c')
-            with open(output_path, 'w', encoding='utf-8') as f:
-                f.write(c_code)
-            
-            print('✅ 编译成功！')
-            print(f'   输出文件：{output_path}\n')
-            
-            print('📦 下一步：')
-            print(f'   gcc {output_path} -o {source_path.replace(".cnsh", "")}')
-            print(f'   ./{source_path.replace(".cnsh", "")}\n')
+            self.log('⚙️  阶段3：代码生成...')
+            with result.phase('codegen'):
+                c_code = self.generate(ast, output_path)
+            self.log('   生成C代码\n')
             
+            # 命中的条目缺C代码（上次是流式输出）时，这次补上
+            if self.cache is not None and (entry is None or c_code is not None):
+                self.store_cache(cache_key, findings, ast, c_code)
+        
+        # 保存输出（流式输出时生成阶段已写入）
+        if c_code is not None:
+            result.bytes_emitted = len(c_code.encode('utf-8'))
+            if output_path is not None:
+                with result.phase('write'):
+                    self.write_output(output_path, c_code)
+        else:
+            result.bytes_emitted = os.path.getsize(output_path)
+        
+        result.success = True
+        result.c_code = c_code
+        result.written = self.written
+    
+    @staticmethod
+    def output_path(source_path: str) -> str:
+        """源文件对应的C文件路径：只替换扩展名，目录名里的“.cnsh”不受影响"""
+        return os.path.splitext(source_path)[0] + '.c'
+    
+    def compile(self, source_code: str, source_path: str) -> Dict[str, Any]:
+        """编译CNSH代码：输出各阶段进度，写入同名的.c文件"""
+        self.log('🇨🇳 CNSH编译器 v' + self.VERSION + ' (Python版)')
+        self.log('DNA追溯码：' + self.DNA_CODE)
+        self.log('━━━━━━━━━━━━━━━━━━\n')
+        
+        output_path = self.output_path(source_path)
+        result = self.run(source_code, output_path, with_nodes=False)
+        if not result.success:
             return {
-                'success': True,
-                'output_path': output_path,
-                'c_code': c_code
+                'success': False,
+                'error': result.error
             }
+        
+        self.log('✅ 编译成功！')
+        if result.written:
+            self.log(f'   输出文件：{output_path}\n')
+        else:
+            self.log(f'   输出文件：{output_path}（内容未变，未重写）\n')
+        
+        self.log('📦 下一步：')
+        executable = os.path.splitext(source_path)[0]
+        self.log(f'   gcc {output_path} -o {executable}')
+        self.log(f'   ./{executable}\n')
+        
+        return {
+            'success': True,
+            'output_path': output_path,
+            'c_code': result.c_code,
+            'audit': result.audit,
+            'written': result.written
+        }
+
+
+def compile_source(source_code: str, output_path: Optional[str] = None, **options) -> CompileResult:
+    """库接口：静默编译一段CNSH代码；options 同 CNSHCompiler 的构造参数"""
+    return CNSHCompiler(verbose=False, **options).run(source_code, output_path)
+
+
+@dataclass
+class CompiledChunk:
+    """增量编译的一块：一条顶层语句"""
+    start: int          # 起始token下标
+    fingerprint: str    # 语句原文（含其后的空白与注释）
+    node: ASTNode
+    code: str           # 生成的C代码片段
+
+
+class IncrementalCompiler:
+    """增量编译：按顶层语句分块，编辑后只重新分词、解析、生成受影响的块
+    
+    顶层语句之间解析器不带状态，一条语句在哪里结束只取决于它其后的第一个token。
+    从受影响的块开始重新解析，一旦解析出的边界与编辑区之后的旧边界重合，
+    其后的块就与上次完全相同；重新解析出的语句再按原文指纹查缓存，
+    内容未变的语句沿用上次的语法树和C代码片段。
+    """
+    
+    def __init__(self, source: str = '', iterative: bool = False, cache_size: int = 4096):
+        self.iterative = iterative
+        self.cache_size = cache_size
+        # 指纹 -> (语句, C代码片段)
+        self.cache: Dict[str, tuple] = {}
+        self.generator = CCodeGenerator(Program([]), iterative=iterative)
+        self.set_source(source)
+    
+    def set_source(self, source: str):
+        """整体替换源码并完整编译一遍"""
+        self.lexer = Lexer(source)
+        self.tokens = self.lexer.tokenize()
+        self.audit = IncrementalAudit(source)
+        self.chunks: List[CompiledChunk] = []
+        # 待重新解析的token下标范围 [起点, 终点)；None表示已全部编译
+        self.dirty = (0, len(self.tokens))
+        self.error = None
+        self.reparse()
+    
+    @property
+    def source(self) -> str:
+        """当前源码"""
+        return self.lexer.source
+    
+    def update(self, source: str) -> int:
+        """提交整份新源码（如编辑器全量同步），求出改动范围后增量编译"""
+        old = self.lexer.source
+        limit = min(len(old), len(source))
+        
+        # 二分求公共前缀、后缀长度，比较在切片上整段进行
+        low, high = 0, limit
+        while low < high:
+            middle = (low + high + 1) // 2
+            if old[:middle] == source[:middle]:
+                low = middle
+            else:
+                high = middle - 1
+        prefix = low
+        
+        low, high = 0, limit - prefix
+        while low < high:
+            middle = (low + high + 1) // 2
+            if old[len(old) - middle:] == source[len(source) - middle:]:
+                low = middle
+            else:
+                high = middle - 1
+        suffix = low
+        
+        return self.edit(TextEdit(prefix, len(old) - suffix, source[prefix:len(source) - suffix]))
+    
+    def edit(self, edit: TextEdit) -> int:
+        """应用一次编辑（偏移按编辑前的源码计），返回重新解析的语句数
+        
+        编辑后源码有语法错误或无法生成C代码时返回0，错误信息记在 self.error，
+        受影响范围保留到下次编辑时一并重新解析。
+        """
+        # 行列号取自增量审计随编辑维护的行表，不重新扫描整份源码
+        start_line, start_column = self.audit.position(edit.start)
+        end_line, end_column = self.audit.position(edit.end)
+        self.lexer.relex(self.tokens, edit)
+        self.audit.edit(start_line, start_column, end_line, end_column, edit.text)
+        
+        first, old_stop, new_stop = self.lexer.relexed
+        delta = new_stop - old_stop
+        
+        def moved(index: int) -> int:
+            """旧token下标在新token序列中的位置"""
+            if index <= first:
+                return index
+            if index >= old_stop:
+                return index + delta
+            return new_stop
+        
+        # 被替换范围内的块边界作废，其后的平移；之前的块不动，两次二分即可定位
+        low = self.chunks_before(first)
+        high = max(low, self.chunks_before(old_stop - 1))
+        if delta:
+            for chunk in itertools.islice(self.chunks, high, None):
+                chunk.start += delta
+        del self.chunks[low:high]
+        
+        if self.dirty is None:
+            self.dirty = (first, new_stop)
+        else:
+            low, high = self.dirty
+            self.dirty = (min(moved(low), first), max(moved(high), new_stop))
+        
+        return self.reparse()
+    
+    def chunks_before(self, token_index: int) -> int:
+        """起点不大于token_index的块数（二分查找）"""
+        chunks = self.chunks
+        low, high = 0, len(chunks)
+        while low < high:
+            middle = (low + high) // 2
+            if chunks[middle].start <= token_index:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+    
+    def chunk_index(self, token_index: int) -> int:
+        """包含第token_index个token的块"""
+        return max(self.chunks_before(token_index) - 1, 0)
+    
+    def reparse(self) -> int:
+        """从脏区所在的块开始重新解析，直到与旧块边界重新对齐"""
+        low, high = self.dirty
+        chunks = self.chunks
+        
+        # 脏区前一个token所在的块也要重新解析：它在哪里结束取决于脏区的第一个token
+        first = self.chunk_index(low - 1)
+        start = chunks[first].start if chunks else 0
+        stop = first
+        
+        parser = Parser(self.tokens, self.lexer.source, iterative=self.iterative)
+        parser.seek(start)
+        new_chunks = []
+        try:
+            for node in parser.iter_statements():
+                new_chunks.append(self.compile_chunk(start, parser.pos, node))
+                start = parser.pos
+                # 越过脏区后，边界与某个旧块起点重合即可停止
+                while stop < len(chunks) and chunks[stop].start < start:
+                    stop += 1
+                if start >= high and stop < len(chunks) and chunks[stop].start == start:
+                    break
+            else:
+                stop = len(chunks)
+        except SyntaxError as e:
+            self.error = str(e)
+            return 0
+        except Exception as e:
+            # 其他阶段的错误（如输入到一半的未知类型名）同样记下，等下次编辑再重新解析
+            self.error = f'编译失败：{type(e).__name__}: {e}'
+            return 0
+        
+        chunks[first:stop] = new_chunks
+        self.dirty = None
+        self.error = None
+        return len(new_chunks)
+    
+    def compile_chunk(self, start: int, end: int, node: ASTNode) -> CompiledChunk:
+        """token下标 [start, end) 的语句：按原文指纹复用语法树和C代码片段"""
+        tokens = self.tokens
+        fingerprint = self.lexer.source[tokens[start].offset:tokens[end].offset]
+        cached = self.cache.get(fingerprint)
+        if cached is None:
+            cached = (node, self.generator.generate_fragment(node))
+            if len(self.cache) >= self.cache_size:
+                self.cache.clear()
+            self.cache[fingerprint] = cached
+        return CompiledChunk(start, fingerprint, *cached)
+    
+    def program(self) -> Program:
+        """当前的语法树"""
+        return Program([chunk.node for chunk in self.chunks])
+    
+    def c_code(self) -> str:
+        """拼接各块的C代码片段"""
+        generator = self.generator
+        return '\n'.join(itertools.chain(
+            generator.PROLOGUE,
+            (chunk.code for chunk in self.chunks),
+            generator.EPILOGUE,
+        ))
+    
+    def result(self) -> Dict[str, Any]:
+        """当前源码的编译结果（与 CNSHCompiler.compile 的返回格式一致，不写文件）"""
+        if self.dirty is not None:
+            return {'success': False, 'error': self.error}
+        audit_result = self.audit.result()
+        if audit_result.level == AuditLevel.RED:
+            return {'success': False, 'error': f'三色审计阻断：{audit_result.reason}'}
+        return {'success': True, 'c_code': self.c_code()}
+
+
+# ═══════════════════════════════════════════════════════════════
+# 🔌 常驻编译服务
+# ═══════════════════════════════════════════════════════════════
+
+class CompileServer:
+    """常驻编译服务：本地套接字上每行一个JSON请求，每行一个JSON响应
+    
+    请求：{"id": 1, "document": "a.cnsh", "source": "...", "code": false}
+    同一文档的编译状态（IncrementalCompiler）常驻内存，按键后只重编受影响的语句；
+    同一文档的新请求到达时，尚未完成的旧请求作废，响应 {"id": ..., "cancelled": true}。
+    {"op": "close", "document": ...} 释放文档的编译状态。
+    """
+    
+    # 单个请求（一行）的长度上限
+    MAX_REQUEST = 1 << 26
+    
+    def __init__(self, iterative: bool = False, max_documents: int = 64):
+        self.iterative = iterative
+        self.max_documents = max_documents
+        # 文档名 -> 增量编译器（按最近使用排序）；编译在线程中进行，增删须持锁
+        self.documents: Dict[str, IncrementalCompiler] = {}
+        self.documents_lock = threading.Lock()
+        # 文档名 -> 尚未完成的请求
+        self.pending: Dict[str, 'asyncio.Task'] = {}
+        # 文档名 -> 锁：同一文档的编译与关闭依次进行；只在有请求使用时存在
+        self.locks: Dict[str, 'asyncio.Lock'] = {}
+        # 文档名 -> 正在持有或等待该锁的请求数，降为0时连同锁一起删除
+        self.lock_users: Dict[str, int] = {}
+    
+    async def serve(self, path: Optional[str] = None, port: Optional[int] = None):
+        """监听Unix套接字（path）或本机TCP端口（port），直到被取消"""
+        if path is not None:
+            self.remove_stale_socket(path)
+            server = await asyncio.start_unix_server(self.handle_client, path, limit=self.MAX_REQUEST)
+        else:
+            server = await asyncio.start_server(self.handle_client, '127.0.0.1', port,
+                                                limit=self.MAX_REQUEST)
+        async with server:
+            await server.serve_forever()
+    
+    @staticmethod
+    def remove_stale_socket(path: str):
+        """删除上次遗留的套接字文件；路径上是别的文件时报错，不误删"""
+        try:
+            mode = os.lstat(path).st_mode
+        except FileNotFoundError:
+            return
+        if not stat.S_ISSOCK(mode):
+            raise FileExistsError(f'{path} 已存在且不是套接字')
+        os.remove(path)
+    
+    async def handle_client(self, reader: 'asyncio.StreamReader', writer: 'asyncio.StreamWriter'):
+        """处理一个连接：请求并发处理，完成一个回复一个"""
+        write_lock = asyncio.Lock()
+        tasks = set()
+        
+        async def respond(response: Dict[str, Any]):
+            async with write_lock:
+                writer.write(json.dumps(response, ensure_ascii=False).encode('utf-8') + b'\n')
+                await writer.drain()
+        
+        async def run(request: Dict[str, Any], task: 'asyncio.Task'):
+            # 请求在另一个任务中执行：被取代时哪怕还没开始执行，也照样回复
+            await asyncio.wait({task})
+            if task.cancelled():
+                response = {'id': request.get('id'), 'cancelled': True}
+            elif task.exception() is not None:
+                response = {'id': request.get('id'), 'success': False,
+                            'error': f'内部错误：{type(task.exception()).__name__}: {task.exception()}'}
+            else:
+                response = task.result()
+            await respond(response)
+        
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                    if not isinstance(request, dict):
+                        raise ValueError('请求须为JSON对象')
+                except ValueError as e:
+                    await respond({'id': None, 'success': False, 'error': f'请求格式错误：{e}'})
+                    continue
+                document = request.get('document')
+                if document is not None and not isinstance(document, str):
+                    await respond({'id': request.get('id'), 'success': False,
+                                   'error': '请求格式错误：document 须为字符串'})
+                    continue
+                
+                task = asyncio.ensure_future(self.handle_request(request))
+                for item in (task, asyncio.ensure_future(run(request, task))):
+                    tasks.add(item)
+                    item.add_done_callback(tasks.discard)
+                if document is not None:
+                    # 新请求取代同一文档尚未完成的旧请求
+                    previous = self.pending.get(document)
+                    if previous is not None:
+                        previous.cancel()
+                    self.pending[document] = task
+                    task.add_done_callback(lambda done, document=document: self.finish(document, done))
+        except (ConnectionError, ValueError):
+            # 连接中断，或单行超过 MAX_REQUEST
+            pass
+        except asyncio.CancelledError:
+            # 服务停止：连接处理到此结束
+            pass
+        finally:
+            for task in tasks:
+                task.cancel()
+            writer.close()
+    
+    def finish(self, document: str, task: 'asyncio.Task'):
+        """请求结束后不再作为该文档的待办"""
+        if self.pending.get(document) is task:
+            del self.pending[document]
+    
+    @asynccontextmanager
+    async def document_lock(self, document: str):
+        """持有文档的锁；最后一个使用者离开时删除锁，不随文档名累积"""
+        lock = self.locks.get(document)
+        if lock is None:
+            lock = self.locks[document] = asyncio.Lock()
+        self.lock_users[document] = self.lock_users.get(document, 0) + 1
+        try:
+            async with lock:
+                yield
+        finally:
+            self.lock_users[document] -= 1
+            if not self.lock_users[document]:
+                del self.lock_users[document]
+                del self.locks[document]
+    
+    async def handle_request(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        """执行一个请求"""
+        document = request.get('document')
+        if request.get('op', 'compile') == 'close':
+            if document is not None:
+                # 等进行中的编译结束再释放，免得它随后又把文档放回去
+                async with self.document_lock(document):
+                    with self.documents_lock:
+                        self.documents.pop(document, None)
+            return {'id': request.get('id'), 'success': True}
+        
+        source = request.get('source')
+        if not isinstance(source, str):
+            return {'id': request.get('id'), 'success': False, 'error': '缺少 source'}
+        
+        loop = asyncio.get_event_loop()
+        if document is None:
+            # 一次性编译，不保留状态
+            future = loop.run_in_executor(None, self.compile_document, None, source)
+            response = await future
+        else:
+            # 排队期间被新请求取代时，在这里就会被取消，不做无用的编译
+            async with self.document_lock(document):
+                future = loop.run_in_executor(None, self.compile_document, document, source)
+                try:
+                    response = await asyncio.shield(future)
+                except asyncio.CancelledError:
+                    # 已开始的编译无法中断：等它结束再放开锁，结果丢弃
+                    await asyncio.wait({future})
+                    raise
+        
+        response['id'] = request.get('id')
+        response['document'] = document
+        if not request.get('code'):
+            response.pop('c_code', None)
+        return response
+    
+    def compile_document(self, document: Optional[str], source: str) -> Dict[str, Any]:
+        """编译文档的新内容（在线程中执行），返回结果与诊断信息；出错时返回错误信息，不抛出"""
+        compiler = None
+        if document is not None:
+            with self.documents_lock:
+                compiler = self.documents.pop(document, None)
+        try:
+            if compiler is None:
+                compiler = IncrementalCompiler(source, iterative=self.iterative)
+            else:
+                compiler.update(source)
             
+            response = compiler.result()
+            audit_result = compiler.audit.result()
+            response['audit'] = audit_result.level.name
+            response['findings'] = [
+                {'line': finding.line, 'level': finding.level.name,
+                 'reason': finding.reason, 'text': finding.text}
+                for finding in audit_result.findings
+            ]
         except Exception as e:
-            print(f'❌ 编译失败：{e}')
-            return {
-                'success': False,
-                'error': str(e)
-            }
+            response = {'success': False, 'error': f'编译失败：{type(e).__name__}: {e}'}
+        finally:
+            if document is not None and compiler is not None:
+                # 重新插入以记为最近使用；超出上限时丢弃最久未用的文档
+                with self.documents_lock:
+                    self.documents[document] = compiler
+                    while len(self.documents) > self.max_documents:
+                        del self.documents[next(iter(self.documents))]
+        return response
+
+
+# ═══════════════════════════════════════════════════════════════
+# 👀 文件监视
+# ═══════════════════════════════════════════════════════════════
+
+class SourceWatcher:
+    """监视 .cnsh 文件的变化：Linux 上用 inotify（经 ctypes 调用），否则按修改时间与大小轮询
+    
+    目录递归监视其中所有 .cnsh 文件（跳过 .git、.cnsh_cache 等以点开头的目录），
+    单独给出的文件只监视它本身。
+    """
+    
+    # <sys/inotify.h> 中的事件位
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    IN_ISDIR = 0x40000000
+    WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+    
+    # struct inotify_event 的定长部分：wd, mask, cookie, len
+    EVENT_HEADER = struct.Struct('iIII')
+    
+    # 收到事件后再等这么久，把一次保存产生的多个事件合并成一次编译
+    DEBOUNCE = 0.05
+    
+    def __init__(self, directories: Iterable[str], files: Iterable[str] = (),
+                 interval: float = 0.5, poll: bool = False):
+        self.directories = list(directories)
+        self.files = {os.path.normpath(path) for path in files}
+        self.interval = interval
+        self.fd = None
+        # inotify 监视号 -> (目录, 是否递归)
+        self.watches: Dict[int, tuple] = {}
+        # 尚未报告的警告（如 inotify 中途不可用而改为轮询），由调用方取走输出
+        self.warnings: List[str] = []
+        if not poll:
+            self.start_inotify()
+        self.previous = self.snapshot() if self.fd is None else {}
+    
+    @property
+    def backend(self) -> str:
+        """当前使用的监视方式"""
+        return 'inotify' if self.fd is not None else f'轮询，每{self.interval}秒'
+    
+    def start_inotify(self):
+        """启用 inotify；不可用（非Linux、监视数超限等）时保持轮询"""
+        if not sys.platform.startswith('linux'):
+            return
+        try:
+            self.libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+            fd = self.libc.inotify_init1(os.O_CLOEXEC)
+        except (OSError, AttributeError):
+            return
+        if fd < 0:
+            return
+        self.fd = fd
+        try:
+            for directory in self.directories:
+                self.add_tree(directory)
+            for path in self.files:
+                self.add_watch(os.path.dirname(path) or '.', recursive=False)
+        except OSError:
+            self.close()
+    
+    def add_watch(self, directory: str, recursive: bool):
+        """监视一个目录"""
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), self.WATCH_MASK)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno), directory)
+        known = self.watches.get(wd)
+        self.watches[wd] = (directory, recursive or (known is not None and known[1]))
+    
+    def add_tree(self, directory: str) -> List[str]:
+        """递归监视目录，返回其中已有的 .cnsh 文件"""
+        found = []
+        for root, dirs, names in os.walk(directory):
+            dirs[:] = [name for name in dirs if not name.startswith('.')]
+            self.add_watch(root, recursive=True)
+            found.extend(os.path.join(root, name) for name in names if name.endswith('.cnsh'))
+        return found
+    
+    def close(self):
+        """释放 inotify"""
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+            self.watches.clear()
+    
+    def snapshot(self) -> Dict[str, tuple]:
+        """所有被监视的 .cnsh 文件 -> (修改时间, 大小)"""
+        result = {}
+        stack = list(self.directories)
+        while stack:
+            try:
+                entries = list(os.scandir(stack.pop()))
+            except OSError:
+                continue
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        if not entry.name.startswith('.'):
+                            stack.append(entry.path)
+                    elif entry.name.endswith('.cnsh'):
+                        stat = entry.stat()
+                        result[entry.path] = (stat.st_mtime_ns, stat.st_size)
+                except OSError:
+                    continue
+        for path in self.files:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            result[path] = (stat.st_mtime_ns, stat.st_size)
+        return result
+    
+    def sources(self) -> List[str]:
+        """当前所有被监视的 .cnsh 文件"""
+        return sorted(self.snapshot())
+    
+    def wait(self) -> List[str]:
+        """阻塞到有 .cnsh 文件被创建或修改，返回这些文件（已删除的不含在内）"""
+        while True:
+            if self.fd is not None:
+                try:
+                    changed = self.wait_inotify()
+                except OSError as e:
+                    # 新目录超出监视数上限等：退回轮询
+                    self.close()
+                    self.warnings.append(f'inotify 不可用（{e}），改为{self.backend}')
+                    self.previous = self.snapshot()
+                    continue
+            else:
+                changed = self.wait_polling()
+            changed = sorted(path for path in changed if os.path.isfile(path))
+            if changed:
+                return changed
+    
+    def wait_polling(self) -> set:
+        """轮询：比较前后两次的修改时间与大小"""
+        time.sleep(self.interval)
+        current = self.snapshot()
+        changed = {path for path, signature in current.items()
+                   if self.previous.get(path) != signature}
+        self.previous = current
+        return changed
+    
+    def wait_inotify(self) -> set:
+        """读取 inotify 事件，直到一段时间内不再有新事件"""
+        changed = set()
+        while True:
+            ready, _, _ = select.select([self.fd], [], [], self.DEBOUNCE if changed else None)
+            if not ready:
+                return changed
+            changed.update(self.parse_events(os.read(self.fd, 1 << 16)))
+    
+    def parse_events(self, data: bytes) -> Iterator[str]:
+        """解析一批 inotify 事件，产出有变化的 .cnsh 文件"""
+        header = self.EVENT_HEADER
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = header.unpack_from(data, offset)
+            offset += header.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+            offset += length
+            
+            if mask & self.IN_Q_OVERFLOW:
+                # 事件队列溢出：全部重新检查（内容未变的由缓存直接给出，且不重写输出）
+                yield from self.snapshot()
+                continue
+            if mask & self.IN_IGNORED:
+                # 目录已删除
+                self.watches.pop(wd, None)
+                continue
+            watch = self.watches.get(wd)
+            if watch is None:
+                continue
+            directory, recursive = watch
+            path = os.path.join(directory, name)
+            
+            if mask & self.IN_ISDIR:
+                if recursive and not name.startswith('.'):
+                    # 新建或移入的子目录：加入监视，其中已有的文件也算变化
+                    yield from self.add_tree(path)
+            elif mask & (self.IN_CLOSE_WRITE | self.IN_MOVED_TO):
+                if recursive and name.endswith('.cnsh'):
+                    yield path
+                elif os.path.normpath(path) in self.files:
+                    yield os.path.normpath(path)
 
 
 # ═══════════════════════════════════════════════════════════════
 # 🎯 命令行入口
 # ═══════════════════════════════════════════════════════════════
 
+def audit_main(argv: List[str]) -> int:
+    """审计命令：流式审计（支持GB级文件）"""
+    parser = argparse.ArgumentParser(
+        prog='cnsh_compiler.py audit',
+        description='流式三色审计，内存占用与文件大小无关'
+    )
+    parser.add_argument('paths', nargs='+', help='待审计的文件')
+    parser.add_argument('--chunk-size', type=int, default=1 << 20,
+                        help='每次读取的字符数（默认1M）')
+    args = parser.parse_args(argv)
+    
+    audit = ThreeColorAudit()
+    blocked = failed = False
+    
+    for path in args.paths:
+        print(f'🛡️  三色审计：{path}')
+        counts = {AuditLevel.RED: 0, AuditLevel.YELLOW: 0}
+        try:
+            for finding in audit.iter_file(path, args.chunk_size):
+                counts[finding.level] += 1
+                print(f'   行{finding.line}（偏移{finding.offset}）：'
+                      f'{finding.level.value} {finding.reason}「{finding.text}」')
+        except FileNotFoundError:
+            # 报告后继续审计其余文件
+            print(f'错误：文件不存在 {path}\n')
+            failed = True
+            continue
+        except (OSError, UnicodeDecodeError) as e:
+            print(f'错误：{e}\n')
+            failed = True
+            continue
+        
+        if counts[AuditLevel.RED]:
+            blocked = True
+            print(f'{AuditLevel.RED.value} 审计阻断：共 {sum(counts.values())} 处命中\n')
+        elif counts[AuditLevel.YELLOW]:
+            print(f'{AuditLevel.YELLOW.value} 审计警告：共 {counts[AuditLevel.YELLOW]} 处命中\n')
+        else:
+            print(f'{AuditLevel.GREEN.value} 审计通过：内容安全\n')
+    
+    return 1 if blocked or failed else 0
+
+
+def watch_main(argv: List[str]) -> int:
+    """监视命令：文件一变就重新编译，C代码未变时不重写输出"""
+    parser = argparse.ArgumentParser(
+        prog='cnsh_compiler.py watch',
+        description='监视目录或文件，.cnsh 保存后自动重新编译'
+    )
+    parser.add_argument('paths', nargs='+', help='监视的目录（递归）、文件或通配符')
+    parser.add_argument('--poll', action='store_true',
+                        help='不用 inotify，按修改时间与大小轮询')
+    parser.add_argument('--interval', type=float, default=0.5,
+                        help='轮询间隔秒数（默认0.5）')
+    add_compile_options(parser)
+    args = parser.parse_args(argv)
+    
+    options = compile_options(args)
+    # 监视模式总是经过编译缓存：改回旧内容时直接命中
+    if options['cache'] is None:
+        options['cache'] = CompileCache(args.cache_dir)
+    
+    directories = [path for path in args.paths if os.path.isdir(path)]
+    files = collect_sources(path for path in args.paths if not os.path.isdir(path))
+    watcher = SourceWatcher(directories, files, interval=args.interval, poll=args.poll)
+    
+    try:
+        sources = watcher.sources()
+        print(f'👀 监视 {len(sources)} 个文件（{watcher.backend}），Ctrl+C 停止')
+        for result in build_files(sources, options):
+            print_build_result(result)
+        while True:
+            changed = watcher.wait()
+            for warning in watcher.warnings:
+                print(f'⚠️  {warning}')
+            watcher.warnings.clear()
+            print(f'\n[{time.strftime("%H:%M:%S")}] {len(changed)} 个文件有变化')
+            for result in build_files(changed, options):
+                print_build_result(result)
+    except KeyboardInterrupt:
+        print('\n停止监视')
+    finally:
+        watcher.close()
+    return 0
+
+
+def serve_main(argv: List[str]) -> int:
+    """服务命令：常驻编译服务，编辑器经本地套接字请求编译"""
+    parser = argparse.ArgumentParser(
+        prog='cnsh_compiler.py serve',
+        description='常驻编译服务：每行一个JSON请求/响应，同一文档的新请求取代旧请求'
+    )
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('--socket', help='监听的Unix套接字路径')
+    group.add_argument('--port', type=int, default=8765,
+                       help='监听的本机TCP端口（默认8765，仅限127.0.0.1）')
+    parser.add_argument('--iterative', action='store_true',
+                        help='迭代模式：显式栈解析与生成，支持极深的嵌套')
+    args = parser.parse_args(argv)
+    
+    if args.socket:
+        # 先检查套接字路径，不是套接字的文件不删除，也不显示已启动
+        try:
+            CompileServer.remove_stale_socket(args.socket)
+        except FileExistsError as e:
+            print(f'错误：{e}')
+            return 1
+    
+    server = CompileServer(iterative=args.iterative)
+    where = args.socket if args.socket else f'127.0.0.1:{args.port}'
+    print(f'🔌 编译服务已启动：{where}（Ctrl+C 停止）')
+    try:
+        asyncio.run(server.serve(args.socket, args.port))
+    except KeyboardInterrupt:
+        print('编译服务已停止')
+    return 0
+
+
+def add_compile_options(parser: argparse.ArgumentParser):
+    """编译与批量构建共用的选项"""
+    parser.add_argument('--stream', action='store_true',
+                        help='流式前端：边分词边解析，内存占用恒定')
+    parser.add_argument('--iterative', action='store_true',
+                        help='迭代模式：显式栈解析与生成，支持极深的嵌套')
+    parser.add_argument('--compact', action='store_true',
+                        help='紧凑AST：节点存为扁平数组，大程序内存占用更低')
+    parser.add_argument('--stream-output', action='store_true',
+                        help='流式输出：C代码边生成边写入文件，不在内存中保留整份')
+    parser.add_argument('--cache', action='store_true',
+                        help='启用编译缓存：源码未变时跳过审计、分析与生成')
+    parser.add_argument('--cache-dir', default='.cnsh_cache',
+                        help='缓存目录（默认 .cnsh_cache）')
+    parser.add_argument('-O', dest='opt_level', type=int, choices=(0, 1), default=0,
+                        metavar='级别', help='优化级别：-O1 常量折叠并删除死代码（默认 -O0）')
+    parser.add_argument('--unroll', action='store_true',
+                        help=f'循环展开：次数为不超过{CCodeGenerator.UNROLL_LIMIT}的常量时重复输出循环体')
+
+
+def compile_options(args: argparse.Namespace) -> Dict[str, Any]:
+    """命令行参数 -> CNSHCompiler 的构造参数"""
+    return {
+        'streaming': args.stream,
+        'iterative': args.iterative,
+        'compact': args.compact,
+        'cache': CompileCache(args.cache_dir) if args.cache else None,
+        'stream_output': args.stream_output,
+        'opt_level': args.opt_level,
+        'unroll': args.unroll,
+    }
+
+
+def collect_sources(patterns: Iterable[str]) -> List[str]:
+    """展开目录（递归查找 .cnsh）与通配符，按给出的顺序去重"""
+    paths = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            matches = sorted(glob.glob(os.path.join(pattern, '**', '*.cnsh'), recursive=True))
+        elif glob.has_magic(pattern):
+            matches = sorted(glob.glob(pattern, recursive=True))
+        else:
+            # 普通路径原样保留，不存在时由构建结果报告
+            matches = [pattern]
+        paths.extend(matches)
+    return list(dict.fromkeys(paths))
+
+
+def build_file(path: str, options: Dict[str, Any]) -> Dict[str, Any]:
+    """静默编译一个文件，返回可跨进程传递的结果（批量构建的单个任务）"""
+    start = time.perf_counter()
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            source_code = f.read()
+        result = CNSHCompiler(verbose=False, **options).compile(source_code, path)
+    except (OSError, UnicodeDecodeError) as e:
+        result = {'success': False, 'error': str(e)}
+    # C代码已写入输出文件，不再传回主进程
+    result.pop('c_code', None)
+    result['path'] = path
+    result['seconds'] = time.perf_counter() - start
+    return result
+
+
+def build_files(paths: List[str], options: Dict[str, Any], jobs: int = 1) -> Iterator[Dict[str, Any]]:
+    """批量编译，按 paths 的顺序逐个产出结果；jobs > 1 时分派到多个进程"""
+    if jobs <= 1 or len(paths) <= 1:
+        for path in paths:
+            yield build_file(path, options)
+        return
+    
+    # 文件多时每次给工作进程派一批，减少进程间往返
+    chunksize = max(1, len(paths) // (jobs * 8))
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        yield from executor.map(build_file, paths, itertools.repeat(options), chunksize=chunksize)
+
+
+def print_build_result(result: Dict[str, Any]):
+    """打印一个文件的构建结果"""
+    if not result['success']:
+        print(f'❌ {result["path"]}：{result["error"]}')
+        return
+    note = f'{result["seconds"]:.3f}秒'
+    if not result['written']:
+        note += '，C代码未变，未重写'
+    if result['audit'] == AuditLevel.YELLOW.name:
+        print(f'{AuditLevel.YELLOW.value} {result["path"]} -> {result["output_path"]}（审计警告，{note}）')
+    else:
+        print(f'✅ {result["path"]} -> {result["output_path"]}（{note}）')
+
+
+def build_main(argv: List[str]) -> int:
+    """构建命令：并行编译多个文件，任一失败则返回非0"""
+    parser = argparse.ArgumentParser(
+        prog='cnsh_compiler.py build',
+        description='批量编译目录或通配符匹配到的CNSH文件'
+    )
+    parser.add_argument('paths', nargs='+', help='CNSH文件、目录（递归）或通配符')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count() or 1,
+                        help='并行进程数（默认为CPU核数）')
+    add_compile_options(parser)
+    args = parser.parse_args(argv)
+    
+    paths = collect_sources(args.paths)
+    if not paths:
+        print('错误：没有找到 .cnsh 文件')
+        return 1
+    
+    print(f'🔨 批量构建：{len(paths)} 个文件，{args.jobs} 个进程')
+    start = time.perf_counter()
+    failed = warned = 0
+    
+    for result in build_files(paths, compile_options(args), args.jobs):
+        if not result['success']:
+            failed += 1
+        elif result['audit'] == AuditLevel.YELLOW.name:
+            warned += 1
+        print_build_result(result)
+    
+    elapsed = time.perf_counter() - start
+    print(f'\n共 {len(paths)} 个文件：成功 {len(paths) - failed}（其中审计警告 {warned}），'
+          f'失败 {failed}，用时 {elapsed:.2f}秒')
+    return 1 if failed else 0
+
+
+# 子命令
+COMMANDS = {
+    'audit': audit_main,
+    'build': build_main,
+    'serve': serve_main,
+    'watch': watch_main,
+}
+
+
 def main():
     """命令行入口"""
+    if len(sys.argv) >= 2 and sys.argv[1] in COMMANDS:
+        sys.exit(COMMANDS[sys.argv[1]](sys.argv[2:]))
+    
     if len(sys.argv) < 2:
-        print('用法: python3 cnsh_compiler.py <文件.cnsh>')
+        print('用法: python3 cnsh_compiler.py <文件.cnsh> [--stream] [--stream-output] [--iterative] [--compact] [--cache] [-O1] [--unroll] [-j 进程数] [--profile json]')
+        print('      python3 cnsh_compiler.py build <目录|文件|通配符>... [-j 进程数]')
+        print('      python3 cnsh_compiler.py watch <目录|文件>... [--poll]')
+        print('      python3 cnsh_compiler.py serve [--socket 路径 | --port 端口]')
+        print('      python3 cnsh_compiler.py audit <文件>...')
         print('示例: python3 cnsh_compiler.py hello.cnsh')
         sys.exit(1)
     
-    source_path = sys.argv[1]
+    parser = argparse.ArgumentParser(
+        prog='cnsh_compiler.py',
+        description='将CNSH代码转译为C代码'
+    )
+    parser.add_argument('source', help='CNSH源文件')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='代码生成的并行进程数（按顶层函数分段，输出与串行相同；默认1）')
+    parser.add_argument('--profile', choices=('json',),
+                        help='不输出进度信息，改为向标准输出打印各阶段耗时与规模统计（JSON）')
+    add_compile_options(parser)
+    args = parser.parse_args()
+    source_path = args.source
     
     try:
         with open(source_path, 'r', encoding='utf-8') as f:
@@ -1181,7 +4774,13 @@ def main():
         print(f'错误：文件不存在 {source_path}')
         sys.exit(1)
     
-    compiler = CNSHCompiler()
+    if args.profile == 'json':
+        compiler = CNSHCompiler(jobs=args.jobs, verbose=False, **compile_options(args))
+        result = compiler.run(source_code, CNSHCompiler.output_path(source_path))
+        print(json.dumps(result.to_dict(), ensure_ascii=False, indent=2))
+        sys.exit(0 if result.success else 1)
+    
+    compiler = CNSHCompiler(jobs=args.jobs, **compile_options(args))
     result = compiler.compile(source_code, source_path)
     
     sys.exit(0 if result['success'] else 1)
@@ -0,0 +1,18 @@
+"""测试公共设置：仓库根目录加入导入路径；参数名为 sample 的测试对每个示例程序各跑一遍"""
+import glob
+import os
+import sys
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(TESTS_DIR))
+
+# 示例程序：文件名 -> 源码
+SAMPLES = {
+    os.path.basename(path): open(path, encoding='utf-8').read()
+    for path in sorted(glob.glob(os.path.join(TESTS_DIR, 'samples', '*.cnsh')))
+}
+
+
+def pytest_generate_tests(metafunc):
+    if 'sample' in metafunc.fixturenames:
+        metafunc.parametrize('sample', list(SAMPLES.values()), ids=list(SAMPLES))
@@ -0,0 +1,56 @@
+"""随机生成CNSH程序（差分测试用）：覆盖全部语句、运算符与嵌套，部分程序有语法错误"""
+import random
+
+ATOMS = ['a', 'b', '1', '2.5', '"s"', '真', '假', '空', 'f(a, 1)', 'g()', '(a)']
+OPERATORS = ['+', '-', '*', '/', '%', '==', '!=', '>', '<', '>=', '<=', '&&', '||', '=']
+TYPES = ['整数', '小数', '文本', '真假']
+
+
+def random_expression(rng: random.Random, depth: int = 0) -> str:
+    """随机表达式"""
+    choice = rng.random()
+    if depth > 3 or choice < 0.3:
+        return rng.choice(ATOMS)
+    if choice < 0.45:
+        return rng.choice(['-', '!']) + random_expression(rng, depth + 1)
+    if choice < 0.55:
+        return '(' + random_expression(rng, depth + 1) + ')'
+    if choice < 0.6:
+        args = [random_expression(rng, depth + 1) for _ in range(rng.randint(0, 3))]
+        return 'h(' + ', '.join(args) + ')'
+    return (random_expression(rng, depth + 1) + ' ' + rng.choice(OPERATORS) + ' '
+            + random_expression(rng, depth + 1))
+
+
+def random_block(rng: random.Random, depth: int) -> str:
+    """随机语句块（含花括号）"""
+    return '{' + ' '.join(random_statement(rng, depth) for _ in range(rng.randint(0, 3))) + '}'
+
+
+def random_statement(rng: random.Random, depth: int = 0) -> str:
+    """随机语句；函数定义只出现在顶层"""
+    choice = rng.random()
+    if depth < 3 and choice < 0.1:
+        else_block = ' 否则 ' + random_block(rng, depth + 1) if rng.random() < 0.5 else ''
+        return '如果【' + random_expression(rng) + '】' + random_block(rng, depth + 1) + else_block
+    if depth < 3 and choice < 0.2:
+        return '循环【' + random_expression(rng) + '】' + random_block(rng, depth + 1)
+    if depth == 0 and choice < 0.3:
+        return f'函数 f{rng.randint(0, 9)}(整数 x, 文本 y) 返回类型 整数 ' + random_block(rng, 1)
+    if choice < 0.4:
+        return rng.choice(TYPES) + ' v = ' + random_expression(rng) + rng.choice(['', ';'])
+    if choice < 0.5:
+        return '返回 ' + rng.choice(['', random_expression(rng)]) + ';'
+    if choice < 0.6:
+        return '打印 ' + random_expression(rng)
+    return random_expression(rng) + rng.choice(['', ';'])
+
+
+def random_program(rng: random.Random) -> str:
+    """随机程序；约五分之一删掉一个词，多半得到语法错误"""
+    source = ' '.join(random_statement(rng) for _ in range(rng.randint(1, 5)))
+    if rng.random() < 0.2:
+        words = source.split(' ')
+        del words[rng.randrange(len(words))]
+        source = ' '.join(words)
+    return source
@@ -0,0 +1,186 @@
+"""三色审计：单遍扫描与逐条规则匹配结果相同；流式分块审计、增量审计与整份扫描结果相同；审计命令"""
+import random
+import re
+
+import pytest
+
+from cnsh_compiler import AuditLevel, IncrementalAudit, ThreeColorAudit, audit_main
+
+
+def make_audit(red, yellow):
+    audit = ThreeColorAudit()
+    audit.rules = {AuditLevel.RED: red, AuditLevel.YELLOW: yellow}
+    audit.compile_rules()
+    return audit
+
+
+def write(tmp_path, text, name='a.cnsh'):
+    path = tmp_path / name
+    path.write_text(text, encoding='utf-8')
+    return str(path)
+
+
+def per_rule_findings(audit, text):
+    """逐条规则 finditer：[(偏移, 行号, 规则序号, 原文), ...]"""
+    findings = []
+    rules = [rule for level in (AuditLevel.RED, AuditLevel.YELLOW) for rule in audit.rules[level]]
+    for index, (pattern, _) in enumerate(rules):
+        for match in re.finditer(pattern, text):
+            findings.append((match.start(), text.count('\n', 0, match.start()) + 1, index, match.group()))
+    return sorted(findings)
+
+
+def per_rule_check(audit, text):
+    """逐条规则 re.search 的审计结论：红色规则优先，同级按规则顺序"""
+    for level in (AuditLevel.RED, AuditLevel.YELLOW):
+        for pattern, reason in audit.rules[level]:
+            if re.search(pattern, text):
+                return level, reason
+    return AuditLevel.GREEN, '内容安全'
+
+
+def check_scan(audit, text):
+    findings = audit.scan(text)
+    assert [(finding.offset, finding.line, finding.rule, finding.text) for finding in findings] == \
+        per_rule_findings(audit, text), text
+    for finding in findings:
+        assert (finding.level, finding.reason) == audit.rule_table[finding.rule]
+    result = audit.check(text)
+    assert (result.level, result.reason) == per_rule_check(audit, text), text
+    assert result.action == ThreeColorAudit.ACTIONS[result.level]
+    assert result.findings == findings
+
+
+# 会互相重叠的规则：黄色命中里藏着红色命中、红色规则彼此重叠、同一位置多条规则命中
+OVERLAPPING_RULES = (
+    [(r'骗子', '后一条红色'), (r'诈骗', '前一条红色'), (r'a+b', '贪婪')],
+    [(r'a诈', '黄色'), (r'\d{3,5}', '数字'), (r'ab|b', '分支'), (r'诈', '单字')],
+)
+
+
+def test_scan_default_rules(sample):
+    audit = ThreeColorAudit()
+    check_scan(audit, sample)
+    fragments = ['打印 1\n', '暴力', '血腥杀人', '诈骗', '政治敏感', '1234567890123456789', '种族歧视\n', ' ']
+    rng = random.Random(0)
+    for _ in range(200):
+        check_scan(audit, ''.join(rng.choice(fragments) for _ in range(rng.randint(0, 12))))
+
+
+@pytest.mark.parametrize('seed', range(4))
+def test_scan_overlapping_rules(seed):
+    audit = make_audit(*OVERLAPPING_RULES)
+    assert audit.check('a诈骗').level == AuditLevel.RED
+    assert audit.check('诈骗子').reason == '后一条红色'
+    rng = random.Random(seed)
+    for _ in range(300):
+        check_scan(audit, ''.join(rng.choice(['a', 'b', '诈', '骗', '子', '1', '\n']) for _ in range(rng.randint(0, 30))))
+
+
+def test_match_cut_by_chunk(tmp_path):
+    # 长规则在块尾被截断时不能漏掉
+    audit = make_audit([(r'abcdefgh', '长')], [(r'c', '短')])
+    path = write(tmp_path, 'x' * 20 + 'abcdefgh')
+    expected = audit.scan('x' * 20 + 'abcdefgh')
+    assert [(finding.offset, finding.text) for finding in expected] == [(20, 'abcdefgh'), (22, 'c')]
+    for chunk_size in range(1, 40):
+        assert list(audit.iter_file(path, chunk_size)) == expected, chunk_size
+
+
+@pytest.mark.parametrize('seed', range(4))
+def test_iter_file_matches_scan(tmp_path, seed):
+    rng = random.Random(seed)
+    audit = make_audit(
+        [(r'abcdefgh', '长'), (r'诈骗', '违法内容'), (r'b\nc', '跨行')],
+        [(r'c', '短'), (r'cd|de', '重叠'), (r'\d{3,5}', '数字'), (r'骗', '单字')],
+    )
+    for _ in range(20):
+        text = ''.join(rng.choice(['a', 'b', 'c', 'd', 'e', '诈', '骗', '\n', '1', 'abcdefgh', 'x'])
+                       for _ in range(rng.randint(0, 200)))
+        path = write(tmp_path, text)
+        expected = audit.scan(text)
+        for chunk_size in (1, 2, 3, 5, 8, 13, 64, 1 << 20):
+            assert list(audit.iter_file(path, chunk_size)) == expected, (text, chunk_size)
+
+
+def test_audit_command(tmp_path, capsys):
+    # 缺失的文件报告后继续审计其余文件
+    clean = write(tmp_path, '打印 1\n', 'clean.cnsh')
+    blocked = write(tmp_path, '打印 1\n打印 「诈骗」\n', 'blocked.cnsh')
+    missing = str(tmp_path / 'missing.cnsh')
+    assert audit_main([clean, '--chunk-size', '2']) == 0
+    assert audit_main([missing, clean, blocked, '--chunk-size', '2']) == 1
+    out = capsys.readouterr().out
+    assert f'错误：文件不存在 {missing}' in out
+    assert f'三色审计：{blocked}' in out and '行2（偏移9）' in out and '审计阻断' in out
+    assert audit_main([clean, missing]) == 1
+
+
+# 增量审计的规则：内置规则都不跨行；其余规则能匹配换行符或依赖行外内容
+LINE_RULES = ([(r'诈骗', '违法内容'), (r'ab', '短')], [(r'b+c', '重叠'), (r'(?m:^x)', '行首')])
+CROSS_LINE_RULES = {
+    'newline': ([(r'b\nc', '跨行')], [(r'c', '短')]),
+    'space': ([(r'诈骗', '违法内容'), (r'a\s+b', '空白')], []),
+    'anchor': ([(r'^x', '文首')], [(r'x\Z', '文尾')]),
+    'class': ([(r'a[^z]b', '字符集')], [(r'(?s:c.)', '任意字符')]),
+    'lookahead': ([(r'a(?=\W)', '断言')], [(r'x', '单字')]),
+}
+
+
+def position(text, offset):
+    """字符偏移 -> (行号, 列号)，均从1开始"""
+    line = text.count('\n', 0, offset) + 1
+    return line, offset - (text.rfind('\n', 0, offset) + 1) + 1
+
+
+def random_text(rng, length):
+    return ''.join(rng.choice(['a', 'b', 'c', 'x', ' ', '\n', '诈', '骗']) for _ in range(length))
+
+
+def check_edits(audit, seed):
+    """随机编辑后增量审计的命中与整份扫描相同"""
+    rng = random.Random(seed)
+    text = random_text(rng, 60)
+    incremental = IncrementalAudit(text, audit)
+    assert incremental.findings() == audit.scan(text)
+    for _ in range(200):
+        start = rng.randint(0, len(text))
+        end = rng.randint(start, min(len(text), start + 8))
+        replacement = random_text(rng, rng.randint(0, 6))
+        assert incremental.position(start) == position(text, start)
+        assert incremental.position(end) == position(text, end)
+        incremental.edit(*position(text, start), *position(text, end), replacement)
+        text = text[:start] + replacement + text[end:]
+        assert incremental.source == text
+        assert incremental.findings() == audit.scan(text)
+        assert incremental.level() == audit.summarize(audit.scan(text)).level
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_incremental_audit(seed):
+    audit = make_audit(*LINE_RULES)
+    assert audit.line_local
+    check_edits(audit, seed)
+
+
+@pytest.mark.parametrize('rules', CROSS_LINE_RULES.values(), ids=list(CROSS_LINE_RULES))
+def test_incremental_audit_cross_line(rules):
+    # 可能跨行匹配的规则：编辑后整份重扫，结果不因按行扫描而出错
+    audit = make_audit(*rules)
+    assert not audit.line_local
+    check_edits(audit, 0)
+
+
+def test_incremental_audit_rules_changed():
+    audit = ThreeColorAudit()
+    text = '打印 「测试」\n打印 「测试」'
+    incremental = IncrementalAudit(text, audit)
+    assert incremental.level() == AuditLevel.GREEN
+    audit.rules[AuditLevel.RED].append((r'测试', '测试规则'))
+    audit.compile_rules()
+    # 规则重新编译后不沿用按行缓存的旧结果
+    assert incremental.level() == AuditLevel.RED
+    assert incremental.findings() == audit.scan(text)
+    incremental.edit(1, 1, 1, 1, '打印 「测试」\n')
+    assert incremental.findings() == audit.scan(incremental.source)
+    assert len(incremental.findings()) == 3
@@ -0,0 +1,105 @@
+"""构建文件：输出的C文件与源文件同名，只替换扩展名；-j 并行时输出与串行相同"""
+import json
+import os
+import random
+import subprocess
+import sys
+
+import pytest
+
+from cnsh_compiler import CNSHCompiler, Lexer, Parser, build_file
+from programs import random_program
+
+COMPILER = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'cnsh_compiler.py')
+
+SOURCE = '函数 主函数() 返回类型 整数 {\n  打印 1\n  返回 0\n}\n'
+
+# 源文件 -> 输出文件（目录名里的 .cnsh 不受影响）
+OUTPUT_PATHS = {
+    'a.cnsh': 'a.c',
+    'a.cnsh_dir/x.cnsh': 'a.cnsh_dir/x.c',
+    'x.cnsh.cnsh': 'x.cnsh.c',
+    'dir.cnsh/a.b.cnsh': 'dir.cnsh/a.b.c',
+    'noext': 'noext.c',
+}
+
+
+@pytest.mark.parametrize('source_path, output_path', OUTPUT_PATHS.items())
+def test_output_path(source_path, output_path):
+    assert CNSHCompiler.output_path(source_path) == output_path
+
+
+@pytest.fixture
+def nested_source(tmp_path):
+    """目录名带 .cnsh 的源文件"""
+    directory = tmp_path / 'a.cnsh_dir'
+    directory.mkdir()
+    path = directory / 'x.cnsh'
+    path.write_text(SOURCE, encoding='utf-8')
+    return path
+
+
+def test_build_file(nested_source):
+    result = build_file(str(nested_source), {})
+    assert result['success'], result['error']
+    assert result['output_path'] == str(nested_source.with_suffix('.c'))
+    assert sorted(os.listdir(nested_source.parent)) == ['x.c', 'x.cnsh']
+
+
+def test_profile_json(nested_source):
+    process = subprocess.run([sys.executable, COMPILER, str(nested_source), '--profile', 'json'],
+                             capture_output=True, text=True, encoding='utf-8')
+    assert process.returncode == 0, process.stderr
+    assert json.loads(process.stdout)['output_path'] == str(nested_source.with_suffix('.c'))
+    assert sorted(os.listdir(nested_source.parent)) == ['x.c', 'x.cnsh']
+
+
+def multi_function_source(seed):
+    """能解析的随机程序拼接成的多函数源码"""
+    rng = random.Random(seed)
+    parts = []
+    while len(parts) < 30:
+        source = random_program(rng)
+        try:
+            Parser(Lexer(source).tokenize()).parse()
+        except SyntaxError:
+            continue
+        parts.append(source)
+    return '\n'.join(parts)
+
+
+def run_cli(*args):
+    process = subprocess.run([sys.executable, COMPILER, *args], capture_output=True, text=True, encoding='utf-8')
+    assert process.returncode == 0, process.stdout + process.stderr
+    return process.stdout
+
+
+def write_sources(directory, count):
+    directory.mkdir()
+    for index in range(count):
+        (directory / f'{index}.cnsh').write_text(multi_function_source(index), encoding='utf-8')
+
+
+def c_files(directory):
+    return {path.name: path.read_text(encoding='utf-8') for path in sorted(directory.glob('*.c'))}
+
+
+@pytest.mark.parametrize('options', [[], ['--compact'], ['-O1', '--unroll']], ids=['plain', 'compact', 'unroll'])
+def test_cli_jobs(tmp_path, options):
+    # 单个文件按顶层函数分段并行生成
+    write_sources(tmp_path / 'serial', 1)
+    write_sources(tmp_path / 'parallel', 1)
+    run_cli(str(tmp_path / 'serial' / '0.cnsh'), '-j', '1', *options)
+    run_cli(str(tmp_path / 'parallel' / '0.cnsh'), '-j', '2', *options)
+    assert c_files(tmp_path / 'parallel') == c_files(tmp_path / 'serial') != {}
+
+
+def test_build_jobs(tmp_path):
+    # 批量构建按文件分派到多个进程
+    write_sources(tmp_path / 'serial', 6)
+    write_sources(tmp_path / 'parallel', 6)
+    run_cli('build', str(tmp_path / 'serial'), '-j', '1')
+    out = run_cli('build', str(tmp_path / 'parallel'), '-j', '2')
+    assert '2 个进程' in out
+    assert c_files(tmp_path / 'parallel') == c_files(tmp_path / 'serial')
+    assert len(c_files(tmp_path / 'serial')) == 6
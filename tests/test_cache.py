@@ -0,0 +1,34 @@
+"""编译缓存：命中时结果与不用缓存相同；审计规则改变后不沿用旧的审计结果"""
+from cnsh_compiler import AuditLevel, CNSHCompiler, CompileCache
+
+SOURCE = '函数 主函数() 返回类型 整数 {\n  打印 「测试文本」\n  返回 0\n}\n'
+
+
+def compile_cached(cache, rules=None):
+    compiler = CNSHCompiler(verbose=False, cache=cache)
+    if rules is not None:
+        compiler.audit_system.rules[AuditLevel.YELLOW].append(rules)
+        compiler.audit_system.compile_rules()
+    return compiler.run(SOURCE)
+
+
+def test_cache_hit(tmp_path):
+    cache = CompileCache(str(tmp_path))
+    first = compile_cached(cache)
+    second = compile_cached(cache)
+    assert not first.cached and second.cached
+    assert (second.audit, second.c_code) == (first.audit, first.c_code)
+
+
+def test_rule_change_misses(tmp_path):
+    cache = CompileCache(str(tmp_path))
+    assert compile_cached(cache).audit == 'GREEN'
+    
+    result = compile_cached(cache, (r'测试', '测试规则'))
+    assert not result.cached
+    assert result.audit == 'YELLOW'
+    assert [finding.reason for finding in result.findings] == ['测试规则']
+    
+    assert compile_cached(cache, (r'测试', '测试规则')).cached
+    assert not compile_cached(cache, (r'测试', '另一条规则')).cached
+    assert compile_cached(cache).audit == 'GREEN'
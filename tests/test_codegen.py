@@ -0,0 +1,343 @@
+"""代码生成：循环次数只求值一次、循环变量按深度命名、常数次小循环展开；深层缩进与流式输出；分派表扩展；并行生成"""
+import os
+import random
+import shutil
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from cnsh_compiler import (
+    ArenaCodeGenerator, ASTArena, BinaryOp, CCodeGenerator, CNSHCompiler, FunctionDeclaration, Identifier,
+    IfStatement, Lexer, LoopStatement, Number, Parser, PrintStatement, Program, UnaryOp, compile_source,
+)
+from programs import random_program
+
+GCC = shutil.which('gcc')
+
+# 次数有副作用的循环：次数只求值一次时“7”只打印一次
+SIDE_EFFECT_PROGRAM = '''函数 次数() 返回类型 整数 { 打印 7 返回 3 }
+函数 主函数() 返回类型 整数 {
+  循环【次数()】{ 循环【2】{ 打印 1 } 打印 2 }
+  返回 0
+}
+'''
+
+
+def function_body(source, **options):
+    """编译只含一个函数的源码，返回函数体各行（保留缩进，去掉函数体本身的一层）"""
+    result = compile_source(source, **options)
+    assert result.success, result.error
+    lines = result.c_code.splitlines()
+    start = next(index for index, line in enumerate(lines) if line.endswith(') {')) + 1
+    return [line[4:] for line in lines[start:lines.index('}', start)]]
+
+
+def test_trip_count_hoisted():
+    source = '函数 f(整数 次数, 小数 比例) { 循环【次数】{ 循环【比例】{ 循环【3】{ 打印 次数 } } } }'
+    assert function_body(source) == [
+        '{',
+        '    const int __n0 = 次数;',
+        '    for (int __i0 = 0; __i0 < __n0; __i0++) {',
+        '        {',
+        '            const double __n1 = 比例;',
+        '            for (int __i1 = 0; __i1 < __n1; __i1++) {',
+        '                for (int __i2 = 0; __i2 < 3; __i2++) {',
+        '                    printf("%d\\n", 次数);',
+        '                }',
+        '            }',
+        '        }',
+        '    }',
+        '}',
+    ]
+
+
+def test_sibling_loops_reuse_names():
+    source = '函数 f() { 循环【2】{ 打印 1 } 循环【3】{ 循环【4】{ 打印 2 } } }'
+    headers = [line.strip() for line in function_body(source) if line.strip().startswith('for')]
+    assert headers == [
+        'for (int __i0 = 0; __i0 < 2; __i0++) {',
+        'for (int __i0 = 0; __i0 < 3; __i0++) {',
+        'for (int __i1 = 0; __i1 < 4; __i1++) {',
+    ]
+
+
+def test_unroll():
+    source = '函数 f() { 循环【2】{ 整数 x = 1 打印 x } 循环【1 + 2】{ 打印 3 } 循环【9】{ 打印 9 } }'
+    assert function_body(source, unroll=True) == [
+        '{', '    int x = 1;', '    printf("%d\\n", x);', '}',
+        '{', '    int x = 1;', '    printf("%d\\n", x);', '}',
+        # 次数不是字面量时要先经 -O1 折叠才展开
+        '{',
+        '    const int __n0 = (1 + 2);',
+        '    for (int __i0 = 0; __i0 < __n0; __i0++) {',
+        '        printf("%g\\n", (double)3);',
+        '    }',
+        '}',
+        # 超过 UNROLL_LIMIT 不展开
+        'for (int __i0 = 0; __i0 < 9; __i0++) {',
+        '    printf("%g\\n", (double)9);',
+        '}',
+    ]
+    assert function_body(source, unroll=True, opt_level=1)[8:11] == ['{', '    printf("%g\\n", (double)3);', '}']
+
+
+def generate_all(source, unroll):
+    """递归、迭代、紧凑数组三种代码生成器的输出"""
+    program = Parser(Lexer(source).tokenize()).parse()
+    return [
+        CCodeGenerator(program, unroll=unroll).generate(),
+        CCodeGenerator(program, iterative=True, unroll=unroll).generate(),
+        ArenaCodeGenerator(ASTArena.from_statements(program.statements), unroll=unroll).generate(),
+    ]
+
+
+@pytest.mark.parametrize('unroll', [False, True])
+def test_generators_agree(unroll, sample):
+    first, *others = generate_all(sample, unroll)
+    assert others == [first, first]
+
+
+@pytest.mark.parametrize('unroll', [False, True])
+def test_generators_agree_random(unroll):
+    rng = random.Random(0)
+    for _ in range(500):
+        source = random_program(rng)
+        try:
+            first, *others = generate_all(source, unroll)
+        except SyntaxError:
+            continue
+        assert others == [first, first], source
+
+
+def loop_program(rng):
+    """随机嵌套循环的程序，次数混用字面量、常量算式、变量与真假"""
+    def block(depth):
+        lines = []
+        for _ in range(rng.randint(1, 3)):
+            if depth < 3 and rng.random() < 0.6:
+                times = rng.choice(['0', '1', '3', '8', '9', '2 + 1', '次数', '次数 - 1', '真', '假', '2.5'])
+                lines += [f'循环【{times}】{{', *block(depth + 1), '}']
+            else:
+                lines += ['总 = 总 + 1', '打印 总']
+        return lines
+    
+    return '\n'.join(['函数 主函数() 返回类型 整数 {', '整数 次数 = 2', '整数 总 = 0', *block(0), '返回 0', '}'])
+
+
+def run_c(c_code, directory, name):
+    """用gcc编译C代码并运行，返回 (退出码, 标准输出)"""
+    source_path = directory / f'{name}.c'
+    source_path.write_text(c_code, encoding='utf-8')
+    executable = directory / name
+    subprocess.run([GCC, '-w', '-O0', str(source_path), '-o', str(executable)], check=True)
+    process = subprocess.run([str(executable)], capture_output=True, timeout=10)
+    return process.returncode, process.stdout
+
+
+@pytest.mark.skipif(GCC is None, reason='需要gcc')
+def test_trip_count_evaluated_once(tmp_path):
+    expected = (0, b'7\n' + b'1\n1\n2\n' * 3)
+    for unroll in (False, True):
+        assert run_c(compile_source(SIDE_EFFECT_PROGRAM, unroll=unroll).c_code, tmp_path, 'once') == expected
+
+
+# 次数为文本、空值：类型取次数表达式自身的类型，C编译不报错；未调用的函数只需编译通过
+POINTER_COUNT_PROGRAM = '''函数 名字() 返回类型 文本 { 返回 「ab」 }
+函数 不调用(文本 s) {
+  循环【s】{ 打印 1 }
+  循环【「ab」】{ 打印 1 }
+  循环【名字()】{ 打印 1 }
+}
+函数 主函数() 返回类型 整数 {
+  循环【空】{ 打印 1 }
+  打印 2
+  返回 0
+}
+'''
+
+
+def test_pointer_count_type():
+    lines = [line.strip() for line in compile_source(POINTER_COUNT_PROGRAM).c_code.splitlines()]
+    assert [line for line in lines if line.startswith('const ')] == [
+        'const __typeof__(s) __n0 = s;',
+        'const __typeof__("ab") __n0 = "ab";',
+        'const __typeof__(名字()) __n0 = 名字();',
+        'const __typeof__(NULL) __n0 = NULL;',
+    ]
+
+
+@pytest.mark.skipif(GCC is None, reason='需要gcc')
+@pytest.mark.parametrize('generator', ['recursive', 'iterative', 'compact'])
+def test_pointer_count_compiles(tmp_path, generator):
+    options = {'iterative': generator == 'iterative', 'compact': generator == 'compact'}
+    c_code = compile_source(POINTER_COUNT_PROGRAM, **options).c_code
+    assert run_c(c_code, tmp_path, 'pointer') == (0, b'2\n')
+
+
+@pytest.mark.skipif(GCC is None, reason='需要gcc')
+def test_unroll_same_output(tmp_path, sample):
+    plain = run_c(compile_source(sample).c_code, tmp_path, 'plain')
+    assert run_c(compile_source(sample, unroll=True).c_code, tmp_path, 'unrolled') == plain
+    assert run_c(compile_source(sample, unroll=True, opt_level=1).c_code, tmp_path, 'optimized') == plain
+
+
+@pytest.mark.skipif(GCC is None, reason='需要gcc')
+@pytest.mark.parametrize('seed', range(2))
+def test_unroll_same_output_random(seed, tmp_path):
+    rng = random.Random(seed)
+    for index in range(5):
+        source = loop_program(rng)
+        plain = run_c(compile_source(source).c_code, tmp_path, f'plain{index}')
+        unrolled = compile_source(source, unroll=True, opt_level=1).c_code
+        assert run_c(unrolled, tmp_path, f'unrolled{index}') == plain, source
+
+
+def test_deep_indentation_threads():
+    # 超出缩进表的深度现算，多线程同时生成不改共用的表
+    source = '函数 f() {' + ' 如果【a】{' * 80 + ' 打印 1' + ' }' * 80 + ' }'
+    program = Parser(Lexer(source).tokenize()).parse()
+    expected = CCodeGenerator(program, iterative=True).generate()
+    indents = CCodeGenerator.INDENTS
+    with ThreadPoolExecutor(8) as executor:
+        outputs = list(executor.map(
+            lambda _: CCodeGenerator(program, iterative=True).generate(), range(16)))
+    assert outputs == [expected] * 16
+    assert CCodeGenerator.INDENTS is indents and len(indents) < 80
+    assert '    ' * 81 + 'printf("%g\\n", (double)1);' in expected.splitlines()
+
+
+def test_stream_output_concurrent(tmp_path):
+    # 多个线程同时流式输出到同一文件：各用各的临时文件，不互相删除或改名
+    output_path = str(tmp_path / 'out.c')
+    expected = compile_source(SIDE_EFFECT_PROGRAM).c_code
+    with ThreadPoolExecutor(8) as executor:
+        results = list(executor.map(
+            lambda _: compile_source(SIDE_EFFECT_PROGRAM, output_path, stream_output=True), range(32)))
+    assert all(result.success for result in results), [result.error for result in results]
+    with open(output_path, encoding='utf-8') as f:
+        assert f.read() == expected
+    assert os.listdir(tmp_path) == ['out.c']
+
+
+def test_stream_output_open_error(tmp_path):
+    # 临时文件建不成时报告原异常，而不是删除临时文件时的异常
+    (tmp_path / 'file').write_text('')
+    compiler = CNSHCompiler(verbose=False, stream_output=True)
+    program = Parser(Lexer(SIDE_EFFECT_PROGRAM).tokenize()).parse()
+    with pytest.raises(NotADirectoryError) as error:
+        compiler.generate(program, str(tmp_path / 'file' / 'out.c'))
+    assert error.value.__context__ is None
+    assert error.value.filename.endswith('.tmp')
+
+
+class Unless(IfStatement):
+    """新增语句：条件为假时执行（继承 if 语句的字段）"""
+
+
+class Power(BinaryOp):
+    """新增表达式：乘方"""
+
+
+class ExtendedGenerator(CCodeGenerator):
+    """新增节点类型只需在分派表加一项并实现生成方法"""
+    STATEMENT_GENERATORS = {**CCodeGenerator.STATEMENT_GENERATORS, Unless: 'generate_unless'}
+    EXPRESSION_GENERATORS = {**CCodeGenerator.EXPRESSION_GENERATORS, Power: 'generate_power'}
+    
+    def generate_unless(self, node):
+        self.generate_if_statement(IfStatement(UnaryOp('!', node.condition), node.then_body, node.else_body))
+    
+    def generate_power(self, node):
+        return f'pow({self.generate_expression(node.left)}, {self.generate_expression(node.right)})'
+
+
+class OverridingGenerator(CCodeGenerator):
+    """覆盖内建节点的生成方法"""
+    
+    def generate_binary_op(self, node):
+        return f'[{self.generate_expression(node.left)} {node.op} {self.generate_expression(node.right)}]'
+    
+    def generate_loop_statement(self, node):
+        self.emit('/* 循环 */')
+        super().generate_loop_statement(node)
+
+
+EXTENSION_PROGRAM = Program([FunctionDeclaration('f', [], '整数', [
+    Unless(BinaryOp('>', Identifier('x'), Number('1')), [
+        PrintStatement(Power('^', Identifier('x'), BinaryOp('+', Number('2'), Number('1')))),
+        LoopStatement(Number('2'), [PrintStatement(BinaryOp('-', Identifier('x'), Number('1')))]),
+    ]),
+])])
+
+
+def function_lines(generator):
+    """生成的C代码中函数 f 的各行"""
+    lines = generator.generate().splitlines()
+    start = lines.index('int f() {')
+    return lines[start:lines.index('}', start) + 1]
+
+
+@pytest.mark.parametrize('iterative', [False, True], ids=['recursive', 'iterative'])
+def test_generator_extension(iterative):
+    # 新增的节点类即使继承内建节点类，迭代模式下也调用登记的生成方法
+    assert function_lines(ExtendedGenerator(EXTENSION_PROGRAM, iterative=iterative)) == [
+        'int f() {',
+        '    if ((!(x > 1))) {',
+        '        printf("%d\\n", pow(x, (2 + 1)));',
+        '        for (int __i0 = 0; __i0 < 2; __i0++) {',
+        '            printf("%d\\n", (x - 1));',
+        '        }',
+        '    }',
+        '}',
+    ]
+
+
+@pytest.mark.parametrize('iterative', [False, True], ids=['recursive', 'iterative'])
+def test_generator_override(iterative):
+    # 子类覆盖内建节点的生成方法，两种模式下都生效；未登记的节点子类沿用父类节点的方法
+    assert function_lines(OverridingGenerator(EXTENSION_PROGRAM, iterative=iterative)) == [
+        'int f() {',
+        '    if ([x > 1]) {',
+        '        printf("%d\\n", [x ^ [2 + 1]]);',
+        '        /* 循环 */',
+        '        for (int __i0 = 0; __i0 < 2; __i0++) {',
+        '            printf("%d\\n", [x - 1]);',
+        '        }',
+        '    }',
+        '}',
+    ]
+
+
+def multi_function_program():
+    """多个顶层函数与语句：随机程序与随机循环程序拼接"""
+    rng = random.Random(3)
+    parts = []
+    while len(parts) < 60:
+        source = random_program(rng) if len(parts) % 2 else loop_program(rng)
+        try:
+            Parser(Lexer(source).tokenize()).parse()
+        except SyntaxError:
+            continue
+        parts.append(source)
+    return '\n'.join(parts)
+
+
+PARALLEL_MODES = {
+    'plain': {},
+    'iterative': {'iterative': True},
+    'compact': {'compact': True},
+    'unroll': {'unroll': True, 'opt_level': 1},
+}
+
+
+@pytest.mark.parametrize('options', PARALLEL_MODES.values(), ids=list(PARALLEL_MODES))
+def test_parallel_same_output(options, tmp_path):
+    # 多进程生成的输出与串行逐字节相同，流式输出到文件也一样
+    source = multi_function_program()
+    serial = compile_source(source, **options)
+    assert serial.success, serial.error
+    assert compile_source(source, jobs=2, **options).c_code == serial.c_code
+    output_path = tmp_path / 'out.c'
+    result = compile_source(source, str(output_path), stream_output=True, jobs=2, **options)
+    assert result.success, result.error
+    assert output_path.read_text(encoding='utf-8') == serial.c_code
@@ -0,0 +1,78 @@
+"""增量编译：随机编辑后的结果与整份重新编译相同"""
+import random
+
+import pytest
+
+from cnsh_compiler import CCodeGenerator, IncrementalCompiler, Lexer, Parser, TextEdit, ThreeColorAudit
+from programs import random_statement
+
+# 编辑插入的片段：半截语句、括号、换行与审计命中
+PIECES = ['', '}', '{', ' ', '否则 {', '(', ')', ';', 'x', '+', '\n', '如果【a】{', '"', '# 注释\n', '诈骗', '政治敏感']
+
+
+def full_compile(source):
+    """整份重新编译：(语法树, C代码)，语法错误时为None"""
+    try:
+        program = Parser(Lexer(source).tokenize()).parse()
+    except SyntaxError:
+        return None
+    return program, CCodeGenerator(program).generate()
+
+
+def random_edit(rng, source):
+    """随机编辑：多半按行替换为新语句，其余为任意位置的小改动"""
+    if rng.random() < 0.4:
+        piece = random_statement(rng) + '\n'
+    else:
+        piece = rng.choice(PIECES)
+    if rng.random() < 0.6:
+        starts = [0] + [index + 1 for index, ch in enumerate(source) if ch == '\n']
+        start = rng.choice(starts)
+        end = rng.choice([offset for offset in starts + [len(source)] if offset >= start][:3])
+    else:
+        start = rng.randint(0, len(source))
+        end = min(len(source), start + rng.randint(0, 10))
+    return TextEdit(start, end, piece)
+
+
+@pytest.mark.parametrize('iterative', [False, True], ids=['recursive', 'iterative'])
+@pytest.mark.parametrize('seed', range(3))
+def test_random_edits(seed, iterative):
+    rng = random.Random(seed)
+    audit = ThreeColorAudit()
+    for _ in range(40):
+        source = '\n'.join(random_statement(rng) for _ in range(rng.randint(0, 8)))
+        compiler = IncrementalCompiler(source, iterative=iterative)
+        for _ in range(15):
+            edit = random_edit(rng, source)
+            source = edit.apply(source)
+            if rng.random() < 0.5:
+                compiler.edit(edit)
+            else:
+                compiler.update(source)
+            assert compiler.source == source
+            assert compiler.audit.source == source
+            assert compiler.audit.findings() == audit.scan(source)
+            
+            expected = full_compile(source)
+            result = compiler.result()
+            if expected is None:
+                assert not result['success'] and compiler.dirty is not None
+            elif audit.summarize(audit.scan(source)).level.name == 'RED':
+                assert not result['success']
+            else:
+                assert compiler.program() == expected[0]
+                assert result == {'success': True, 'c_code': expected[1]}
+
+
+def test_generation_error():
+    # 代码生成出错（输入到一半的类型名）与语法错误一样记下，改正后结果与整份重新编译相同
+    source = '函数 f() 返回类型 整数 { 如果【真】{ 返回 1 } 返回 0 }\n打印 2'
+    compiler = IncrementalCompiler(source)
+    broken = source.replace('整数', '整')
+    assert compiler.update(broken) == 0
+    result = compiler.result()
+    assert not result['success'] and 'KeyError' in result['error']
+    compiler.update(source)
+    assert compiler.result() == {'success': True, 'c_code': full_compile(source)[1]}
+    assert compiler.generator.indent == 0 and compiler.generator.loops == []
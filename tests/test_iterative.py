@@ -0,0 +1,78 @@
+"""迭代模式：与递归实现的差分测试，以及递归实现处理不了的深层嵌套"""
+import random
+import sys
+import time
+
+import pytest
+
+from cnsh_compiler import CCodeGenerator, Lexer, Parser
+from programs import random_program
+
+# 语句块嵌套层数：远超递归上限；生成代码的缩进随层数平方增长，不宜再大
+BLOCK_DEPTH = 1000
+
+# 括号与函数调用的嵌套层数
+EXPRESSION_DEPTH = 10000
+
+
+def compile_both(source, iterative):
+    """语法分析并生成C代码；出错时返回异常类型与信息"""
+    try:
+        program = Parser(Lexer(source).tokenize(), iterative=iterative).parse()
+        return program, CCodeGenerator(program, iterative=iterative).generate()
+    except SyntaxError as e:
+        return type(e), str(e)
+
+
+def assert_same_result(source):
+    assert compile_both(source, True) == compile_both(source, False)
+
+
+def test_samples(sample):
+    assert_same_result(sample)
+
+
+@pytest.mark.parametrize('seed', range(4))
+def test_random_programs(seed):
+    rng = random.Random(seed)
+    for _ in range(500):
+        assert_same_result(random_program(rng))
+
+
+def nested_blocks(depth):
+    """depth层交替嵌套的如果/循环，最内层打印"""
+    return '函数 主函数() {\n' + '如果【a】{ 循环【2】{ ' * depth + '打印 x' + ' }}' * depth + ' 否则 { 打印 1 }\n}\n'
+
+
+def nested_expression(depth):
+    """depth层交替嵌套的取负、括号与函数调用"""
+    return '整数 z = ' + '-(' * depth + 'f(a, (b + ' * depth + '1' + '))' * depth + ')' * depth + '\n'
+
+
+def test_deep_nesting():
+    source = nested_blocks(BLOCK_DEPTH) + nested_expression(EXPRESSION_DEPTH)
+    limit = sys.getrecursionlimit()
+    with pytest.raises(RecursionError):
+        Parser(Lexer(source).tokenize()).parse()
+    
+    program = Parser(Lexer(source).tokenize_stream(), iterative=True).parse()
+    code = CCodeGenerator(program, iterative=True).generate()
+    assert sys.getrecursionlimit() == limit
+    assert code.count('for (int __i') == BLOCK_DEPTH
+    assert code.count('printf') == 2
+    assert code.count('f(a, (b + ') == EXPRESSION_DEPTH
+
+
+def test_linear_time():
+    def parse_time(depth):
+        source = nested_blocks(depth) + nested_expression(depth)
+        tokens = Lexer(source).tokenize()
+        best = float('inf')
+        for _ in range(3):
+            start = time.perf_counter()
+            Parser(tokens, iterative=True).parse()
+            best = min(best, time.perf_counter() - start)
+        return best
+    
+    # 线性时间：规模翻四倍，耗时远不到十六倍
+    assert parse_time(4000) < 8 * parse_time(1000)
@@ -0,0 +1,117 @@
+"""词法分析：与逐字符旧实现的差分测试，以及长字面量的分词耗时"""
+import random
+import time
+
+import pytest
+
+from cnsh_compiler import ByteLexer, Lexer, TextEdit
+
+# 边界情况：未闭合的字符串、转义、非十进制数字、全角符号、各种换行
+EDGE_CASES = [
+    '',
+    '   \t\r\n ',
+    '# 只有注释',
+    '整数 x = 1 # 行尾注释',
+    '"未闭合',
+    '「未闭合\n第二行',
+    '『a\\』b』',
+    '"a\\"b" \'c\\\'d\' 「e\\」f」',
+    '"结尾是反斜杠\\',
+    '"\\n\\t\\r\\\\\\q"',
+    '1.2.3 12. .5 007',
+    'x² ٣4 Ⅷ ½ 12٣',
+    'abc中 中é é中 _x1 丁䷿ 龥龦',
+    '，　【1】[2]',
+    '== != >= <= && || = ! > < & | ===',
+    '+-*/%(){};,.',
+    '如果【真】{\r\n  打印「你好」\r\n}',
+    '\x00\x01',
+]
+
+# 随机程序的字母表：单个字符与常见片段
+ALPHABET = list(' \t\r\n#"\'「」『』【】\\abc_xZ019.²٣Ⅷ½中文如果循环整数=!<>&|+-*/%(){}[];,，　é\x00')
+FRAGMENTS = ['如果', '整数', 'abc', '12.5', '1.2.3', '"x\\"y"', '「你好」', '# 注释\n',
+             '==', '&&', '||', '\\', '"a\nb"', 'abc中', '12٣', 'x²']
+
+
+# 10 MB字符串字面量的分词时限（秒）；逐字符拼接的旧实现处理1 MB就要十几秒，2 MB要一分半
+TIME_BUDGET = 5.0
+
+# 字面量内容的重复单元（各10字节UTF-8）：无转义，以及每段一个转义
+LITERAL_UNITS = {'plain': '数据表,', 'escaped': '数据\\t,,'}
+
+
+def positions(tokens):
+    """token的类型、值与位置（偏移、行、列）"""
+    return [(token.type, token.value, token.offset, token.line, token.column) for token in tokens]
+
+
+def assert_same_tokens(source):
+    assert positions(Lexer(source).tokenize()) == positions(Lexer(source).tokenize_legacy())
+
+
+def test_samples(sample):
+    assert_same_tokens(sample)
+
+
+@pytest.mark.parametrize('source', EDGE_CASES)
+def test_edge_cases(source):
+    assert_same_tokens(source)
+
+
+@pytest.mark.parametrize('seed', range(4))
+def test_random_sources(seed):
+    rng = random.Random(seed)
+    for _ in range(500):
+        source = ''.join(
+            rng.choice(ALPHABET) if rng.random() < 0.7 else rng.choice(FRAGMENTS)
+            for _ in range(rng.randint(0, 60))
+        )
+        assert_same_tokens(source)
+
+
+def test_stream_matches_tokens(sample):
+    stream = Lexer(sample).tokenize_stream()
+    assert positions(stream) == positions(Lexer(sample).tokenize())
+
+
+@pytest.mark.parametrize('source', EDGE_CASES)
+def test_byte_lexer(source):
+    data = source.encode('utf-8')
+    tokens = ByteLexer(data).tokenize()
+    # 与str版类型、值、行列相同，偏移为字节偏移
+    expected = [
+        (token.type, token.value, len(source[:token.offset].encode('utf-8')), token.line, token.column)
+        for token in Lexer(source).tokenize()
+    ]
+    assert positions(tokens) == expected
+    assert positions(ByteLexer(memoryview(data)).tokenize()) == expected
+    assert positions(ByteLexer(data).tokenize_legacy()) == expected
+
+
+def test_byte_lexer_samples(sample):
+    data = sample.encode('utf-8')
+    assert positions(ByteLexer(data).tokenize_legacy()) == positions(ByteLexer(data).tokenize())
+
+
+def test_byte_lexer_rejects_relex():
+    lexer = ByteLexer('整数 x = 1;'.encode('utf-8'))
+    tokens = lexer.tokenize()
+    with pytest.raises(TypeError):
+        lexer.relex(tokens, TextEdit(0, 0, ' '))
+
+
+@pytest.mark.parametrize('method', ['tokenize', 'tokenize_legacy', 'tokenize_stream'])
+@pytest.mark.parametrize('unit', LITERAL_UNITS.values(), ids=list(LITERAL_UNITS))
+def test_ten_megabyte_string_literal(unit, method):
+    body = unit * ((10 << 20) // len(unit.encode('utf-8')))
+    source = f'文本 表 = "{body}";'
+    
+    start = time.perf_counter()
+    tokens = getattr(Lexer(source), method)()
+    value = tokens[3].value
+    elapsed = time.perf_counter() - start
+    
+    assert value == body.replace('\\t', '\t')
+    assert [token.value for token in tokens] == ['文本', '表', '=', value, ';', None]
+    assert elapsed < TIME_BUDGET, f'{method} 分词10 MB字面量用了 {elapsed:.2f} 秒'
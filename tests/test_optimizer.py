@@ -0,0 +1,165 @@
+"""-O1 优化：常量折叠按C语义，删除死代码；随机程序经gcc编译运行，与不优化时输出相同"""
+import random
+import shutil
+import subprocess
+
+import pytest
+
+from cnsh_compiler import compile_source
+
+GCC = shutil.which('gcc')
+
+# 表达式 -> 优化后 `整数 x = ...` 生成的初值
+FOLDS = {
+    '1 - 3': '(-2)',
+    '7 / -2 + 010': '5',          # 除法向零截断，前导0是八进制
+    '-7 % 3': '(-1)',
+    '1.5 * 2': '3.0',
+    '-(2 - 2.0)': '(-0.0)',
+    '!(1 < 2)': 'false',
+    '0 && f()': 'false',          # 短路：右侧不求值，不必是常量
+    '1 || f()': 'true',
+    '(1 + 2) * a': '(3 * a)',
+    # 以下不折叠：除数为0、小数取余、int溢出、非法八进制、非常量
+    '5 / 0': '(5 / 0)',
+    '5 % 0': '(5 % 0)',
+    '2.5 % 2': '(2.5 % 2)',
+    '2147483647 + 1': '(2147483647 + 1)',
+    '09 + 1': '(09 + 1)',
+    '3 + a': '(3 + a)',
+}
+
+# 源码 -> 优化后函数体内的C语句（删去的死代码都含“打印 0”）
+DEAD_CODE = {
+    '如果【1 > 2】{ 打印 0 } 否则 { 打印 2 }': ['printf("%g\\n", (double)2);'],
+    '如果【真 || a】{ 打印 2 } 否则 { 打印 0 }': ['printf("%g\\n", (double)2);'],
+    '如果【假】{ 打印 0 }': [],
+    '循环【2 - 2】{ 打印 0 }': [],
+    '循环【-1】{ 打印 0 }': [],
+    '返回 2; 打印 0': ['return 2;'],
+    '如果【a】{ 返回 1 打印 0 } 打印 2': ['if (a) {', 'return 1;', '}', 'printf("%g\\n", (double)2);'],
+}
+
+
+def body_lines(source, **options):
+    """源码包成主函数编译，返回函数体的各行（去掉缩进）"""
+    result = compile_source('函数 主函数() 返回类型 整数 {\n' + source + '\n}\n', **options)
+    assert result.success, result.error
+    lines = [line.strip() for line in result.c_code.splitlines()]
+    # 函数体之后是函数的 } 与空行，再往后是C的main
+    end = lines.index('int main() {')
+    while not lines[end - 1]:
+        end -= 1
+    return lines[lines.index('int 主函数() {') + 1:end - 1]
+
+
+@pytest.mark.parametrize('expression, folded', FOLDS.items())
+def test_constant_folding(expression, folded):
+    result = compile_source(f'整数 x = {expression}', opt_level=1)
+    assert f'int x = {folded};' in result.c_code.splitlines()
+
+
+def test_print_keeps_format():
+    # 打印按节点类型选格式，整数算式折成数字字面量会改用%g
+    result = compile_source('打印 1 + 2', opt_level=1)
+    assert 'printf("%d\\n", (1 + 2));' in result.c_code.splitlines()
+
+
+@pytest.mark.parametrize('source, expected', DEAD_CODE.items())
+def test_dead_code(source, expected):
+    assert body_lines(source, opt_level=1) == expected
+    assert 'printf("%g\\n", (double)0);' in body_lines(source)
+
+
+class ProgramGenerator:
+    """随机生成只用常量与一个变量的程序，输出只取决于C语义"""
+    
+    def __init__(self, seed):
+        self.rng = random.Random(seed)
+    
+    def number(self):
+        choice = self.rng.random()
+        if choice < 0.5:
+            return str(self.rng.randint(0, 12)), 'i'
+        if choice < 0.6:
+            return self.rng.choice(['010', '007', '0', '00']), 'i'
+        if choice < 0.8:
+            return self.rng.choice(['2.5', '0.1', '3.', '0.0', '1.25', '7.75']), 'd'
+        return self.rng.choice(['真', '假']), 'b'
+    
+    def expression(self, depth, allow_variable=True):
+        """(表达式, 类型)；类型为 i 整数、d 小数、b 真假"""
+        if depth <= 0 or self.rng.random() < 0.25:
+            if allow_variable and self.rng.random() < 0.2:
+                return '甲', 'i'
+            return self.number()
+        if self.rng.random() < 0.15:
+            operand, operand_type = self.expression(depth - 1, allow_variable)
+            op = self.rng.choice(['-', '!'])
+            return f'{op}({operand})', ('b' if op == '!' else operand_type)
+        left, left_type = self.expression(depth - 1, allow_variable)
+        right, right_type = self.expression(depth - 1, allow_variable)
+        op = self.rng.choice(['+', '-', '*', '/', '%', '==', '!=', '<', '>', '<=', '>=', '&&', '||'])
+        if op == '%' and 'd' in (left_type, right_type):
+            op = '+'
+        if op in ('==', '!=', '<', '>', '<=', '>=', '&&', '||'):
+            return f'({left} {op} {right})', 'b'
+        return f'({left} {op} {right})', ('d' if 'd' in (left_type, right_type) else 'i')
+    
+    def statements(self, depth, count):
+        lines = []
+        for _ in range(count):
+            choice = self.rng.random()
+            value, value_type = self.expression(3)
+            if choice < 0.3:
+                # 小数按%g打印，折叠前后的舍入可能不同，换成整数再打印
+                lines.append(f'结果 = ({value}) * 100' if value_type == 'd' else f'打印 {value}')
+            elif choice < 0.45:
+                lines += [f'结果 = 结果 + ({value}) * 10', '打印 结果']
+            elif choice < 0.6 and depth > 0:
+                condition, _ = self.expression(2)
+                lines += [f'如果【{condition}】{{', f'整数 局部 = {self.rng.randint(0, 9)}']
+                lines += self.statements(depth - 1, 2)
+                lines.append('打印 局部')
+                if self.rng.random() < 0.5:
+                    lines.append('} 否则 {')
+                    lines += self.statements(depth - 1, 2)
+                lines.append('}')
+            elif choice < 0.7 and depth > 0:
+                times, _ = self.expression(2, allow_variable=False)
+                lines.append(f'循环【{times}】{{')
+                lines += self.statements(depth - 1, 1)
+                lines.append('}')
+            elif choice < 0.75 and depth > 0:
+                lines += ['如果【甲 > 100】{', '打印 999', '返回 1', '打印 888', '}']
+            else:
+                lines.append('结果 = 结果 + 1')
+        return lines
+    
+    def program(self):
+        body = ['整数 甲 = 3', '整数 结果 = 0'] + self.statements(3, 8) + ['打印 结果', '返回 0', '打印 777']
+        return '函数 主函数() 返回类型 整数 {\n' + '\n'.join(body) + '\n}\n'
+
+
+def run_c(c_code, directory, name):
+    """用gcc编译C代码并运行，返回 (退出码, 标准输出)"""
+    source_path = directory / f'{name}.c'
+    source_path.write_text(c_code, encoding='utf-8')
+    executable = directory / name
+    subprocess.run([GCC, '-w', '-O0', str(source_path), '-o', str(executable)], check=True)
+    process = subprocess.run([str(executable)], capture_output=True, timeout=10)
+    return process.returncode, process.stdout
+
+
+@pytest.mark.skipif(GCC is None, reason='需要gcc')
+@pytest.mark.parametrize('seed', range(4))
+def test_random_programs(seed, tmp_path):
+    generator = ProgramGenerator(seed)
+    for index in range(5):
+        source = generator.program()
+        plain = compile_source(source)
+        optimized = compile_source(source, opt_level=1)
+        assert plain.success and optimized.success
+        assert compile_source(source, opt_level=1, compact=True).c_code == optimized.c_code
+        assert run_c(optimized.c_code, tmp_path, f'O1_{index}') == run_c(plain.c_code, tmp_path, f'O0_{index}'), \
+            source
@@ -0,0 +1,115 @@
+"""语法分析：错误信息与token位置"""
+import pytest
+
+from cnsh_compiler import (
+    ByteLexer, ExpressionStatement, FunctionDeclaration, Identifier, IfStatement, Lexer, LoopStatement,
+    Parser, PrintStatement, ReturnStatement, TextEdit, Token, TokenType, VariableDeclaration,
+    compile_source,
+)
+
+# 源码 -> 期望的错误信息（与逐字符记录行列号的旧实现逐字相同）
+ERRORS = {
+    '整数 x = 1;\n整数 = 2;': "语法错误 (行2): 期望 IDENTIFIER, 但得到 ASSIGN '='",
+    '打印(1\n\n': "语法错误 (行3): 期望 RPAREN, 但得到 EOF 'None'",
+    '函数 f(整数 a) {\n  返回 a\n': "语法错误 (行3): 意外的token EOF 'None'",
+    '\n\n  ) ': "语法错误 (行3): 意外的token RPAREN ')'",
+    '如果 (1) {\n打印(2);\n}': "语法错误 (行1): 期望 LBRACKET, 但得到 LPAREN '('",
+}
+
+# 各种token来源
+TOKEN_SOURCES = {
+    'tokenize': lambda source: Lexer(source).tokenize(),
+    'tokenize_legacy': lambda source: Lexer(source).tokenize_legacy(),
+    'tokenize_stream': lambda source: Lexer(source).tokenize_stream(),
+    'iter_tokens': lambda source: Lexer(source).iter_tokens(),
+    'bytes': lambda source: ByteLexer(source.encode('utf-8')).tokenize(),
+}
+
+
+@pytest.mark.parametrize('make_tokens', TOKEN_SOURCES.values(), ids=list(TOKEN_SOURCES))
+@pytest.mark.parametrize('iterative', [False, True], ids=['recursive', 'iterative'])
+@pytest.mark.parametrize('source, message', ERRORS.items())
+def test_error_message(source, message, make_tokens, iterative):
+    with pytest.raises(SyntaxError) as error:
+        Parser(make_tokens(source), iterative=iterative).parse()
+    assert str(error.value) == message
+
+
+@pytest.mark.parametrize('streaming', [False, True])
+@pytest.mark.parametrize('source, message', ERRORS.items())
+def test_compile_error_message(source, message, streaming):
+    result = compile_source(source, streaming=streaming)
+    assert not result.success
+    assert result.error == message
+
+
+def test_token_line_column():
+    source = '整数 x\n  = 「a\nb」 + 1;'
+    tokens = Lexer(source).tokenize()
+    positions = [(token.value, token.line, token.column) for token in tokens]
+    assert positions == [
+        ('整数', 1, 1), ('x', 1, 4), ('=', 2, 3), ('a\nb', 2, 5),
+        ('+', 3, 4), ('1', 3, 6), (';', 3, 7), (None, 3, 8),
+    ]
+    assert [(token.line, token.column) for token in Lexer(source).tokenize_legacy()] == \
+        [(line, column) for _, line, column in positions]
+
+
+def test_token_line_after_relex():
+    lexer = Lexer('整数 x = 1;\n打印 x')
+    tokens = lexer.tokenize()
+    lexer.relex(tokens, TextEdit(0, 0, '\n\n'))
+    assert [(token.value, token.line) for token in tokens[-3:]] == [('打印', 4), ('x', 4), (None, 4)]
+
+
+def test_token_without_line_index():
+    token = Token(TokenType.IDENTIFIER, 'x', 5)
+    assert token.line is None and token.column is None
+    assert token == Token(TokenType.IDENTIFIER, 'x', 5, Lexer('').lines)
+
+
+# 语句关键字 -> 以它开头的语句解析出的节点类型
+STATEMENTS = {
+    '整数 x = 1': VariableDeclaration,
+    '真假 x': VariableDeclaration,
+    '函数 f(整数 a, 文本 b) 返回类型 整数 { 返回 a }': FunctionDeclaration,
+    '如果【x】{ 打印 1 } 否则 { 打印 2 }': IfStatement,
+    '循环【3】{ x = x + 1 }': LoopStatement,
+    '返回 x;': ReturnStatement,
+    '打印 x': PrintStatement,
+    'x = 1': ExpressionStatement,
+}
+
+
+class BreakParser(Parser):
+    """新增语句只需在分派表加一项并实现解析方法"""
+    STATEMENT_PARSERS = {**Parser.STATEMENT_PARSERS, '跳出': 'parse_break_statement'}
+    
+    def parse_break_statement(self):
+        self.advance()
+        return ExpressionStatement(Identifier('跳出'))
+
+
+@pytest.mark.parametrize('iterative', [False, True], ids=['recursive', 'iterative'])
+@pytest.mark.parametrize('source, node_class', STATEMENTS.items())
+def test_statement_dispatch(source, node_class, iterative):
+    statements = Parser(Lexer(source).tokenize(), iterative=iterative).parse().statements
+    assert [type(statement) for statement in statements] == [node_class]
+
+
+@pytest.mark.parametrize('iterative', [False, True], ids=['recursive', 'iterative'])
+def test_statement_table_extension(iterative):
+    source = '循环【3】{ 如果【x】{ 跳出 } 打印 x }'
+    loop, = BreakParser(Lexer(source).tokenize(), iterative=iterative).parse().statements
+    assert loop.body[0].then_body == [ExpressionStatement(Identifier('跳出'))]
+    # 基类不认识该关键字，当作表达式语句解析后在 } 处报错
+    with pytest.raises(SyntaxError):
+        Parser(Lexer(source).tokenize(), iterative=iterative).parse()
+
+
+def test_operator_tables_cover_operators():
+    # 词法分析器产生的每个运算符token都在优先级表或前缀表里，分隔符等其他token都不在
+    operators = {token.type for token in Lexer('+ - * / % == != > < >= <= && || ! =').tokenize()[:-1]}
+    assert len(operators) == 15
+    assert operators == Parser.BINARY_PRECEDENCE.keys() | Parser.PREFIX_OPERATORS
+    assert Parser.PREFIX_OPERATORS == {TokenType.MINUS, TokenType.NOT}
@@ -0,0 +1,160 @@
+"""编译服务：套接字路径、格式错误的请求、文档锁的释放"""
+import asyncio
+import json
+import socket
+from contextlib import asynccontextmanager
+
+import pytest
+
+from cnsh_compiler import CompileServer
+
+SOURCE = '函数 主函数() 返回类型 整数 {\n  打印 1\n  返回 0\n}\n'
+
+# 编译要花一段时间的源码，用来在编译进行中发送其他请求
+SLOW_SOURCE = '整数 x = 1 + 2 * 3\n' * 30000
+
+
+@asynccontextmanager
+async def running(server, path):
+    """在 path 上运行服务并连接，返回发送请求与读取响应的函数"""
+    serving = asyncio.ensure_future(server.serve(str(path)))
+    # 等服务开始监听（遗留的套接字文件可能还没被替换）
+    for _ in range(500):
+        try:
+            reader, writer = await asyncio.open_unix_connection(str(path), limit=CompileServer.MAX_REQUEST)
+            break
+        except (FileNotFoundError, ConnectionRefusedError):
+            assert not serving.done()
+            await asyncio.sleep(0.01)
+    
+    def send(request):
+        writer.write(json.dumps(request, ensure_ascii=False).encode('utf-8') + b'\n')
+    
+    async def receive():
+        return json.loads(await asyncio.wait_for(reader.readline(), 30))
+    
+    try:
+        yield send, receive
+    finally:
+        writer.close()
+        serving.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await serving
+
+
+def test_refuses_regular_file(tmp_path):
+    path = tmp_path / 'notes.txt'
+    path.write_text('不是套接字')
+    # 误删文件后服务会一直运行下去，限时以免测试挂住
+    with pytest.raises(FileExistsError):
+        asyncio.run(asyncio.wait_for(CompileServer().serve(str(path)), 10))
+    assert path.read_text() == '不是套接字'
+
+
+def test_replaces_stale_socket(tmp_path):
+    path = tmp_path / 's.sock'
+    stale = socket.socket(socket.AF_UNIX)
+    stale.bind(str(path))
+    stale.close()
+    
+    async def main():
+        async with running(CompileServer(), path) as (send, receive):
+            send({'id': 1, 'source': SOURCE})
+            assert (await receive())['success']
+    
+    asyncio.run(main())
+
+
+@pytest.mark.parametrize('document', [['x'], {'a': 1}, 3])
+def test_bad_document(tmp_path, document):
+    async def main():
+        async with running(CompileServer(), tmp_path / 's.sock') as (send, receive):
+            send({'id': 1, 'document': document, 'source': 'a'})
+            response = await receive()
+            assert response['id'] == 1 and not response['success']
+            # 连接仍然可用
+            send({'id': 2, 'document': 'a.cnsh', 'source': SOURCE})
+            response = await receive()
+            assert response['id'] == 2 and response['success']
+    
+    asyncio.run(main())
+
+
+def test_locks_released(tmp_path):
+    server = CompileServer(max_documents=4)
+    
+    async def main():
+        async with running(server, tmp_path / 's.sock') as (send, receive):
+            for index in range(20):
+                send({'id': index, 'document': f'{index}.cnsh', 'source': SOURCE})
+                assert (await receive())['success']
+            assert len(server.documents) == 4
+            send({'id': 20, 'op': 'close', 'document': '19.cnsh'})
+            assert (await receive())['success']
+    
+    asyncio.run(main())
+    assert server.locks == {} and server.lock_users == {}
+    assert list(server.documents) == ['16.cnsh', '17.cnsh', '18.cnsh']
+
+
+def test_close_during_compile(tmp_path):
+    server = CompileServer()
+    
+    async def main():
+        async with running(server, tmp_path / 's.sock') as (send, receive):
+            send({'id': 1, 'document': 'a.cnsh', 'source': SLOW_SOURCE})
+            # 等编译线程开始后再关闭文档
+            while 'a.cnsh' not in server.locks or not server.locks['a.cnsh'].locked():
+                await asyncio.sleep(0.001)
+            send({'id': 2, 'op': 'close', 'document': 'a.cnsh'})
+            responses = {}
+            for _ in range(2):
+                response = await receive()
+                responses[response['id']] = response
+            assert responses[1].get('cancelled')
+            assert responses[2]['success']
+            # 关闭等编译结束才释放，编译结果不会再被放回
+            assert server.documents == {}
+    
+    asyncio.run(main())
+    assert server.locks == {}
+
+
+def test_superseded_before_start(tmp_path):
+    # 同一次读到的多个请求：被取代的请求还没开始执行，也要回复 cancelled
+    async def main():
+        async with running(CompileServer(), tmp_path / 's.sock') as (send, receive):
+            for index in range(5):
+                send({'id': index, 'document': 'a.cnsh', 'source': SOURCE})
+            send({'id': 5, 'op': 'close', 'document': 'a.cnsh'})
+            responses = sorted([await receive() for _ in range(6)], key=lambda response: response['id'])
+            assert [response['id'] for response in responses] == list(range(6))
+            assert all(response.get('cancelled') for response in responses[:5])
+            assert responses[5]['success']
+    
+    asyncio.run(main())
+
+
+def test_compile_error(tmp_path):
+    # 输入到一半的类型名（“整”）在代码生成时出错：照样回复，文档状态保留
+    server = CompileServer()
+    
+    async def main():
+        async with running(server, tmp_path / 's.sock') as (send, receive):
+            send({'id': 1, 'document': 'a.cnsh', 'source': SOURCE})
+            assert (await receive())['success']
+            send({'id': 2, 'document': 'a.cnsh', 'source': SOURCE.replace('整数', '整')})
+            response = await receive()
+            assert response['id'] == 2 and not response['success'] and 'KeyError' in response['error']
+            assert 'a.cnsh' in server.documents
+            send({'id': 3, 'document': 'a.cnsh', 'source': SOURCE, 'code': True})
+            response = await receive()
+            assert response['id'] == 3 and response['success']
+            assert response['c_code'] == CompileServer().compile_document(None, SOURCE)['c_code']
+            # 新文档一开始就出错也一样
+            send({'id': 4, 'document': 'b.cnsh', 'source': '函数 f() 返回类型 x { }'})
+            response = await receive()
+            assert response['id'] == 4 and not response['success']
+            assert 'b.cnsh' in server.documents
+    
+    asyncio.run(main())
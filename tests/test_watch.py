@@ -0,0 +1,147 @@
+"""文件监视：轮询与 inotify 发现改动；C代码未变时不重写输出"""
+import os
+import select
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+from cnsh_compiler import SourceWatcher
+
+COMPILER = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'cnsh_compiler.py')
+
+SOURCE = '函数 主函数() 返回类型 整数 {\n  打印 1\n  返回 0\n}\n'
+
+
+@pytest.fixture
+def tree(tmp_path):
+    """目录里有一个源文件、一个子目录和一个不相关的文件"""
+    (tmp_path / 'a.cnsh').write_text(SOURCE, encoding='utf-8')
+    (tmp_path / 'sub').mkdir()
+    (tmp_path / 'notes.txt').write_text('')
+    return tmp_path
+
+
+def edit(tree):
+    """改动源文件、新建子目录中的源文件，并改动不相关的文件"""
+    (tree / 'a.cnsh').write_text(SOURCE + '打印 2\n', encoding='utf-8')
+    (tree / 'sub' / 'b.cnsh').write_text(SOURCE, encoding='utf-8')
+    (tree / 'notes.txt').write_text('不监视')
+
+
+def test_polling(tree):
+    watcher = SourceWatcher([str(tree)], poll=True, interval=0.01)
+    assert watcher.backend.startswith('轮询')
+    assert watcher.sources() == [str(tree / 'a.cnsh')]
+    edit(tree)
+    assert watcher.wait() == [str(tree / 'a.cnsh'), str(tree / 'sub' / 'b.cnsh')]
+    # 删除的文件不算变化
+    (tree / 'sub' / 'b.cnsh').unlink()
+    (tree / 'a.cnsh').write_text(SOURCE, encoding='utf-8')
+    assert watcher.wait() == [str(tree / 'a.cnsh')]
+
+
+def test_single_file_polling(tree):
+    path = str(tree / 'a.cnsh')
+    watcher = SourceWatcher([], [path], poll=True, interval=0.01)
+    edit(tree)
+    assert watcher.wait() == [path]
+
+
+def test_inotify(tree):
+    watcher = SourceWatcher([str(tree)])
+    if watcher.backend != 'inotify':
+        pytest.skip('inotify 不可用')
+    try:
+        edit(tree)
+        assert watcher.wait() == [str(tree / 'a.cnsh'), str(tree / 'sub' / 'b.cnsh')]
+    finally:
+        watcher.close()
+
+
+def test_inotify_fallback(tree, capsys):
+    # inotify 中途出错时改为轮询；警告留给调用方报告，监视类本身不输出
+    watcher = SourceWatcher([str(tree)], interval=0.01)
+    if watcher.backend != 'inotify':
+        pytest.skip('inotify 不可用')
+    
+    def fail():
+        raise OSError(28, '监视数已达上限')
+    
+    watcher.wait_inotify = fail
+    # 改为轮询后才改动文件
+    path = tree / 'a.cnsh'
+    timer = threading.Timer(0.2, path.write_text, (SOURCE + '打印 2\n',), {'encoding': 'utf-8'})
+    timer.start()
+    try:
+        assert watcher.wait() == [str(path)]
+    finally:
+        timer.join()
+    assert watcher.backend.startswith('轮询') and watcher.fd is None
+    assert watcher.warnings == ['inotify 不可用（[Errno 28] 监视数已达上限），改为轮询，每0.01秒']
+    assert capsys.readouterr().out == ''
+
+
+class Output:
+    """逐步读取子进程的标准输出"""
+    
+    def __init__(self, process):
+        self.process = process
+        self.text = ''
+        self.position = 0
+    
+    def until(self, expected, timeout=30):
+        """读到 expected 出现为止，返回上次读到处到 expected 末尾的输出"""
+        data = b''
+        deadline = time.monotonic() + timeout
+        while expected not in self.text[self.position:]:
+            remaining = deadline - time.monotonic()
+            assert remaining > 0, self.text
+            ready, _, _ = select.select([self.process.stdout], [], [], remaining)
+            if ready:
+                chunk = os.read(self.process.stdout.fileno(), 1 << 16)
+                assert chunk, self.text
+                data += chunk
+                try:
+                    self.text += data.decode('utf-8')
+                    data = b''
+                except UnicodeDecodeError:
+                    continue
+        end = self.text.index(expected, self.position) + len(expected)
+        output, self.position = self.text[self.position:end], end
+        return output
+    
+    def build_line(self, output_path):
+        """读到输出文件为 output_path 的下一条构建结果（整行），返回其前的全部输出"""
+        return self.until(f' -> {output_path}（') + self.until('\n')
+
+
+def test_watch_command(tree):
+    output_path = tree / 'a.c'
+    process = subprocess.Popen(
+        [sys.executable, '-u', COMPILER, 'watch', str(tree), '--poll', '--interval', '0.05',
+         '--cache-dir', str(tree / '.cache')],
+        stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    output = Output(process)
+    try:
+        assert '监视 1 个文件' in output.build_line(output_path)
+        written = output_path.stat().st_mtime_ns
+        expected = output_path.read_text(encoding='utf-8')
+        
+        # 只加注释：C代码未变，不重写 .c，下游的构建不会被触发
+        (tree / 'a.cnsh').write_text('# 注释\n' + SOURCE, encoding='utf-8')
+        assert 'C代码未变，未重写' in output.build_line(output_path)
+        assert output_path.stat().st_mtime_ns == written
+        assert output_path.read_text(encoding='utf-8') == expected
+        
+        (tree / 'a.cnsh').write_text(SOURCE + '打印 2\n', encoding='utf-8')
+        assert '未重写' not in output.build_line(output_path)
+        assert output_path.read_text(encoding='utf-8') != expected
+    finally:
+        process.send_signal(signal.SIGINT)
+        process.wait(10)
+    assert '停止监视' in output.text + process.stdout.read().decode('utf-8')
+    assert process.returncode == 0
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""编译器各阶段的基准测试：用固定种子生成程序，取多次运行的最短耗时
+
+用法: python3 tools/benchmark.py [基准名 ...] [--repeat 次数] [--scale 倍数]
+"""
+import argparse
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cnsh_compiler import CCodeGenerator, Lexer, Parser, compile_source  # noqa: E402
+
+
+def best_time(function, repeat: int) -> float:
+    """多次运行取最短耗时（秒）"""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def statement_program(rng: random.Random, functions: int) -> str:
+    """语句密集的程序：许多函数，每个函数十来条各种语句"""
+    statements = [
+        '整数 丙 = 甲',
+        '文本 丁 = 「x」',
+        '丙 = 丙 + 1',
+        '打印 丙',
+        '返回 丙',
+        '如果【丙】{ 打印 甲 } 否则 { 返回 乙 }',
+        '循环【3】{ 丙 = 丙 * 2 }',
+    ]
+    lines = []
+    for index in range(functions):
+        lines.append(f'函数 函数{index}(整数 甲, 小数 乙) 返回类型 整数 {{')
+        lines.extend('  ' + rng.choice(statements) for _ in range(10))
+        lines.append('}')
+    return '\n'.join(lines) + '\n'
+
+
+def bench_statements(rng: random.Random, scale: float, repeat: int) -> str:
+    """语句分派：语句密集程序的语法分析"""
+    tokens = Lexer(statement_program(rng, int(3000 * scale))).tokenize()
+    seconds = best_time(lambda: Parser(tokens).parse(), repeat)
+    return f'{len(tokens)} 个token，语法分析 {seconds:.3f} 秒'
+
+
+def bench_nesting(rng: random.Random, scale: float, repeat: int) -> str:
+    """迭代模式：深层嵌套的语句块与表达式，层数翻倍时耗时应大致翻倍"""
+    results = []
+    for depth in (int(10000 * scale), int(20000 * scale)):
+        blocks = '如果【a】{ 循环【2】{ ' * depth + '打印 x' + ' }}' * depth
+        expression = '整数 z = ' + '-(' * depth + 'f(a, (b + ' * depth + '1' + '))' * depth + ')' * depth
+        tokens = Lexer(blocks + '\n' + expression).tokenize()
+        parse_seconds = best_time(lambda: Parser(tokens, iterative=True).parse(), repeat)
+        program = Parser(tokens, iterative=True).parse()
+        generator = CCodeGenerator(program, iterative=True)
+        value = program.statements[-1].value
+        generate_seconds = best_time(lambda: generator.generate_expression(value), repeat)
+        results.append(f'{depth} 层：语法分析 {parse_seconds:.3f} 秒，表达式生成 {generate_seconds:.3f} 秒')
+    return '；'.join(results)
+
+
+def bench_loops(rng: random.Random, scale: float, repeat: int) -> str:
+    """循环次数只求值一次：次数调用一个耗时函数，gcc -O0 编译后的运行时间"""
+    gcc = shutil.which('gcc')
+    if gcc is None:
+        return '跳过（需要gcc）'
+    steps = int(20000 * scale)
+    source = (
+        f'函数 次数() 返回类型 整数 {{ 整数 总 = 0 循环【{steps}】{{ 总 = 总 + 1 }} 返回 总 }}\n'
+        '函数 主函数() 返回类型 整数 { 整数 和 = 0 循环【次数()】{ 和 = 和 + 1 } 打印 和 返回 0 }\n'
+    )
+    with tempfile.TemporaryDirectory() as directory:
+        source_path = os.path.join(directory, 'loops.c')
+        executable = os.path.join(directory, 'loops')
+        with open(source_path, 'w', encoding='utf-8') as f:
+            f.write(compile_source(source).c_code)
+        subprocess.run([gcc, '-w', '-O0', source_path, '-o', executable], check=True)
+        seconds = best_time(lambda: subprocess.run([executable], check=True, stdout=subprocess.DEVNULL), repeat)
+    return f'次数函数循环 {steps} 步，运行 {seconds:.3f} 秒'
+
+
+# 基准名 -> 函数(随机数发生器, 规模倍数, 重复次数)，返回一行结果说明
+BENCHMARKS = {
+    'statements': bench_statements,
+    'nesting': bench_nesting,
+    'loops': bench_loops,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='CNSH编译器基准测试')
+    parser.add_argument('names', nargs='*', metavar='基准名',
+                        help='要运行的基准（默认全部）：' + '、'.join(BENCHMARKS))
+    parser.add_argument('--repeat', type=int, default=5, help='每项重复次数，取最短耗时')
+    parser.add_argument('--scale', type=float, default=1.0, help='程序规模倍数')
+    parser.add_argument('--seed', type=int, default=0, help='生成程序的随机种子')
+    args = parser.parse_args()
+    unknown = [name for name in args.names if name not in BENCHMARKS]
+    if unknown:
+        parser.error('未知的基准：' + '、'.join(unknown))
+    
+    for name in args.names or BENCHMARKS:
+        result = BENCHMARKS[name](random.Random(args.seed), args.scale, args.repeat)
+        print(f'{name:12} {result}')
+
+
+if __name__ == '__main__':
+    main()